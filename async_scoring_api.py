@@ -0,0 +1,561 @@
+import asyncio
+import time
+
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Tuple
+
+import httpx
+
+from cache import get_response_cache, invalidate_cached
+from decoding import decode_response
+from models import *
+from scheduler import current_scheduler
+from scoring_api import prepare_request, check_response_code, get_token_manager
+from streaming import MultipartFileStream, ProgressCallback, DEFAULT_CHUNK_SIZE
+from tasks import async_wait_for_task
+from tokens import TokenManager
+from tracing import traced, trace_call, get_tracer
+from transport import timing_from_trace
+
+
+class AsyncScoringApi:
+    """
+    Asyncio mirror of scoring_api endpoint wrappers
+
+    All calls share one connection pool, the number of requests in flight is bounded by max_concurrency:
+
+        async with AsyncScoringApi(max_concurrency=200) as api:
+            datasets = await api.get_datasets_list()
+            models = await asyncio.gather(*[api.get_dataset_result_model(item.dataset_id) for item in datasets])
+
+    Tokens come from scoring_api.get_token_manager() unless token_manager is given.
+    """
+    def __init__(self, max_concurrency: int = 100, max_connections: int = None, http2: bool = False,
+                 timeout: float = None, token_manager: TokenManager = None):
+        self.max_concurrency = max_concurrency
+        self.token_manager = token_manager
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        limits = httpx.Limits(max_connections=max_connections or max_concurrency,
+                              max_keepalive_connections=max_connections or max_concurrency)
+        self._client = httpx.AsyncClient(limits=limits, http2=http2, timeout=timeout)
+
+    async def __aenter__(self) -> "AsyncScoringApi":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self._client.aclose()
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a raw request through the shared pool, waiting for a free concurrency slot
+        """
+        if "allow_redirects" in kwargs:
+            kwargs["follow_redirects"] = kwargs.pop("allow_redirects")
+        if kwargs.get("json") is None:
+            kwargs.pop("json", None)
+        async with self._semaphore:
+            if get_tracer() is None:
+                return await self._client.request(method, url, **kwargs)
+            marks = {}
+
+            async def trace(event_name, info):
+                marks[event_name] = time.perf_counter()
+
+            kwargs.setdefault("extensions", {})["trace"] = trace
+            started = time.perf_counter()
+            response = await self._client.request(method, url, **kwargs)
+            response.timing = timing_from_trace(method, url, response.status_code, marks, started,
+                                                time.perf_counter() - started)
+            return response
+
+    async def send_request(self, url: str, method: str, query_params: dict = None,
+                           body_parameters: Union[Dict, Tuple, List, BaseModel] = None, headers: dict = None,
+                           files: dict = None, data: dict = None, expected_code: Union[str, int] = None,
+                           check_code=True, allow_redirects=True, token: str = None,
+                           cache: bool = False) -> httpx.Response:
+        started = time.perf_counter()
+        token_manager = self.token_manager or get_token_manager()
+        managed = not token and "refresh" not in url and "Authorization" not in (headers or {})
+        if managed:
+            token = await token_manager.get_async(self.refresh_access_token)
+        elif not token and "refresh" in url:
+            token = token_manager.refresh_token
+        request_parameters = prepare_request(url, query_params, body_parameters, headers, files, data,
+                                             allow_redirects, token)
+        response_cache = get_response_cache() if cache and method.lower() == "get" and expected_code in (None, 200) \
+            else None
+        if response_cache is not None:
+            key = response_cache.key(request_parameters['url'], request_parameters['params'],
+                                     request_parameters['headers'])
+            generation = response_cache.generation()
+            response, entry = response_cache.lookup(key)
+            if response is not None:
+                trace_call(method, request_parameters['url'], started, response=response)
+                return response
+            if entry is not None:
+                request_parameters['headers']['If-None-Match'] = entry.etag
+        scheduler = current_scheduler()
+        response = await scheduler.send_async(self.request, method.lower(), request_parameters, expected_code)
+        if managed and response.status_code == 401 and expected_code != 401:
+            request_parameters['headers']['Authorization'] = await token_manager.invalidate_async(
+                token, self.refresh_access_token)
+            response = await scheduler.send_async(self.request, method.lower(), request_parameters, expected_code)
+        sent = response
+        if response_cache is not None:
+            if response.status_code == 304 and entry is not None:
+                response = response_cache.revalidated(key, entry, generation)
+            elif response.status_code == 200:
+                response_cache.store(response_cache.key(request_parameters['url'], request_parameters['params'],
+                                                        request_parameters['headers']), response, generation)
+        trace_call(method, request_parameters['url'], started, sent, response)
+        if check_code:
+            check_response_code(response, expected_code)
+        return response
+
+    @traced
+    async def refresh_access_token(self, refresh_token: str) -> str:
+        response = await self.send_request("/api/authorization/refresh", "post", token=refresh_token)
+        return f"Bearer {RefreshResponse(**decode_response(response)).access_token}"
+
+    # -------------------------
+    # AUTHORIZATION ENDPOINTS
+    # -------------------------
+
+    @traced
+    async def authorization_me_get(self, token=None, expected_code=None) -> UserResponse:
+        """
+        Test User
+        """
+        url = f"/api/authorization/me"
+        method = "get"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code, token=token, cache=True)
+        try:
+            result_object = decode_response(response)
+            result_object = UserResponse(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def authorization_refresh_get(self, expected_code=None) -> RefreshResponse:
+        """
+        Refresh Jwt Token
+        """
+        url = f"/api/authorization/refresh"
+        method = "post"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        try:
+            result_object = decode_response(response)
+            result_object = RefreshResponse(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def authorization_name_patch(self, name, expected_code):
+        """
+        Rename User
+        """
+        url = f"/api/authorization/name"
+        method = "patch"
+        query = {"name": name}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/authorization/me")
+        try:
+            result_object = decode_response(response)
+            result_object = UserResponse(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    # ---------------------------
+    # UPLOAD AND TASKS ENDPOINTS
+    # ---------------------------
+
+    @traced
+    async def upload_datasets_upload_params_get(self, filename: str, expected_code=None) -> UploadParams:
+        """
+        Dataset Upload Params
+        """
+        url = f"/api/upload/datasets/upload_params"
+        method = "get"
+        query = {"filename": filename}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        try:
+            result_object = decode_response(response)
+            result_object = UploadParams(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def upload_datasets_validate_post(self, request_body: ValidateDataset, expected_code=None) -> Task:
+        """
+        Dataset Validate
+        """
+        url = f"/api/upload/datasets/validate"
+        method = "post"
+        query = None
+        body_parameters = request_body
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", "/api/authorization/me")
+        try:
+            result_object = decode_response(response, Task)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def task_task_id_status_get(self, task_id: str, expected_code=None, wait: float = None) -> Task:
+        """
+        Task Status
+        wait: seconds the server may hold the request until the status changes (long-poll)
+        """
+        url = f"/api/task/{task_id}/status"
+        method = "get"
+        query = {"wait": wait}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        try:
+            result_object = decode_response(response, Task)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def task_task_id_result_get(self, task_id: str, expected_code=None) -> Task:
+        """
+        Task Result Status
+        """
+        url = f"/api/task/{task_id}/result"
+        method = "get"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        try:
+            result_object = decode_response(response, Task)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def upload_file_to_bucket(self, upload_params: UploadParams, filename: str, path_to_file: Path,
+                                    chunk_size: int = DEFAULT_CHUNK_SIZE, progress: ProgressCallback = None):
+        """
+        Stream file to the presigned bucket URL from upload params
+        The file is read in a worker thread, other calls go on while it's on a slow disk; progress is called there too
+        """
+        stream = MultipartFileStream(upload_params.data["fields"], "file", filename, path_to_file,
+                                     chunk_size=chunk_size, progress=progress)
+
+        async def body():
+            chunks = iter(stream)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+
+        started = time.perf_counter()
+        response = await self.request("post", upload_params.data["url"], content=body(), headers=stream.headers)
+        trace_call("post", upload_params.data["url"], started, response, response)
+        assert response.status_code == 204, \
+            f"Uploading file to bucket returned unexpected code: {response.content}"
+
+    @traced
+    async def upload_dataset(self, filename: str, path_to_file: Path, timeout: int = 300) -> Task:
+        """
+        Upload dataset using new mechanism
+        """
+        upload_params = await self.upload_datasets_upload_params_get(filename)
+        await self.upload_file_to_bucket(upload_params, filename, path_to_file)
+
+        validate_dataset = ValidateDataset(filepath=upload_params.data["fields"]["key"])
+        task = await self.upload_datasets_validate_post(validate_dataset)
+        await async_wait_for_task(task.id, self.task_task_id_status_get, timeout=timeout)
+        task_result = await self.task_task_id_result_get(task.id)
+        invalidate_cached("/api/datasets", "/api/authorization/me")
+        return task_result
+
+    # ---------------------------
+    # DATASET ENDPOINTS
+    # ---------------------------
+
+    @traced
+    async def get_datasets_list(self, limit: int = None, expected_code=None) -> List[DatasetExtendedCardOut]:
+        """
+        Datasets List
+        """
+        url = f"/api/datasets"
+        method = "get"
+        query = {"limit": limit}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code, cache=True)
+        try:
+            result_object = decode_response(response, DatasetExtendedCardOut, many=True)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def get_dataset_result_model(self, dataset_id: str, page: int = None, per_page: int = None,
+                                       sort: str = None, order: str = None, expected_code=None) -> ResultModel:
+        """
+        Get Dataset
+        """
+        url = f"/api/datasets/{dataset_id}/result_model"
+        method = "get"
+        query = {"page": page,
+                 "per_page": per_page,
+                 "sort": sort,
+                 "order": order}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code, cache=True)
+        try:
+            result_object = decode_response(response, ResultModel)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def get_dataset_result_model_json(self, dataset_id: str, page: int = None, per_page: int = None,
+                                            sort: str = None, order: str = None, expected_code=None) -> Dict:
+        """
+        Get Dataset without building ResultModel, returns the decoded JSON
+        """
+        url = f"/api/datasets/{dataset_id}/result_model"
+        method = "get"
+        query = {"page": page,
+                 "per_page": per_page,
+                 "sort": sort,
+                 "order": order}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code, cache=True)
+        try:
+            result_object = decode_response(response)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def delete_dataset(self, dataset_id: str, expected_code=None) -> Dict:
+        """
+        Dataset Delete
+        """
+        url = f"/api/datasets/{dataset_id}"
+        method = "delete"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", "/api/authorization/me")
+        invalidate_cached(f"/api/datasets/{dataset_id}", subtree=True)
+        try:
+            result_object = decode_response(response)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def restore_dataset(self, dataset_id: str, expected_code=None) -> Dict:
+        """
+        Restore Dataset
+        """
+        url = f"/api/datasets/{dataset_id}/restore"
+        method = "post"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", "/api/authorization/me")
+        invalidate_cached(f"/api/datasets/{dataset_id}", subtree=True)
+        try:
+            result_object = decode_response(response)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    # ---------------------------
+    # SCORING ENDPOINTS
+    # ---------------------------
+
+    @traced
+    async def scoring_template_post(self, request_body: PostScoringTemplate, expected_code=None) -> CreateResponse:
+        """
+        Add Scoring Template
+        """
+        url = f"/api/scoring"
+        method = "post"
+        query = None
+        body_parameters = request_body
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets")
+        invalidate_cached(f"/api/datasets/{request_body.dataset_id}", subtree=True)
+        try:
+            result_object = decode_response(response)
+            result_object = CreateResponse(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def scoring_template_delete(self, template_id: str, expected_code=None):
+        """
+        Delete Scoring Template
+        """
+        url = f"/api/scoring/{template_id}"
+        method = "delete"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", subtree=True)
+        try:
+            result_object = decode_response(response)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def scoring_template_properties_post(self, request_body: RequestTemplateProperty, template_id: str,
+                                               expected_code=None) -> CreateResponse:
+        """
+        Add Template Property
+        """
+        url = f"/api/scoring/{template_id}/template_properties"
+        method = "post"
+        query = None
+        body_parameters = request_body
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", subtree=True)
+        try:
+            result_object = decode_response(response)
+            result_object = CreateResponse(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def scoring_template_properties_delete(self, template_id: str, template_property_id: str,
+                                                 expected_code=None):
+        """
+        Delete Template Property
+        """
+        url = f"/api/scoring/{template_id}/template_properties/{template_property_id}"
+        method = "delete"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", subtree=True)
+        try:
+            result_object = decode_response(response)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def scored_dataset_post(self, dataset_id: str, template_id: str, expected_code=None) -> CreateResponse:
+        """
+        Add Scored Dataset
+        """
+        url = f"/api/scored_dataset"
+        method = "post"
+        query = {"dataset_id": dataset_id,
+                 "template_id": template_id}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets")
+        invalidate_cached(f"/api/datasets/{dataset_id}", subtree=True)
+        try:
+            result_object = decode_response(response)
+            result_object = CreateResponse(**result_object)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    @traced
+    async def scored_dataset_delete(self, scored_dataset_id: str, expected_code=None):
+        """
+        Delete Scored Dataset
+        """
+        url = f"/api/scored_dataset/{scored_dataset_id}"
+        method = "delete"
+        query = None
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code)
+        invalidate_cached("/api/datasets", subtree=True)
+        try:
+            result_object = decode_response(response)
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
+
+    # ---------------------------
+    # USER FEEDBACK ENDPOINTS
+    # ---------------------------
+
+    @traced
+    async def feedback_get(self, after: str, before: str, expected_code=None) -> Dict:
+        """
+        Get the list with users feedbacks
+        after: date to filter feedbacks - include posted after this date (inclusive)
+        before: date to filter feedbacks - include posted before this date (exclusive)
+            date format: yyyy-mm-dd
+        """
+        url = f"/api/feedback/user-feedback"
+        method = "get"
+        query = {"after": after,
+                 "before": before}
+        body_parameters = None
+        file = None
+        response = await self.send_request(url, method, query, body_parameters, files=file,
+                                           expected_code=expected_code, cache=True)
+        try:
+            result_object = decode_response(response)
+            result_object = [UserFeedback(**item) for item in result_object]
+        except JSONDecodeError:
+            result_object = response.content
+        return result_object
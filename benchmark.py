@@ -0,0 +1,330 @@
+import argparse
+import itertools
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Callable, Iterable, Tuple
+
+import numpy
+from pydantic import BaseModel, Field
+
+import scoring_api
+import transport
+from datagen import generate_dataset, column_ranges, column_functions
+from models import PostScoringTemplate, RequestTemplateProperty, DesirabilityFunctionTypes
+
+OPERATIONS = ("datasets_list", "result_model", "upload", "score")
+NAME_PREFIX = "Auto-bench"
+
+
+class Scenario(BaseModel):
+    operation: str = Field(..., title='One of OPERATIONS')
+    rows: int = Field(100, title='Rows of the benchmarked dataset')
+    columns: int = Field(3, title='Value columns of the benchmarked dataset')
+    per_page: int = Field(25, title='Page size of result_model')
+    sort: Optional[str] = Field(None, title='Sort column of result_model')
+    order: Optional[str] = Field("asc", title='Sort order of result_model')
+    concurrency: int = Field(1, title='Calls in flight')
+    warmup: int = Field(3, title='Calls before measuring')
+    repeats: int = Field(30, title='Measured calls')
+    transport: Dict[str, Any] = Field({}, title='configure_transport() arguments')
+
+    @property
+    def name(self) -> str:
+        name = f"{self.operation}[rows={self.rows},columns={self.columns},concurrency={self.concurrency}"
+        if self.operation == "result_model":
+            name += f",per_page={self.per_page},sort={self.sort},order={self.order}"
+        if self.transport:
+            name += "," + ",".join(f"{key}={value}" for key, value in sorted(self.transport.items()))
+        return name + "]"
+
+
+class ScenarioResult(BaseModel):
+    name: str = Field(..., title='Scenario name')
+    scenario: Scenario
+    calls: int = Field(0, title='Measured calls')
+    errors: int = Field(0, title='Failed calls')
+    p50: float = Field(0, title='Median latency, seconds')
+    p95: float = Field(0, title='95th percentile latency, seconds')
+    p99: float = Field(0, title='99th percentile latency, seconds')
+    mean: float = Field(0, title='Mean latency, seconds')
+    rps: float = Field(0, title='Calls per second')
+    wall_time: float = Field(0, title='Seconds')
+    first_error: Optional[str] = Field(None, title='First error')
+
+
+class Regression(BaseModel):
+    name: str
+    metric: str
+    baseline: float
+    actual: float
+
+    def __str__(self):
+        return f"{self.name}: {self.metric} {self.actual * 1000:.1f} ms > baseline {self.baseline * 1000:.1f} ms"
+
+
+class BenchmarkReport(BaseModel):
+    environment: str = Field(..., title='Benchmarked host')
+    started_at: str = Field(..., title='Start time, ISO format')
+    results: List[ScenarioResult] = Field([], title='Results')
+
+    def save(self, path: Path):
+        Path(path).write_text(self.json(indent=2))
+
+    @classmethod
+    def load(cls, path: Path) -> "BenchmarkReport":
+        return cls(**json.loads(Path(path).read_text()))
+
+    def compare(self, baseline: "BenchmarkReport", tolerance: float = 0.2,
+                metrics: Iterable[str] = ("p50", "p95")) -> List[Regression]:
+        """
+        Scenarios slower than the same baseline scenarios by more than tolerance (share of the baseline value)
+        """
+        baseline_results = {item.name: item for item in baseline.results}
+        regressions = []
+        for result in self.results:
+            expected = baseline_results.get(result.name)
+            if expected is None:
+                continue
+            for metric in metrics:
+                if getattr(result, metric) > getattr(expected, metric) * (1 + tolerance):
+                    regressions.append(Regression(name=result.name, metric=metric, baseline=getattr(expected, metric),
+                                                  actual=getattr(result, metric)))
+        return regressions
+
+    def table(self) -> str:
+        lines = [f"{'scenario':<90} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>9} {'errors':>7}"]
+        for item in self.results:
+            lines.append(f"{item.name:<90} {item.p50 * 1000:>9.1f} {item.p95 * 1000:>9.1f} {item.p99 * 1000:>9.1f} "
+                         f"{item.rps:>9.1f} {item.errors:>7}")
+        return "\n".join(lines)
+
+
+def scenario_matrix(operations: Iterable[str] = OPERATIONS, rows: Iterable[int] = (100,),
+                    per_page: Iterable[int] = (25,), sorts: Iterable[Optional[str]] = (None,),
+                    orders: Iterable[str] = ("asc",), concurrency: Iterable[int] = (1,), **common) -> List[Scenario]:
+    """
+    Scenarios for every combination of parameters, page parameters only multiply result_model scenarios
+    """
+    scenarios = []
+    for operation, rows_num, workers in itertools.product(operations, rows, concurrency):
+        assert operation in OPERATIONS, f"Unknown operation {operation}, use one of {OPERATIONS}"
+        if operation == "result_model":
+            for page_size, sort, order in itertools.product(per_page, sorts, orders):
+                scenarios.append(Scenario(operation=operation, rows=rows_num, concurrency=workers,
+                                          per_page=page_size, sort=sort, order=order, **common))
+        else:
+            scenarios.append(Scenario(operation=operation, rows=rows_num, concurrency=workers, **common))
+    return scenarios
+
+
+class BenchmarkFixtures:
+    """
+    Datasets and templates scenarios run against, created once per dataset size and removed by cleanup()
+    """
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.files: Dict[Tuple[int, int], Path] = {}
+        self.datasets: Dict[Tuple[int, int], str] = {}
+        self.templates: Dict[Tuple[int, int], str] = {}
+        self.created_datasets: List[str] = []
+        self.created_templates: List[Tuple[str, str]] = []
+        self.created_scored_datasets: List[str] = []
+        self._lock = threading.Lock()
+
+    def file(self, rows: int, columns: int) -> Path:
+        if (rows, columns) not in self.files:
+            self.files[rows, columns] = generate_dataset(self.directory / f"bench_{rows}_{columns}.csv", rows, columns,
+                                                         parameters_in_every_row=False)
+        return self.files[rows, columns]
+
+    def dataset(self, rows: int, columns: int) -> str:
+        if (rows, columns) not in self.datasets:
+            task = scoring_api.upload_dataset(f"{NAME_PREFIX}-{uuid.uuid4()}.csv", self.file(rows, columns))
+            self.datasets[rows, columns] = task.result.dataset_id
+            self.created_datasets.append(task.result.dataset_id)
+        return self.datasets[rows, columns]
+
+    def template(self, rows: int, columns: int) -> str:
+        if (rows, columns) not in self.templates:
+            dataset_id = self.dataset(rows, columns)
+            request = PostScoringTemplate(name=f"{NAME_PREFIX}-{uuid.uuid4().hex[:8]}", dataset_id=dataset_id)
+            template_id = scoring_api.scoring_template_post(request, expected_code=201).created_id
+            center, spread = column_ranges(columns)[0]
+            function = column_functions(center, spread)[DesirabilityFunctionTypes.logarithmic]
+            template_property = RequestTemplateProperty(column_name="Column_1", enabled_for_scoring=True, importance=1,
+                                                        desirability_function=function)
+            property_id = scoring_api.scoring_template_properties_post(template_property, template_id,
+                                                                       expected_code=201).created_id
+            self.templates[rows, columns] = template_id
+            self.created_templates.append((template_id, property_id))
+        return self.templates[rows, columns]
+
+    def scored_dataset(self, rows: int, columns: int) -> str:
+        dataset_id = self.dataset(rows, columns)
+        scored_dataset_id = scoring_api.scored_dataset_post(dataset_id, self.template(rows, columns),
+                                                            expected_code=201).created_id
+        with self._lock:
+            self.created_scored_datasets.append(scored_dataset_id)
+        return scored_dataset_id
+
+    def upload(self, rows: int, columns: int) -> str:
+        dataset_id = scoring_api.upload_dataset(f"{NAME_PREFIX}-{uuid.uuid4()}.csv",
+                                                self.file(rows, columns)).result.dataset_id
+        with self._lock:
+            self.created_datasets.append(dataset_id)
+        return dataset_id
+
+    def cleanup(self):
+        for scored_dataset_id in self.created_scored_datasets:
+            scoring_api.scored_dataset_delete(scored_dataset_id, expected_code=204)
+        for template_id, property_id in self.created_templates:
+            scoring_api.scoring_template_properties_delete(template_id, property_id, expected_code=204)
+            scoring_api.scoring_template_delete(template_id, expected_code=204)
+        for dataset_id in self.created_datasets:
+            scoring_api.delete_dataset(dataset_id, expected_code=204)
+
+
+def _operation(scenario: Scenario, fixtures: BenchmarkFixtures) -> Callable[[random.Random], Any]:
+    if scenario.operation == "datasets_list":
+        return lambda rng: scoring_api.get_datasets_list()
+    if scenario.operation == "result_model":
+        dataset_id = fixtures.dataset(scenario.rows, scenario.columns)
+        if scenario.sort == "Scored_column":
+            fixtures.scored_dataset(scenario.rows, scenario.columns)
+        pages = max(1, -(-scenario.rows // scenario.per_page))
+        return lambda rng: scoring_api.get_dataset_result_model(dataset_id, page=rng.randint(1, pages),
+                                                                per_page=scenario.per_page, sort=scenario.sort,
+                                                                order=scenario.order)
+    if scenario.operation == "upload":
+        return lambda rng: fixtures.upload(scenario.rows, scenario.columns)
+    if scenario.operation == "score":
+        fixtures.template(scenario.rows, scenario.columns)
+        return lambda rng: fixtures.scored_dataset(scenario.rows, scenario.columns)
+    raise ValueError(f"Unknown operation {scenario.operation}")
+
+
+def run_scenario(scenario: Scenario, fixtures: BenchmarkFixtures, seed: int = 0) -> ScenarioResult:
+    """
+    Run warmup calls, then `repeats` measured calls with `concurrency` calls in flight
+    """
+    if not scenario.transport:
+        return _measure(scenario, fixtures, seed)
+    # the shared transport is put back afterwards, along with its pooled connections
+    previous = transport.set_transport(transport.Transport(transport.TransportConfig(**scenario.transport)))
+    try:
+        return _measure(scenario, fixtures, seed)
+    finally:
+        transport.set_transport(previous).close()
+
+
+def _measure(scenario: Scenario, fixtures: BenchmarkFixtures, seed: int) -> ScenarioResult:
+    operation = _operation(scenario, fixtures)
+    rng = random.Random(seed)
+    for _ in range(scenario.warmup):
+        operation(rng)
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def worker(worker_seed: int):
+        worker_rng = random.Random(worker_seed)
+        while next(counter) < scenario.repeats:
+            started = time.perf_counter()
+            try:
+                operation(worker_rng)
+            except Exception as error:
+                with lock:
+                    errors.append(repr(error))
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=scenario.concurrency) as executor:
+        list(executor.map(worker, [seed + index for index in range(scenario.concurrency)]))
+    wall_time = time.perf_counter() - started
+
+    result = ScenarioResult(name=scenario.name, scenario=scenario, calls=len(latencies), errors=len(errors),
+                            wall_time=wall_time, rps=len(latencies) / wall_time if wall_time else 0,
+                            first_error=errors[0] if errors else None)
+    if latencies:
+        result.p50, result.p95, result.p99 = numpy.percentile(latencies, [50, 95, 99]).tolist()
+        result.mean = float(numpy.mean(latencies))
+    return result
+
+
+def run_benchmark(scenarios: List[Scenario], stub: bool = False, seed: int = 0) -> BenchmarkReport:
+    """
+    Run scenarios against variables.ENV, or against an in-process stub backend if stub is set
+    """
+    server = None
+    if stub:
+        from stub_server import StubServer
+        server = StubServer().start()
+        previous_environment = scoring_api.set_environment(server.url)
+    report = BenchmarkReport(environment=scoring_api.ENV, started_at=datetime.now().isoformat())
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            fixtures = BenchmarkFixtures(Path(directory))
+            try:
+                for scenario in scenarios:
+                    report.results.append(run_scenario(scenario, fixtures, seed))
+            finally:
+                if not stub:
+                    fixtures.cleanup()
+    finally:
+        if server is not None:
+            scoring_api.set_environment(previous_environment)
+            server.stop()
+    return report
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Scoring API latency and throughput benchmark")
+    parser.add_argument("--operations", nargs="+", default=["datasets_list", "result_model"], choices=OPERATIONS)
+    parser.add_argument("--rows", nargs="+", type=int, default=[100])
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--per-page", nargs="+", type=int, default=[25])
+    parser.add_argument("--sort", nargs="+", default=[None], help="result_model sort columns, e.g. Column_1")
+    parser.add_argument("--order", nargs="+", default=["asc"], choices=["asc", "desc"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1])
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--no-keep-alive", action="store_true", help="open a new connection for every call")
+    parser.add_argument("--stub", action="store_true", help="run against an in-process stub backend")
+    parser.add_argument("--output", type=Path, help="save results as JSON")
+    parser.add_argument("--baseline", type=Path, help="fail if slower than results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, share of the baseline")
+    options = parser.parse_args(arguments)
+
+    transport_config = {"keep_alive": False} if options.no_keep_alive else {}
+    scenarios = scenario_matrix(options.operations, options.rows, options.per_page, options.sort, options.order,
+                                options.concurrency, columns=options.columns, warmup=options.warmup,
+                                repeats=options.repeats, transport=transport_config)
+    report = run_benchmark(scenarios, stub=options.stub)
+    print(report.table())
+    if options.output:
+        report.save(options.output)
+    if options.baseline:
+        regressions = report.compare(BenchmarkReport.load(options.baseline), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Optional, List, Union, Iterable, Callable
+
+from pydantic import BaseModel, Field
+
+import scoring_api
+from models import UploadParams, ValidateDataset, Task
+from tasks import TaskScheduler, TaskWaitResult, Backoff
+
+STAGES = ("params", "bucket", "validate", "wait")
+
+
+class StageLimits(BaseModel):
+    params: int = Field(8, title='Concurrent upload params requests')
+    bucket: int = Field(4, title='Concurrent bucket uploads')
+    validate_: int = Field(8, title='Concurrent validate requests', alias='validate')
+    wait: int = Field(8, title='Concurrent task status polls')
+
+    class Config:
+        allow_population_by_field_name = True
+
+
+class BulkUploadResult(BaseModel):
+    path: str = Field(..., title='Path')
+    filename: str = Field(..., title='Filename')
+    dataset_id: Optional[str] = Field(None, title='Dataset Id')
+    task_id: Optional[str] = Field(None, title='Task Id')
+    status: Optional[str] = Field(None, title='Task Status')
+    params_time: float = Field(0, title='Upload params request, seconds')
+    bucket_time: float = Field(0, title='Bucket upload, seconds')
+    validate_time: float = Field(0, title='Validate request, seconds')
+    wait_time: float = Field(0, title='Task waiting and result request, seconds')
+    polls: int = Field(0, title='Task status polls')
+    total_time: float = Field(0, title='From submission to the last stage, seconds')
+    failed_stage: Optional[str] = Field(None, title='Stage that failed')
+    error: Optional[str] = Field(None, title='Error')
+    task: Optional[Task] = Field(None, title='Task result')
+
+
+class BulkUploadReport(BaseModel):
+    results: List[BulkUploadResult] = Field([], title='Results in input order')
+    wall_time: float = Field(0, title='Seconds')
+
+    @property
+    def succeeded(self) -> List[BulkUploadResult]:
+        return [item for item in self.results if item.failed_stage is None]
+
+    @property
+    def failed(self) -> List[BulkUploadResult]:
+        return [item for item in self.results if item.failed_stage is not None]
+
+    def to_dataframe(self):
+        import pandas
+        return pandas.DataFrame([item.dict(exclude={"task"}) for item in self.results])
+
+
+class _Job:
+    __slots__ = ("result", "path", "started", "upload_params", "stage", "stage_started", "finished")
+
+    def __init__(self, path: Path, filename: str):
+        self.result = BulkUploadResult(path=str(path), filename=filename)
+        self.path = path
+        self.started = time.monotonic()
+        self.upload_params: Optional[UploadParams] = None
+        self.stage = "params"
+        self.stage_started = 0.0
+        self.finished = False
+
+
+def _collect_paths(source: Union[str, Path, Iterable[Union[str, Path]]], pattern: str) -> List[Path]:
+    if isinstance(source, (str, Path)) and Path(source).is_dir():
+        return sorted(Path(source).glob(pattern))
+    if isinstance(source, (str, Path)):
+        return [Path(source)]
+    return [Path(item) for item in source]
+
+
+def bulk_upload_datasets(source: Union[str, Path, Iterable[Union[str, Path]]],
+                         filename_factory: Callable[[Path], str] = lambda path: path.name,
+                         limits: StageLimits = None, pattern: str = "*.csv", timeout: float = 300,
+                         backoff: Backoff = None) -> BulkUploadReport:
+    """
+    Upload many datasets pipelining upload params, bucket upload, validation and task waiting
+
+    source: directory (files matching pattern are uploaded) or an iterable of paths
+    filename_factory: dataset name for a path, e.g. lambda path: f"Auto-{uuid.uuid4()}.csv"
+    limits: concurrency of every stage, a file moves to the next stage as soon as its current one finishes
+    timeout: seconds a validation task may take; every batch of files passing the narrowest stage at once gets
+        2 * timeout, files unfinished after that are reported as failed in the stage they were in
+    """
+    limits = limits or StageLimits()
+    jobs = [_Job(path, filename_factory(path)) for path in _collect_paths(source, pattern)]
+    started = time.monotonic()
+    pending = len(jobs)
+    all_done = threading.Event()
+    lock = threading.Lock()
+    if not jobs:
+        return BulkUploadReport()
+
+    executors = {"params": ThreadPoolExecutor(limits.params, thread_name_prefix="bulk-params"),
+                 "bucket": ThreadPoolExecutor(limits.bucket, thread_name_prefix="bulk-bucket"),
+                 "validate": ThreadPoolExecutor(limits.validate_, thread_name_prefix="bulk-validate")}
+    scheduler = TaskScheduler(scoring_api.task_task_id_status_get, timeout=timeout, backoff=backoff,
+                              max_workers=limits.wait)
+
+    def finish(job: _Job, stage: str = None, error: Exception = None):
+        nonlocal pending
+        with lock:
+            if job.finished:
+                return
+            job.finished = True
+        job.result.total_time = time.monotonic() - job.started
+        if stage:
+            job.result.failed_stage = stage
+            job.result.error = repr(error)
+        with lock:
+            pending -= 1
+            if pending == 0:
+                all_done.set()
+
+    def guarded(job: _Job, callback: Callable[..., None]) -> Callable[..., None]:
+        # exceptions of done callbacks are only logged by Future, the job has to fail instead of hanging
+        def call(*args):
+            try:
+                callback(*args)
+            except Exception as error:
+                finish(job, job.stage, error)
+        return call
+
+    def run_stage(stage: str, job: _Job, action: Callable[[_Job], None], next_step: Callable[[_Job], None]):
+        def run():
+            job.stage_started = time.monotonic()
+            action(job)
+            setattr(job.result, f"{stage}_time", time.monotonic() - job.stage_started)
+
+        def done(future: Future):
+            if future.exception() is not None:
+                setattr(job.result, f"{stage}_time", time.monotonic() - job.stage_started)
+                finish(job, stage, future.exception())
+            else:
+                next_step(job)
+
+        job.stage = stage
+        executors[stage].submit(run).add_done_callback(guarded(job, done))
+
+    def get_params(job: _Job):
+        job.upload_params = scoring_api.upload_datasets_upload_params_get(job.result.filename)
+
+    def post_to_bucket(job: _Job):
+        scoring_api.upload_file_to_bucket(job.upload_params, job.result.filename, job.path)
+
+    def validate(job: _Job):
+        validate_dataset = ValidateDataset(filepath=job.upload_params.data["fields"]["key"])
+        job.result.task_id = scoring_api.upload_datasets_validate_post(validate_dataset).id
+
+    def wait(job: _Job):
+        job.stage, job.stage_started = "wait", time.monotonic()
+        scheduler.submit(job.result.task_id).add_done_callback(guarded(job, lambda future: waited(job, future)))
+
+    def waited(job: _Job, future: "Future[TaskWaitResult]"):
+        try:
+            waiting = future.result()
+            job.result.polls = waiting.polls
+            if waiting.error or waiting.timed_out:
+                raise Exception(waiting.error or f"Task reached timeout: {waiting.task}")
+            job.result.task = scoring_api.task_task_id_result_get(job.result.task_id)
+            job.result.status = job.result.task.status
+            if job.result.task.result is not None and hasattr(job.result.task.result, "dataset_id"):
+                job.result.dataset_id = job.result.task.result.dataset_id
+        except Exception as error:
+            job.result.wait_time = time.monotonic() - job.stage_started
+            finish(job, "wait", error)
+            return
+        job.result.wait_time = time.monotonic() - job.stage_started
+        finish(job)
+
+    for item in jobs:
+        run_stage("params", item, get_params,
+                  lambda job: run_stage("bucket", job, post_to_bucket,
+                                        lambda job: run_stage("validate", job, validate, wait)))
+    batches = -(-len(jobs) // min(limits.params, limits.bucket, limits.validate_))
+    deadline = timeout * 2 * batches
+    completed = False
+    try:
+        completed = all_done.wait(deadline)
+        if not completed:
+            for job in jobs:
+                finish(job, job.stage, TimeoutError(f"Not done {deadline}s after the start of the bulk upload"))
+    finally:
+        scheduler.close()
+        for executor in executors.values():
+            executor.shutdown(wait=completed, cancel_futures=not completed)
+    return BulkUploadReport(results=[job.result for job in jobs], wall_time=time.monotonic() - started)
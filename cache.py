@@ -0,0 +1,185 @@
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple, Any, Callable
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field
+
+CacheKey = Tuple[str, Tuple[Tuple[str, str], ...], Optional[str]]
+
+
+class CacheStats(BaseModel):
+    hits: int = Field(0, title='Responses served from the cache')
+    revalidated: int = Field(0, title='Stale responses confirmed by 304 Not Modified')
+    misses: int = Field(0, title='Requests sent to the server')
+    stores: int = Field(0, title='Responses put in the cache')
+    evictions: int = Field(0, title='Entries dropped to stay under max_entries')
+    invalidations: int = Field(0, title='Entries dropped by mutating calls')
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.revalidated + self.misses
+        return (self.hits + self.revalidated) / lookups if lookups else 0.0
+
+
+class CacheEntry:
+    __slots__ = ("response", "path", "expires_at", "etag")
+
+    def __init__(self, response: Any, path: str, expires_at: float, etag: Optional[str]):
+        self.response = response
+        self.path = path
+        self.expires_at = expires_at
+        self.etag = etag
+
+
+class ResponseCache:
+    """
+    TTL and LRU cache of successful GET responses, keyed by URL, query and Authorization header
+
+    Entries older than ttl are revalidated with If-None-Match when the server sent an ETag, dropped otherwise.
+    Endpoint wrappers opt in per call and invalidate the paths they change. Every invalidation bumps the generation
+    of its paths: a response requested before the bump can be out of date and isn't stored, see generation().
+    """
+    def __init__(self, ttl: float = 30, max_entries: int = 1024, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._generation = 0
+        self._invalidated: Dict[str, int] = {}
+        self._invalidated_subtrees: Dict[str, int] = {}
+        self._cleared = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(url: str, params: Optional[Dict[str, Any]], headers: Optional[Dict[str, str]]) -> CacheKey:
+        query = tuple(sorted((name, str(value)) for name, value in (params or {}).items()))
+        return url, query, (headers or {}).get("Authorization")
+
+    def generation(self) -> int:
+        """
+        Current generation, taken before sending a request and passed to store() or revalidated() with its response
+        """
+        with self._lock:
+            return self._generation
+
+    def _invalidated_since(self, path: str, generation: Optional[int]) -> bool:
+        if generation is None:
+            return False
+        if max(self._cleared, self._invalidated.get(path, 0)) > generation:
+            return True
+        parent = path
+        while parent:
+            if self._invalidated_subtrees.get(parent, 0) > generation:
+                return True
+            parent = parent.rpartition("/")[0]
+        return False
+
+    def lookup(self, key: CacheKey) -> Tuple[Any, Optional[CacheEntry]]:
+        """
+        (fresh response, None) on a hit, (None, stale entry with an ETag) if it can be revalidated, (None, None)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return entry.response, None
+                if entry.etag is None:
+                    del self._entries[key]
+                    entry = None
+            self.stats.misses += 1
+            return None, entry
+
+    def revalidated(self, key: CacheKey, entry: CacheEntry, generation: int = None) -> Any:
+        """
+        Cached response of an entry the server answered 304 for, kept unless its path was invalidated since generation
+        """
+        with self._lock:
+            self.stats.misses -= 1
+            self.stats.revalidated += 1
+            if self._invalidated_since(entry.path, generation):
+                return entry.response
+            entry.expires_at = self.clock() + self.ttl
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+        return entry.response
+
+    def store(self, key: CacheKey, response: Any, generation: int = None):
+        """
+        Cache a response, unless its path was invalidated after generation (the response may predate the change)
+        """
+        entry = CacheEntry(response, urlsplit(key[0]).path, self.clock() + self.ttl, response.headers.get("ETag"))
+        with self._lock:
+            if self._invalidated_since(entry.path, generation):
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.stats.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def invalidate(self, *paths: str, subtree: bool = False) -> int:
+        """
+        Drop entries of the paths, and of everything under them if subtree is set. Returns the number dropped
+        """
+        prefixes = tuple(f"{path}/" for path in paths)
+        with self._lock:
+            self._generation += 1
+            for path in paths:
+                (self._invalidated_subtrees if subtree else self._invalidated)[path] = self._generation
+            keys = [key for key, entry in self._entries.items()
+                    if entry.path in paths or subtree and entry.path.startswith(prefixes)]
+            for key in keys:
+                del self._entries[key]
+            self.stats.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared = self._generation
+            self._invalidated.clear()
+            self._invalidated_subtrees.clear()
+            self.stats.invalidations += len(self._entries)
+            self._entries.clear()
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """
+    Cache used by endpoint wrappers, None until enabled with configure_response_cache
+    """
+    return _cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> Optional[ResponseCache]:
+    """
+    Replace the shared cache (None disables caching), returns the previous one
+    """
+    global _cache
+    previous, _cache = _cache, cache
+    return previous
+
+
+def configure_response_cache(ttl: float = 30, max_entries: int = 1024) -> ResponseCache:
+    set_response_cache(ResponseCache(ttl, max_entries))
+    return _cache
+
+
+def invalidate_cached(*paths: str, subtree: bool = False):
+    """
+    Drop cached responses of paths changed by a mutating call, no-op while caching is disabled
+    """
+    if _cache is not None:
+        _cache.invalidate(*paths, subtree=subtree)
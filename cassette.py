@@ -0,0 +1,327 @@
+import base64
+import gzip
+import json
+import re
+import threading
+
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Iterable, Iterator, Tuple, Union
+from urllib.parse import urlsplit, parse_qsl
+
+import requests
+from pydantic import BaseModel, Field
+from requests.structures import CaseInsensitiveDict
+
+from transport import Transport, CallTiming, endpoint_template, get_transport, set_transport
+
+MODES = ("record", "replay", "auto")
+# values differing between runs of the same test: uuids, also cut ones, and long hex ids
+DEFAULT_SCRUB = (r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F-]{1,17}", r"[0-9a-fA-F]{16,}")
+RESPONSE_HEADERS = ("content-type", "etag", "retry-after", "location", "cache-control")
+STREAMED = "<stream>"
+
+
+class CassetteMiss(LookupError):
+    """
+    Replayed request that wasn't recorded
+    """
+
+
+class Interaction(BaseModel):
+    method: str = Field(..., title='HTTP method, upper case')
+    endpoint: str = Field(..., title='Method and URL template, see transport.endpoint_template')
+    query: Dict[str, str] = Field({}, title='Query parameters')
+    body: Any = Field(None, title=f'JSON body or form data, {STREAMED} for streamed bodies')
+    status_code: int = Field(..., title='Response status')
+    headers: Dict[str, str] = Field({}, title='Response headers of RESPONSE_HEADERS')
+    text: Optional[str] = Field(None, title='Response body if it is UTF-8')
+    content_base64: Optional[str] = Field(None, title='Response body otherwise')
+    elapsed: float = Field(0, title='Recorded response time, seconds')
+
+    @property
+    def content(self) -> bytes:
+        if self.text is not None:
+            return self.text.encode()
+        return base64.b64decode(self.content_base64 or "")
+
+
+class CassetteStats(BaseModel):
+    recorded: int = Field(0, title='Interactions recorded')
+    hits: int = Field(0, title='Requests replayed from an interaction with the same query and body')
+    loose_hits: int = Field(0, title='Requests replayed from an interaction with the same query and body keys')
+    repeats: int = Field(0, title='Requests replayed from the last interaction of a used up sequence')
+    misses: int = Field(0, title='Requests without a recorded interaction')
+
+
+def _shape(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [_shape(item) for item in value[:1]]
+    return type(value).__name__
+
+
+def _key(*parts: Any) -> str:
+    return json.dumps(parts, sort_keys=True, default=str)
+
+
+class Cassette:
+    """
+    Recorded HTTP exchanges of a test module, stored as NDJSON (gzipped if the path ends with .gz)
+
+    Requests are matched on method, URL template, query and JSON body with run-specific values (DEFAULT_SCRUB and
+    `scrub` patterns) replaced by <id>. Interactions with the same key are replayed in recorded order, so polling
+    sequences like STARTED, STARTED, SUCCESS come back as recorded; a used up sequence repeats its last response.
+    Requests without an exact match take the next interaction of the endpoint with the same query and body keys,
+    e.g. uploads of files with random names. Streamed bodies (bucket uploads) are matched on the endpoint only.
+    Scrubbed values of the current requests replace the recorded ones in replayed responses, so a dataset uploaded
+    as Auto-<uuid>.csv is listed under the name of this run.
+    """
+    def __init__(self, path: Union[str, Path], scrub: Iterable[str] = ()):
+        self.path = Path(path)
+        self.scrub = re.compile("|".join(f"(?:{pattern})" for pattern in [*DEFAULT_SCRUB, *scrub]))
+        self.interactions: List[Interaction] = []
+        # record or replay, decided by the transport the first time the cassette is used
+        self.recording: Optional[bool] = None
+        self.stats = CassetteStats()
+        self._lock = threading.Lock()
+        self._used: List[bool] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._loose: Dict[str, List[int]] = {}
+        # recorded value: value of this run
+        self.substitutions: Dict[str, str] = {}
+        self._substitute: Optional[re.Pattern] = None
+
+    def __len__(self) -> int:
+        return len(self.interactions)
+
+    def _scrubbed(self, value: Any) -> Any:
+        if isinstance(value, dict):
+            return {str(key): self._scrubbed(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._scrubbed(item) for item in value]
+        if isinstance(value, str):
+            return self.scrub.sub("<id>", value)
+        return value
+
+    @staticmethod
+    def request(url: str, params: Optional[Dict[str, Any]] = None, json_body: Any = None, data: Any = None,
+                files: Any = None) -> Tuple[Dict[str, str], Any]:
+        """
+        (query, body) of a request as they are recorded
+        """
+        query = dict(parse_qsl(urlsplit(url).query, keep_blank_values=True))
+        query.update({name: str(value) for name, value in (params or {}).items() if value is not None})
+        if files is not None or (data is not None and not isinstance(data, (dict, str, bytes))):
+            return query, STREAMED
+        if data is not None:
+            return query, data.decode(errors="replace") if isinstance(data, bytes) else data
+        return query, json_body
+
+    def request_key(self, method: str, url: str, query: Dict[str, str], body: Any) -> Tuple[str, Dict[str, str], Any]:
+        """
+        (endpoint, scrubbed query, scrubbed body) requests are matched on
+        """
+        return endpoint_template(method, url), self._scrubbed(query), self._scrubbed(body)
+
+    def _pairs(self, recorded: Any, current: Any, found: Dict[str, str]):
+        """
+        Collect recorded: current pairs of scrubbed values at the same places of two requests with the same key
+        """
+        if isinstance(recorded, dict) and isinstance(current, dict):
+            for key in recorded.keys() & current.keys():
+                self._pairs(recorded[key], current[key], found)
+        elif isinstance(recorded, (list, tuple)) and isinstance(current, (list, tuple)):
+            for recorded_item, current_item in zip(recorded, current):
+                self._pairs(recorded_item, current_item, found)
+        elif isinstance(recorded, str) and isinstance(current, str) and recorded != current:
+            for old, new in zip(self.scrub.findall(recorded), self.scrub.findall(current)):
+                if old != new:
+                    found[old] = new
+
+    def _index(self, position: int):
+        item = self.interactions[position]
+        query, body = self._scrubbed(item.query), self._scrubbed(item.body)
+        self._exact.setdefault(_key(item.endpoint, query, body), []).append(position)
+        self._loose.setdefault(_key(item.endpoint, _shape(query), _shape(body)), []).append(position)
+        self._used.append(False)
+
+    def load(self) -> "Cassette":
+        opener = gzip.open if self.path.suffix == ".gz" else open
+        with opener(self.path, "rt", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    self.interactions.append(Interaction.parse_raw(line))
+                    self._index(len(self.interactions) - 1)
+        return self
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.path.with_name(f".{self.path.name}.tmp")
+        opener = gzip.open if self.path.suffix == ".gz" else open
+        with opener(temporary, "wt", encoding="utf-8") as file:
+            for item in self.interactions:
+                file.write(item.json(exclude_none=True) + "\n")
+        temporary.replace(self.path)
+
+    def record(self, method: str, url: str, response: Any, **kwargs) -> Interaction:
+        query, body = self.request(url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"),
+                                   kwargs.get("files"))
+        content = response.content or b""
+        try:
+            text, content_base64 = content.decode("utf-8"), None
+        except UnicodeDecodeError:
+            text, content_base64 = None, base64.b64encode(content).decode()
+        elapsed = response.elapsed.total_seconds() if hasattr(response.elapsed, "total_seconds") else 0.0
+        interaction = Interaction(method=method.upper(), endpoint=endpoint_template(method, url), query=query,
+                                  body=body, status_code=response.status_code,
+                                  headers={name: value for name, value in response.headers.items()
+                                           if name.lower() in RESPONSE_HEADERS},
+                                  text=text, content_base64=content_base64, elapsed=elapsed)
+        with self._lock:
+            self.interactions.append(interaction)
+            self._index(len(self.interactions) - 1)
+            self.stats.recorded += 1
+        return interaction
+
+    def _next(self, positions: Optional[List[int]]) -> Optional[int]:
+        if not positions:
+            return None
+        return next((position for position in positions if not self._used[position]), None)
+
+    def match(self, method: str, url: str, **kwargs) -> Interaction:
+        """
+        Next recorded interaction for a request, raises CassetteMiss if there is none
+        """
+        query, body = self.request(url, kwargs.get("params"), kwargs.get("json"), kwargs.get("data"),
+                                   kwargs.get("files"))
+        endpoint, scrubbed_query, scrubbed_body = self.request_key(method, url, query, body)
+        exact = self._exact.get(_key(endpoint, scrubbed_query, scrubbed_body))
+        loose = self._loose.get(_key(endpoint, _shape(scrubbed_query), _shape(scrubbed_body)))
+        with self._lock:
+            position = self._next(exact)
+            if position is not None:
+                self.stats.hits += 1
+            elif exact:
+                # polled until the end of the recorded sequence, e.g. the last SUCCESS of a task
+                position = exact[-1]
+                self.stats.repeats += 1
+            else:
+                position = self._next(loose)
+                if position is not None:
+                    self.stats.loose_hits += 1
+                elif loose:
+                    position = loose[-1]
+                    self.stats.repeats += 1
+                else:
+                    self.stats.misses += 1
+                    raise CassetteMiss(f"{endpoint} query={scrubbed_query} body={scrubbed_body} "
+                                       f"isn't recorded in {self.path}")
+            self._used[position] = True
+            interaction = self.interactions[position]
+            if not exact:
+                return interaction
+            found = {}
+            self._pairs([interaction.query, interaction.body], [query, body], found)
+            if found.items() - self.substitutions.items():
+                self.substitutions.update(found)
+                values = sorted(self.substitutions, key=len, reverse=True)
+                self._substitute = re.compile("|".join(re.escape(value) for value in values))
+            return interaction
+
+    def content(self, interaction: Interaction) -> bytes:
+        """
+        Recorded response body with recorded request values replaced by the ones of this run
+        """
+        if interaction.text is None or self._substitute is None:
+            return interaction.content
+        return self._substitute.sub(lambda match: self.substitutions[match.group(0)], interaction.text).encode()
+
+
+def replayed_response(interaction: Interaction, content: bytes, method: str, url: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = interaction.status_code
+    response.headers = CaseInsensitiveDict(interaction.headers)
+    response._content = content
+    response.encoding = "utf-8" if interaction.text is not None else None
+    response.url = url
+    response.reason = "Replayed"
+    response.elapsed = timedelta(0)
+    response.timing = CallTiming(method=method.upper(), url=url, status_code=interaction.status_code, connect=0.0,
+                                 ttfb=0.0, total=0.0)
+    return response
+
+
+class CassetteTransport(Transport):
+    """
+    Transport recording exchanges of the inner transport into the current cassette, or serving them from it
+
+    mode: "record", "replay", or "auto" - replay cassettes that exist and record the others
+    No cassette (use_cassette(None)) passes requests to the inner transport untouched.
+    """
+    def __init__(self, mode: str = "auto", inner: Transport = None, cassette: Cassette = None):
+        assert mode in MODES, f"Unknown cassette mode {mode}, use one of {MODES}"
+        self.mode = mode
+        self.inner = inner or Transport()
+        self.config = self.inner.config
+        self.timings = self.inner.timings
+        self._lock = threading.Lock()
+        self._client = self._session = None
+        self.cassette: Optional[Cassette] = None
+        self.recording = False
+        self.use_cassette(cassette)
+
+    def use_cassette(self, cassette: Optional[Cassette]) -> Optional[Cassette]:
+        """
+        Switch cassettes, a recorded one is saved; returns the previous cassette
+        """
+        previous = self.cassette
+        if previous is not None and self.recording and len(previous):
+            previous.save()
+        self.cassette = cassette
+        self.recording = False
+        if cassette is not None:
+            if cassette.recording is None:
+                # once per cassette, saving it on a switch mustn't turn the rest of an auto recording into replay
+                cassette.recording = self.mode == "record" or (self.mode == "auto" and not cassette.path.exists())
+                if not cassette.recording and not len(cassette):
+                    cassette.load()
+            self.recording = cassette.recording
+        return previous
+
+    def request(self, method: str, url: str, **kwargs):
+        cassette = self.cassette
+        if cassette is None:
+            return self.inner.request(method, url, **kwargs)
+        if self.recording:
+            response = self.inner.request(method, url, **kwargs)
+            cassette.record(method, url, response, **kwargs)
+            return response
+        interaction = cassette.match(method, url, **kwargs)
+        response = replayed_response(interaction, cassette.content(interaction), method, url)
+        self._record(response.timing)
+        return response
+
+    def close(self):
+        self.use_cassette(None)
+        self.inner.close()
+
+
+@contextmanager
+def use_cassette(path: Union[str, Path], mode: str = "auto", scrub: Iterable[str] = ()) -> Iterator[Cassette]:
+    """
+    Record or replay scoring_api calls of a block:
+
+        with use_cassette("cassettes/upload.ndjson.gz"):
+            scoring_api.upload_dataset(...)
+    """
+    cassette = Cassette(path, scrub)
+    transport = CassetteTransport(mode, get_transport(), cassette)
+    previous = set_transport(transport)
+    try:
+        yield cassette
+    finally:
+        transport.use_cassette(None)
+        set_transport(previous)
@@ -0,0 +1,108 @@
+"""
+pytest plugin recording API calls of test modules into cassettes and replaying them, loaded by tests/conftest.py
+or with `-p cassette_plugin`
+
+    pytest --cassettes record tests     # run against QA once, saves tests/cassettes/<module>.ndjson.gz
+    pytest --cassettes replay tests     # serve the calls from the cassettes, no network
+
+"auto" replays the modules having a cassette and records the others. Calls made outside tests (session cleanup)
+go to session.ndjson.gz. Tests using the `stub` fixture or marked no_cassette talk to their server directly.
+"""
+import random
+
+from pathlib import Path
+from typing import Optional, List
+
+import pytest
+
+from cassette import Cassette, CassetteTransport, CassetteStats, MODES
+from transport import get_transport, set_transport
+
+DEFAULT_DIRECTORY = Path(__file__).resolve().parent / "tests" / "cassettes"
+SUFFIX = ".ndjson.gz"
+# run-specific values of recorded requests, e.g. dataset name prefixes, conftest.py adds its run id in pytest_configure
+SCRUB: List[str] = []
+
+
+class CassetteRecorder:
+    def __init__(self, mode: str, directory: Path, scrub: List[str]):
+        self.mode = mode
+        self.directory = directory
+        self.scrub = scrub
+        self.cassettes = {}
+        self.transport = CassetteTransport(mode, get_transport())
+        set_transport(self.transport)
+
+    def use(self, name: Optional[str]):
+        current = get_transport()
+        if current is not self.transport:
+            # the test replaced the shared transport, keep it for the calls passing through
+            self.transport.inner = current
+            set_transport(self.transport)
+        cassette = None
+        if name is not None:
+            if name not in self.cassettes:
+                self.cassettes[name] = Cassette(self.directory / f"{name}{SUFFIX}", [*SCRUB, *self.scrub])
+            cassette = self.cassettes[name]
+        if cassette is not self.transport.cassette:
+            self.transport.use_cassette(cassette)
+
+    def pytest_sessionstart(self, session):
+        self.use("session")
+
+    @pytest.hookimpl(hookwrapper=True, tryfirst=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        bypass = "stub" in getattr(item, "fixturenames", ()) or item.get_closest_marker("no_cassette")
+        module = Path(item.fspath).stem
+        self.use(None if bypass else module)
+        if not bypass:
+            # random pages and names of a test are the same in the recording and in the replay
+            random.seed(f"{module}::{item.name}")
+        try:
+            yield
+        finally:
+            self.use("session")
+
+    def stats(self) -> CassetteStats:
+        total = CassetteStats()
+        for cassette in self.cassettes.values():
+            for name, value in cassette.stats:
+                setattr(total, name, getattr(total, name) + value)
+        return total
+
+    def pytest_terminal_summary(self, terminalreporter):
+        stats = self.stats()
+        terminalreporter.write_sep("=", f"cassettes ({self.mode}, {self.directory})")
+        terminalreporter.write_line(", ".join(f"{name} {value}" for name, value in stats))
+
+    def close(self):
+        self.transport.use_cassette(None)
+        set_transport(self.transport.inner)
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("cassettes", "API call recording")
+    group.addoption("--cassettes", choices=("off", *MODES), default="off",
+                    help="record API calls of test modules, replay them, or replay existing cassettes and record the "
+                         "missing ones (auto)")
+    group.addoption("--cassette-dir", metavar="PATH", default=str(DEFAULT_DIRECTORY),
+                    help=f"cassette directory, {DEFAULT_DIRECTORY} by default")
+    group.addoption("--cassette-scrub", metavar="REGEX", action="append", default=[],
+                    help="pattern of run-specific request values ignored by matching, may be repeated")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "no_cassette: send the test's API calls without recording or replaying them")
+    mode = config.getoption("cassettes")
+    if mode == "off":
+        return
+    recorder = CassetteRecorder(mode, Path(config.getoption("cassette_dir")), config.getoption("cassette_scrub"))
+    config.pluginmanager.register(recorder, "cassette-recorder")
+
+
+def pytest_unconfigure(config):
+    recorder = config.pluginmanager.get_plugin("cassette-recorder")
+    if recorder is None:
+        return
+    recorder.close()
+    config.pluginmanager.unregister(recorder)
@@ -0,0 +1,231 @@
+import argparse
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Iterable
+
+from pydantic import BaseModel, Field
+
+import scoring_api
+from cache import invalidate_cached
+from models import DatasetExtendedCardOut
+from scheduler import RequestScheduler, get_scheduler
+from tasks import Backoff
+
+# artifacts are deleted kind by kind in this order, nothing is deleted before the artifacts depending on it
+KINDS = ("scored_dataset", "template_property", "scoring_template", "dataset")
+URLS = {
+    "scored_dataset": "/api/scored_dataset/{id}",
+    "template_property": "/api/scoring/{parent_id}/template_properties/{id}",
+    "scoring_template": "/api/scoring/{id}",
+    "dataset": "/api/datasets/{id}",
+}
+
+
+class Leftover(BaseModel):
+    kind: str = Field(..., title='One of KINDS')
+    id: str = Field(..., title='Id')
+    parent_id: Optional[str] = Field(None, title='Template Id of a template property')
+    dataset_id: Optional[str] = Field(None, title='Dataset the artifact belongs to')
+    name: Optional[str] = Field(None, title='Name')
+
+
+class CleanupResult(BaseModel):
+    leftover: Leftover = Field(..., title='Deleted artifact')
+    deleted: bool = Field(False, title='Deleted by this run or already gone (404)')
+    status_code: Optional[int] = Field(None, title='Status of the last attempt')
+    attempts: int = Field(0, title='Delete requests sent')
+    time: float = Field(0, title='Seconds spent on all attempts')
+    error: Optional[str] = Field(None, title='Error of the last attempt')
+
+
+class CleanupReport(BaseModel):
+    results: List[CleanupResult] = Field([], title='Results in dependency order')
+    discovery_time: float = Field(0, title='Seconds spent finding leftovers')
+    wall_time: float = Field(0, title='Seconds spent deleting')
+    dry_run: bool = Field(False, title='Leftovers were only listed')
+
+    @property
+    def failed(self) -> List[CleanupResult]:
+        return [] if self.dry_run else [item for item in self.results if not item.deleted]
+
+    @property
+    def throughput(self) -> float:
+        """
+        Deleted artifacts per second
+        """
+        deleted = sum(item.deleted for item in self.results)
+        return deleted / self.wall_time if self.wall_time else 0.0
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        counts = {kind: {"found": 0, "deleted": 0, "failed": 0} for kind in KINDS}
+        for item in self.results:
+            counts[item.leftover.kind]["found"] += 1
+            if not self.dry_run:
+                counts[item.leftover.kind]["deleted" if item.deleted else "failed"] += 1
+        return counts
+
+    def summary(self) -> str:
+        lines = [f"{kind}: {value['found']} found, {value['deleted']} deleted, {value['failed']} failed"
+                 for kind, value in self.counts().items()]
+        lines.append(f"{len(self.results)} artifacts in {self.wall_time:.1f}s "
+                     f"(+{self.discovery_time:.1f}s discovery), {self.throughput:.1f}/s")
+        return "\n".join(lines)
+
+
+def _age(upload_date: Optional[str], now: datetime) -> Optional[timedelta]:
+    try:
+        uploaded = datetime.fromisoformat(upload_date)
+    except (TypeError, ValueError):
+        return None
+    if uploaded.tzinfo is not None:
+        uploaded = uploaded.astimezone(timezone.utc).replace(tzinfo=None)
+    return now - uploaded
+
+
+def matches(card: DatasetExtendedCardOut, prefix: str = None, contains: str = None,
+            older_than: timedelta = None, now: datetime = None) -> bool:
+    """
+    Dataset name starts with prefix, contains the substring and it was uploaded more than older_than ago,
+    criteria left None aren't checked
+    """
+    if prefix is not None and not card.name.startswith(prefix):
+        return False
+    if contains is not None and contains not in card.name:
+        return False
+    if older_than is not None:
+        age = _age(card.upload_date, now or datetime.utcnow())
+        if age is None or age < older_than:
+            return False
+    return True
+
+
+def _dataset_leftovers(card: DatasetExtendedCardOut) -> List[Leftover]:
+    leftovers = [Leftover(kind="dataset", id=card.dataset_id, dataset_id=card.dataset_id, name=card.name)]
+    template_id = card.associated_scoring_template_id
+    try:
+        dataset = scoring_api.get_dataset_result_model_json(card.dataset_id, page=1, per_page=1)["dataset"]
+    except (AssertionError, KeyError, TypeError):
+        dataset = {}
+    template_id = dataset.get("associated_scoring_template_id") or template_id
+    if template_id:
+        leftovers.append(Leftover(kind="scoring_template", id=template_id, dataset_id=card.dataset_id,
+                                  name=card.associated_scoring_template_name))
+    if dataset.get("associated_scored_dataset_id"):
+        leftovers.append(Leftover(kind="scored_dataset", id=dataset["associated_scored_dataset_id"],
+                                  dataset_id=card.dataset_id))
+    return leftovers
+
+
+def discover_leftovers(prefix: str = "Auto", contains: str = None, older_than: timedelta = None,
+                       workers: int = 16) -> List[Leftover]:
+    """
+    Matching datasets with their scoring templates and scored datasets
+
+    Templates and scored datasets are found through the dataset they are associated with; template properties
+    have no listing endpoint and go away with their template unless passed to cleanup explicitly.
+    """
+    now = datetime.utcnow()
+    cards = [card for card in scoring_api.get_datasets_list() if matches(card, prefix, contains, older_than, now)]
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="cleanup-discovery") as executor:
+        found = [item for leftovers in executor.map(_dataset_leftovers, cards) for item in leftovers]
+    unique: Dict[tuple, Leftover] = {}
+    for item in found:
+        unique.setdefault((item.kind, item.id), item)
+    return list(unique.values())
+
+
+def _delete(leftover: Leftover, retries: int, backoff: Backoff, scheduler: RequestScheduler) -> CleanupResult:
+    result = CleanupResult(leftover=leftover)
+    url = URLS[leftover.kind].format(id=leftover.id, parent_id=leftover.parent_id)
+    started = time.monotonic()
+    for attempt in range(retries + 1):
+        result.attempts += 1
+        try:
+            response = scoring_api.send_request(url, "delete", check_code=False, scheduler=scheduler)
+        except Exception as error:
+            result.status_code, result.error = None, repr(error)
+        else:
+            result.status_code = response.status_code
+            # 404: deleted by someone else or together with its parent
+            if response.status_code in (200, 204, 404):
+                result.deleted, result.error = True, None
+                break
+            result.error = response.text[:500]
+            if response.status_code < 500 and response.status_code not in (408, 429):
+                break
+        if attempt < retries:
+            time.sleep(backoff.delay(attempt))
+    result.time = time.monotonic() - started
+    return result
+
+
+def cleanup(leftovers: Iterable[Leftover], workers: int = 16, retries: int = 3, backoff: Backoff = None,
+            dry_run: bool = False) -> CleanupReport:
+    """
+    Delete artifacts kind by kind in dependency order, every kind by a pool of workers
+
+    Connection errors, timeouts, 429 and 5xx responses are retried with backoff.
+    """
+    backoff = backoff or Backoff(initial=0.2, max_delay=5)
+    # deletes are retried here, every attempt is a single request under the shared rate limit
+    scheduler = get_scheduler().single_attempt()
+    leftovers = list(leftovers)
+    report = CleanupReport(dry_run=dry_run)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="cleanup") as executor:
+        for kind in KINDS:
+            stage = [item for item in leftovers if item.kind == kind]
+            if dry_run:
+                report.results += [CleanupResult(leftover=item) for item in stage]
+            else:
+                report.results += list(executor.map(lambda item: _delete(item, retries, backoff, scheduler), stage))
+    report.wall_time = time.monotonic() - started
+    invalidate_cached("/api/datasets", "/api/authorization/me", subtree=True)
+    return report
+
+
+def cleanup_leftovers(prefix: str = "Auto", contains: str = None, older_than: timedelta = None,
+                      workers: int = 16, retries: int = 3, dry_run: bool = False) -> CleanupReport:
+    """
+    Find and delete leftovers of test runs, e.g. in a teardown fixture:
+
+        cleanup_leftovers(prefix=None, contains="Auto")
+    """
+    started = time.monotonic()
+    leftovers = discover_leftovers(prefix, contains, older_than, workers)
+    discovery_time = time.monotonic() - started
+    report = cleanup(leftovers, workers, retries, dry_run=dry_run)
+    report.discovery_time = discovery_time
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete leftover test datasets with their scoring artifacts")
+    parser.add_argument("--env", help="host to clean, variables.ENV by default")
+    parser.add_argument("--prefix", default="Auto", help="dataset name prefix, empty string for any name")
+    parser.add_argument("--contains", help="substring the dataset name must contain")
+    parser.add_argument("--older-than-hours", type=float, help="only datasets uploaded earlier than this")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--dry-run", action="store_true", help="list leftovers without deleting them")
+    parser.add_argument("--output", help="save the report as JSON")
+    options = parser.parse_args()
+    if options.env:
+        scoring_api.set_environment(options.env)
+    older_than = timedelta(hours=options.older_than_hours) if options.older_than_hours is not None else None
+    report = cleanup_leftovers(options.prefix or None, options.contains, older_than, options.workers,
+                               options.retries, options.dry_run)
+    if options.dry_run:
+        for item in report.results:
+            print(f"{item.leftover.kind}\t{item.leftover.id}\t{item.leftover.name or ''}")
+    print(report.summary())
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(report.json(indent=2))
+    raise SystemExit(1 if report.failed else 0)
+
+
+if __name__ == "__main__":
+    main()
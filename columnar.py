@@ -0,0 +1,132 @@
+from typing import Optional, Dict, List, Iterable, Any, Tuple
+
+import numpy
+
+import scoring_api
+from models import ResultModel
+
+VALIDATION_MODES = ("eager", "lazy", "skip")
+
+
+def parse_floats(values: List[Any]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Convert raw cell values to float64, returns (values, mask) where mask is True for cells that aren't numbers
+    Non-numeric cells are NaN in values.
+    """
+    try:
+        array = numpy.array(values, dtype=numpy.float64)
+        return array, numpy.isnan(array)
+    except (ValueError, TypeError):
+        pass
+    array = numpy.empty(len(values), dtype=numpy.float64)
+    mask = numpy.zeros(len(values), dtype=bool)
+    for index, value in enumerate(values):
+        try:
+            array[index] = float(value)
+        except (ValueError, TypeError):
+            array[index] = numpy.nan
+            mask[index] = True
+    mask |= numpy.isnan(array)
+    return array, mask
+
+
+def looks_numeric(values: Iterable[Any]) -> bool:
+    """
+    Columns aren't always flagged numeric, they are if every non-empty cell is a number
+    """
+    present = [value for value in values if value not in ("", None)]
+    if not present:
+        return False
+    try:
+        numpy.array(present, dtype=numpy.float64)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+class ColumnarResult:
+    """
+    /result_model payload decoded into typed column arrays keyed by column name
+
+    numeric columns are float64 arrays with NaN for missing or non-numeric cells, `masks` marks those cells;
+    other columns are arrays of str. `scored` is the scored column with 'nonquantifiable' masked.
+    numeric: numeric-or-not decisions by column name overriding the flag and the per-payload guess, e.g. to keep
+        every page of a dataset as str and type whole columns later
+    """
+    __slots__ = ("payload", "columns", "masks", "orders", "scored", "scored_mask", "validation", "_model")
+
+    def __init__(self, payload: Dict[str, Any], columns: Iterable[str] = None, validation: str = "lazy",
+                 numeric: Dict[str, bool] = None):
+        assert validation in VALIDATION_MODES, f"Unknown validation mode {validation}, use one of {VALIDATION_MODES}"
+        self.payload = payload
+        self.validation = validation
+        self.columns: Dict[str, numpy.ndarray] = {}
+        self.masks: Dict[str, numpy.ndarray] = {}
+        self.orders: Dict[str, numpy.ndarray] = {}
+        self._model: Optional[ResultModel] = None
+        selected = set(columns) if columns is not None else None
+        for column in payload["dataset"].get("columns") or []:
+            name = column["name"]
+            if selected is not None and name not in selected:
+                continue
+            cells = column["values"] or []
+            self.orders[name] = numpy.fromiter((cell["order"] for cell in cells), dtype=numpy.int64,
+                                               count=len(cells))
+            values = [cell["value"] for cell in cells]
+            if numeric is not None and name in numeric:
+                decided = numeric[name]
+            else:
+                decided = column.get("numeric") or looks_numeric(values)
+            if decided:
+                self.columns[name], self.masks[name] = parse_floats(values)
+            else:
+                self.columns[name] = numpy.array(values, dtype=str)
+                self.masks[name] = self.columns[name] == ""
+        scored = payload.get("scored")
+        if scored:
+            self.scored, self.scored_mask = parse_floats(scored["scored_column"])
+        else:
+            self.scored, self.scored_mask = None, None
+        if validation == "eager":
+            self._model = ResultModel(**payload)
+
+    @property
+    def model(self) -> ResultModel:
+        """
+        ResultModel of the payload: validated on first access in lazy mode, built without validation in skip mode
+        """
+        if self._model is None:
+            if self.validation == "skip":
+                self._model = ResultModel.construct(**self.payload)
+            else:
+                self._model = ResultModel(**self.payload)
+        return self._model
+
+    def masked(self, name: str) -> numpy.ma.MaskedArray:
+        return numpy.ma.MaskedArray(self.columns[name], mask=self.masks[name])
+
+    def to_arrow(self):
+        """
+        pyarrow.Table of all decoded columns and the scored column, masked cells become nulls
+        """
+        import pyarrow
+        arrays = {name: pyarrow.array(values, mask=self.masks[name]) for name, values in self.columns.items()}
+        if self.scored is not None:
+            arrays["Scored_column"] = pyarrow.array(self.scored, mask=self.scored_mask)
+        return pyarrow.table(arrays)
+
+
+def decode_result_model(payload: Dict[str, Any], columns: Iterable[str] = None,
+                        validation: str = "lazy", numeric: Dict[str, bool] = None) -> ColumnarResult:
+    return ColumnarResult(payload, columns, validation, numeric)
+
+
+def get_dataset_result_columns(dataset_id: str, page: int = None, per_page: int = None, sort: str = None,
+                               order: str = None, columns: Iterable[str] = None, validation: str = "lazy",
+                               expected_code=None) -> ColumnarResult:
+    """
+    Get Dataset decoded into column arrays instead of ResultModel
+    """
+    payload = scoring_api.get_dataset_result_model_json(dataset_id, page, per_page, sort, order,
+                                                        expected_code=expected_code)
+    return ColumnarResult(payload, columns, validation)
@@ -0,0 +1,152 @@
+import argparse
+import gzip
+import json
+
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy
+
+from desirability import evaluate
+from models import DesirabilityFunction, DesirabilityFunctionTypes
+
+# Order of score columns after every value column, as in tests/data/scoring_100_with_meta.csv
+FUNCTION_TYPES = [DesirabilityFunctionTypes.custom_curve, DesirabilityFunctionTypes.logarithmic,
+                  DesirabilityFunctionTypes.logistic, DesirabilityFunctionTypes.unit_step,
+                  DesirabilityFunctionTypes.linear, DesirabilityFunctionTypes.triangular,
+                  DesirabilityFunctionTypes.rectangular]
+SCORED_FUNCTION_TYPE = DesirabilityFunctionTypes.logarithmic
+SMILES = ["CCO", "CBBC1CCCC1", "C1CCCC1Nc1ccccc1O", "CC(=O)Oc1ccccc1C(=O)O", "c1ccccc1", "CCN(CC)CC",
+          "CC(C)Cc1ccc(cc1)C(C)C(=O)O", "O=C(O)c1ccccc1O", "CN1CCC[C@H]1c2cccnc2", "C1=CC=C(C=C1)O"]
+FUNCTION_NAMES = {DesirabilityFunctionTypes.custom_curve: "CustomCurveFunction",
+                  DesirabilityFunctionTypes.logarithmic: "LogarithmicFunction",
+                  DesirabilityFunctionTypes.logistic: "LogisticFunction",
+                  DesirabilityFunctionTypes.unit_step: "UnitStepFunction",
+                  DesirabilityFunctionTypes.linear: "LinearFunction",
+                  DesirabilityFunctionTypes.triangular: "TriangularFunction",
+                  DesirabilityFunctionTypes.rectangular: "RectangularFunction"}
+
+
+def column_ranges(columns: int, seed: int = 0) -> List[Tuple[float, float]]:
+    """
+    (center, spread) of every value column, values are uniform in center +- spread
+    """
+    rng = numpy.random.default_rng([seed, 0])
+    centers = rng.uniform(-200, 200, columns)
+    spreads = rng.choice([10.0, 100.0, 1000.0], columns) * rng.uniform(0.5, 1.5, columns)
+    return list(zip(centers.tolist(), spreads.tolist()))
+
+
+def column_functions(center: float, spread: float) -> Dict[DesirabilityFunctionTypes, DesirabilityFunction]:
+    """
+    Desirability functions of a value column, shaped like the ones in scoring_100_with_meta.csv
+    """
+    low, high = center - 0.8 * spread, center + 0.65 * spread
+    grid = numpy.linspace(low, high, 10).tolist()
+    middle = grid[5]
+    points = {
+        DesirabilityFunctionTypes.custom_curve: [{"x": x, "y": [1.0, 0.5, 0.0][index % 3]}
+                                                 for index, x in enumerate(grid)],
+        DesirabilityFunctionTypes.logarithmic: [{"x": low, "y": 0.0}, {"x": center + 0.8 * spread, "y": 1.0}],
+        DesirabilityFunctionTypes.logistic: [{"x": middle, "y": 1.0}],
+        DesirabilityFunctionTypes.unit_step: [{"x": middle, "y": 0.0}, {"x": middle, "y": 1.0}],
+        DesirabilityFunctionTypes.linear: [{"x": low, "y": 0.0}, {"x": high, "y": 1.0}],
+        DesirabilityFunctionTypes.triangular: [{"x": low, "y": 0.0}, {"x": middle, "y": 1.0}, {"x": high, "y": 0.0}],
+        DesirabilityFunctionTypes.rectangular: [{"x": low, "y": 0.0}, {"x": middle, "y": 1.0},
+                                                {"x": grid[7], "y": 0.8}, {"x": high, "y": 0.0}],
+    }
+    parameters = {DesirabilityFunctionTypes.logarithmic: {"base": 10},
+                  DesirabilityFunctionTypes.logistic: {"L": 1, "K": 3 / (spread / 100)}}
+    return {function_type: DesirabilityFunction(name=FUNCTION_NAMES[function_type], type=function_type,
+                                                points=points[function_type],
+                                                parameters=parameters.get(function_type, {}))
+            for function_type in FUNCTION_TYPES}
+
+
+def header(columns: int) -> List[str]:
+    names = ["CID"]
+    for index in range(1, columns + 1):
+        names.append(f"Column_{index}")
+        for function_type in FUNCTION_TYPES:
+            names += [f"Column_{index}_{function_type.value}", f"Column_{index}_{function_type.value}_parameter"]
+    return names + ["SMILES", "Scored_column"]
+
+
+def _quote(value: str) -> str:
+    return '"{}"'.format(value.replace('"', '""'))
+
+
+def _row_format(parameters: List[Dict[DesirabilityFunctionTypes, str]]) -> str:
+    row_format = ["%d"]
+    for column in parameters:
+        row_format.append("%.10f")
+        for function_type in FUNCTION_TYPES:
+            row_format += ["%.10g", column[function_type]]
+    return "\t".join(row_format + ["%s", "%.10g"]) + "\n"
+
+
+def generate_dataset(path: Union[str, Path], rows: int, columns: int = 3, seed: int = 0, block_rows: int = 100000,
+                     compress: bool = None, parameters_in_every_row: bool = True) -> Path:
+    """
+    Write a tab-separated dataset laid out like scoring_100_with_meta.csv
+
+    Rows are generated and written in blocks of block_rows, memory doesn't depend on the number of rows.
+    Output is the same for the same seed and block_rows.
+    compress: gzip the file, by default if path ends with .gz
+    parameters_in_every_row: the parameter JSON takes most of every row, write it only in the first row if False
+    """
+    path = Path(path)
+    compress = path.suffix == ".gz" if compress is None else compress
+    ranges = column_ranges(columns, seed)
+    functions = [column_functions(center, spread) for center, spread in ranges]
+    parameters = [{function_type: _quote(json.dumps(function.dict(exclude={"id"}), default=str))
+                   .replace("%", "%%") for function_type, function in column.items()} for column in functions]
+    first_row_format = _row_format(parameters)
+    if parameters_in_every_row:
+        row_format = first_row_format
+    else:
+        row_format = _row_format([{function_type: "" for function_type in FUNCTION_TYPES} for _ in parameters])
+    rng = numpy.random.default_rng([seed, 1])
+    smiles = numpy.array(SMILES, dtype=object)
+
+    opener = gzip.open if compress else open
+    with opener(path, "wt", newline="") as file:
+        file.write("\t".join(header(columns)) + "\n")
+        for start in range(0, rows, block_rows):
+            size = min(block_rows, rows - start)
+            block = [numpy.arange(start, start + size)]
+            scored = numpy.zeros(size)
+            for (center, spread), column in zip(ranges, functions):
+                values = rng.uniform(center - spread, center + spread, size)
+                block.append(values)
+                for function_type in FUNCTION_TYPES:
+                    desirability = evaluate(column[function_type], values)
+                    block.append(desirability)
+                    if function_type == SCORED_FUNCTION_TYPE:
+                        scored += desirability
+            block.append(smiles[rng.integers(0, len(SMILES), size)])
+            block.append(scored / columns)
+            block_values = zip(*(item.tolist() for item in block))
+            if start == 0:
+                file.write(first_row_format % next(block_values))
+            file.write("".join(row_format % row for row in block_values))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset laid out like scoring_100_with_meta.csv")
+    parser.add_argument("path", help="output file, gzipped if it ends with .gz")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--columns", type=int, default=3, help="value columns, each adds 15 columns")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--block-rows", type=int, default=100000)
+    parser.add_argument("--gzip", action="store_true", default=None)
+    parser.add_argument("--parameters-in-first-row", action="store_true",
+                        help="write desirability function parameters only in the first row")
+    arguments = parser.parse_args()
+    generate_dataset(arguments.path, arguments.rows, arguments.columns, arguments.seed, arguments.block_rows,
+                     arguments.gzip, not arguments.parameters_in_first_row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+import json
+import time
+
+from array import array
+from itertools import accumulate
+from json import JSONDecodeError
+from typing import Dict, List, Any, Callable, Type, Tuple, Union, Iterator
+
+import numpy
+
+from pydantic import BaseModel
+
+from models import (ComplexValue, CustomDatasetColumn, DatasetColumn, DatasetExtendedCardOut, DatasetPagination,
+                    RenderedImages, ResultModel, ScoringResults, Task)
+from tracing import record_phase
+
+JSON_BACKENDS = ("json", "orjson", "msgspec")
+MODEL_KINDS = ("pydantic", "struct", "compact")
+_REQUIRED = object()
+
+
+def json_loads(backend: str = "json") -> Callable[[bytes], Any]:
+    """
+    loads(bytes) of a JSON backend, every one raises json.JSONDecodeError on malformed input
+    "auto" is the fastest installed one
+    """
+    if backend == "auto":
+        for backend in reversed(JSON_BACKENDS):
+            try:
+                return json_loads(backend)
+            except ImportError:
+                continue
+    assert backend in JSON_BACKENDS, f"Unknown JSON backend {backend}, use one of {JSON_BACKENDS} or auto"
+    if backend == "orjson":
+        import orjson
+        # orjson.JSONDecodeError is a json.JSONDecodeError
+        return orjson.loads
+    if backend == "msgspec":
+        import msgspec
+        decode = msgspec.json.decode
+
+        def loads(content: bytes) -> Any:
+            try:
+                return decode(content)
+            except msgspec.DecodeError as error:
+                raise JSONDecodeError(str(error), "", 0) from error
+        return loads
+    return json.loads
+
+
+class Struct:
+    """
+    Compact read-only stand-in of a pydantic model: attributes of the model fields in __slots__,
+    filled from decoded JSON without validation or coercion
+
+    Subclasses set `model` and `nested` ({attribute: converter of the raw value}); fields, JSON keys
+    and defaults come from the pydantic model.
+    """
+    __slots__ = ()
+    model: Type[BaseModel] = None
+    nested: Dict[str, Callable[[Any], Any]] = {}
+    fields: Tuple[Tuple[str, str, Any], ...] = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        slots = {slot for klass in cls.__mro__ for slot in getattr(klass, "__slots__", ())}
+        assert slots == set(cls.model.__fields__), f"{cls.__name__} slots don't match {cls.model}"
+        cls.fields = tuple((name, field.alias, _REQUIRED if field.required else field.default)
+                           for name, field in cls.model.__fields__.items())
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "Struct":
+        struct = cls.__new__(cls)
+        for name, key, default in cls.fields:
+            value = data[key] if default is _REQUIRED else data.get(key, default)
+            converter = cls.nested.get(name)
+            setattr(struct, name, converter(value) if converter is not None and value is not None else value)
+        return struct
+
+    def _values(self, by_alias: bool) -> Dict[str, Any]:
+        return {key if by_alias else name: _plain(getattr(self, name), by_alias) for name, key, _ in self.fields}
+
+    def dict(self) -> Dict[str, Any]:
+        return self._values(by_alias=False)
+
+    def to_model(self) -> BaseModel:
+        """
+        Validated pydantic model of the same data
+        """
+        return self.model(**self._values(by_alias=True))
+
+    def __eq__(self, other) -> bool:
+        return type(other) is type(self) and all(getattr(self, name) == getattr(other, name)
+                                                 for name, _, _ in self.fields)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{name}={getattr(self, name)!r}' for name, _, _ in self.fields)})"
+
+
+def _plain(value: Any, by_alias: bool) -> Any:
+    if isinstance(value, Struct):
+        return value._values(by_alias)
+    if isinstance(value, (list, CompactValues)):
+        return [_plain(item, by_alias) for item in value]
+    return value
+
+
+class ComplexValueStruct(Struct):
+    __slots__ = ("order", "value")
+    model = ComplexValue
+
+    def __init__(self, order: int, value: str):
+        self.order = order
+        self.value = value
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "ComplexValueStruct":
+        return cls(data["order"], data["value"])
+
+
+def _complex_values(cells: List[Dict[str, Any]]) -> List[ComplexValueStruct]:
+    return [ComplexValueStruct(cell["order"], cell["value"]) for cell in cells]
+
+
+class DatasetColumnStruct(Struct):
+    __slots__ = ("id", "name", "values", "visible", "pinned", "scored", "numeric", "max", "min", "color",
+                 "model_type")
+    model = DatasetColumn
+    nested = {"values": _complex_values}
+
+
+class CustomDatasetColumnStruct(Struct):
+    __slots__ = ("id", "name", "values", "visible", "pinned", "scored", "numeric", "max", "min", "ordinal_number",
+                 "color", "model_type", "custom_formula")
+    model = CustomDatasetColumn
+    nested = {"values": _complex_values}
+
+
+def _is_custom(column: Dict[str, Any]) -> bool:
+    # formula columns may come without values, DatasetColumn requires them
+    return column.get("model_type") == "custom_dataset_column" or "values" not in column
+
+
+def _columns(columns: List[Dict[str, Any]]) -> List[Union[DatasetColumnStruct, CustomDatasetColumnStruct]]:
+    return [(CustomDatasetColumnStruct if _is_custom(column) else DatasetColumnStruct).from_json(column)
+            for column in columns]
+
+
+class DatasetExtendedCardStruct(Struct):
+    __slots__ = ("user_id", "name", "id", "dataset_id", "rows_num", "cols_num", "missing_num", "upload_date",
+                 "allocated_memory", "delimiter", "deleted_at", "associated_scoring_template_id",
+                 "associated_scoring_template_name", "model_type")
+    model = DatasetExtendedCardOut
+
+
+def _task_result(result: Any) -> Any:
+    if isinstance(result, dict) and "dataset_id" in result and "user_id" in result:
+        return DatasetExtendedCardStruct.from_json(result)
+    return result
+
+
+class TaskStruct(Struct):
+    __slots__ = ("id", "status", "meta", "result")
+    model = Task
+    nested = {"result": _task_result}
+
+
+class ScoringResultsStruct(Struct):
+    __slots__ = ("column_meta", "counted_columns", "scored_column")
+    model = ScoringResults
+    nested = {"counted_columns": _columns}
+
+
+class DatasetPaginationStruct(Struct):
+    __slots__ = ("user_id", "columns", "allocated_memory", "associated_scored_dataset_id",
+                 "associated_scoring_template_id", "associated_scoring_template_md5_hash", "columns_order",
+                 "delimiter", "id", "model_type", "name", "rows_order", "upload_date")
+    model = DatasetPagination
+    nested = {"columns": _columns}
+
+
+class RenderedImagesStruct(Struct):
+    __slots__ = ("values",)
+    model = RenderedImages
+    nested = {"values": _complex_values}
+
+
+class ResultModelStruct(Struct):
+    __slots__ = ("dataset", "radar", "scored", "rendered_images")
+    model = ResultModel
+    nested = {"dataset": DatasetPaginationStruct.from_json,
+              "scored": ScoringResultsStruct.from_json,
+              "rendered_images": RenderedImagesStruct.from_json}
+
+
+class CompactValues:
+    """
+    Cells of a column in three flat buffers: orders in an int64 array, values utf-8 encoded back to back
+    in one bytes object and their end offsets in another int64 array
+
+    A cell takes 16 bytes plus its encoded value instead of a ComplexValue object with two boxed fields.
+    Indexing and iteration build ComplexValueStruct views on demand.
+    """
+    __slots__ = ("orders", "offsets", "buffer")
+
+    def __init__(self, orders: array, offsets: array, buffer: bytes):
+        self.orders = orders
+        self.offsets = offsets
+        self.buffer = buffer
+
+    @classmethod
+    def from_cells(cls, cells: List[Dict[str, Any]]) -> "CompactValues":
+        encoded = [value.encode() if isinstance(value, str) else str(value).encode()
+                   for value in (cell["value"] for cell in cells)]
+        return cls(array("q", [cell["order"] for cell in cells]), array("q", accumulate(map(len, encoded))),
+                   b"".join(encoded))
+
+    def __len__(self) -> int:
+        return len(self.orders)
+
+    def value(self, index: int) -> str:
+        if index < 0:
+            index += len(self.orders)
+        start = self.offsets[index - 1] if index else 0
+        return self.buffer[start:self.offsets[index]].decode()
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[ComplexValueStruct, List[ComplexValueStruct]]:
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self.orders)))]
+        return ComplexValueStruct(self.orders[index], self.value(index))
+
+    def __iter__(self) -> Iterator[ComplexValueStruct]:
+        start = 0
+        for order, end in zip(self.orders, self.offsets):
+            yield ComplexValueStruct(order, self.buffer[start:end].decode())
+            start = end
+
+    def strings(self) -> List[str]:
+        """
+        All values as str
+        """
+        buffer, start, values = self.buffer, 0, []
+        for end in self.offsets:
+            values.append(buffer[start:end].decode())
+            start = end
+        return values
+
+    def orders_array(self) -> numpy.ndarray:
+        """
+        Orders as an int64 numpy array sharing memory with the column
+        """
+        return numpy.frombuffer(self.orders, dtype=numpy.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.buffer) + (len(self.orders) + len(self.offsets)) * self.orders.itemsize
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CompactValues):
+            return self.orders == other.orders and self.offsets == other.offsets and self.buffer == other.buffer
+        try:
+            return len(other) == len(self) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return False
+
+    def __repr__(self) -> str:
+        return f"CompactValues({len(self)} cells, {self.nbytes} bytes)"
+
+
+class CompactColumnStruct(DatasetColumnStruct):
+    __slots__ = ()
+    nested = {"values": CompactValues.from_cells}
+
+
+class CompactCustomColumnStruct(CustomDatasetColumnStruct):
+    __slots__ = ()
+    nested = {"values": CompactValues.from_cells}
+
+
+def _compact_columns(columns: List[Dict[str, Any]]) -> List[Union[CompactColumnStruct, CompactCustomColumnStruct]]:
+    return [(CompactCustomColumnStruct if _is_custom(column) else CompactColumnStruct).from_json(column)
+            for column in columns]
+
+
+class CompactScoringResultsStruct(ScoringResultsStruct):
+    __slots__ = ()
+    nested = {"counted_columns": _compact_columns}
+
+
+class CompactDatasetPaginationStruct(DatasetPaginationStruct):
+    __slots__ = ()
+    nested = {"columns": _compact_columns}
+
+
+class CompactResultModelStruct(ResultModelStruct):
+    __slots__ = ()
+    nested = {"dataset": CompactDatasetPaginationStruct.from_json,
+              "scored": CompactScoringResultsStruct.from_json,
+              "rendered_images": RenderedImagesStruct.from_json}
+
+
+STRUCTS: Dict[Type[BaseModel], Type[Struct]] = {
+    struct.model: struct for struct in (ComplexValueStruct, DatasetColumnStruct, DatasetExtendedCardStruct,
+                                        TaskStruct, ScoringResultsStruct, DatasetPaginationStruct,
+                                        RenderedImagesStruct, ResultModelStruct)}
+COMPACT_STRUCTS: Dict[Type[BaseModel], Type[Struct]] = {
+    **STRUCTS, **{struct.model: struct for struct in (CompactColumnStruct, CompactScoringResultsStruct,
+                                                       CompactDatasetPaginationStruct, CompactResultModelStruct)}}
+
+
+class Decoder:
+    """
+    Turns response bodies into models
+
+    json_backend: one of JSON_BACKENDS or "auto"
+    models: "pydantic" builds the validated models of models.py,
+        "struct" builds STRUCTS for the models that have one (attributes and nesting match the pydantic models,
+        nothing is validated or coerced) and pydantic models for the others,
+        "compact" is "struct" with column values held in CompactValues
+    """
+    def __init__(self, json_backend: str = "json", models: str = "pydantic"):
+        assert models in MODEL_KINDS, f"Unknown model kind {models}, use one of {MODEL_KINDS}"
+        self.json_backend = json_backend
+        self.models = models
+        self.loads = json_loads(json_backend)
+        self.structs = {"struct": STRUCTS, "compact": COMPACT_STRUCTS}.get(models, {})
+
+    def build(self, model: Type[BaseModel], data: Any) -> Any:
+        struct = self.structs.get(model)
+        if struct is not None:
+            return struct.from_json(data)
+        return model(**data)
+
+    def decode(self, response: Any, model: Type[BaseModel] = None, many: bool = False) -> Any:
+        """
+        Body of a response built into model, a list of them if many; the decoded JSON if model is None
+        """
+        started = time.perf_counter()
+        data = self.loads(response.content)
+        record_phase("decode", time.perf_counter() - started)
+        if model is None:
+            return data
+        if many:
+            return [self.build(model, item) for item in data]
+        return self.build(model, data)
+
+
+_decoder = Decoder()
+
+
+def get_decoder() -> Decoder:
+    return _decoder
+
+
+def set_decoder(decoder: Decoder) -> Decoder:
+    """
+    Replace the decoder of endpoint wrappers, returns the previous one
+    """
+    global _decoder
+    previous, _decoder = _decoder, decoder
+    return previous
+
+
+def configure_decoding(json_backend: str = "auto", models: str = "pydantic") -> Decoder:
+    """
+    e.g. configure_decoding("orjson", "struct") for the least CPU per call
+    """
+    set_decoder(Decoder(json_backend, models))
+    return _decoder
+
+
+def decode_response(response: Any, model: Type[BaseModel] = None, many: bool = False) -> Any:
+    return _decoder.decode(response, model, many)
@@ -0,0 +1,138 @@
+from typing import Dict, List, Mapping, Union, Iterable, Optional
+
+import numpy
+
+from models import DesirabilityFunction, DesirabilityFunctionTypes, MissingValues, MissingValuesTypes, \
+    TemplateProperty, RequestTemplateProperty, Threshold
+
+Property = Union[TemplateProperty, RequestTemplateProperty]
+
+
+def _points(function: DesirabilityFunction):
+    points = sorted((point for point in function.points or [] if point.x is not None),
+                    key=lambda point: point.x)
+    assert points, f"Desirability function {function.name} has no points"
+    return (numpy.array([point.x for point in points], dtype=numpy.float64),
+            numpy.array([point.y if point.y is not None else 0.0 for point in points], dtype=numpy.float64))
+
+
+def _piecewise_linear(function: DesirabilityFunction, x: numpy.ndarray) -> numpy.ndarray:
+    xs, ys = _points(function)
+    return numpy.interp(x, xs, ys)
+
+
+def _logarithmic(function: DesirabilityFunction, x: numpy.ndarray) -> numpy.ndarray:
+    xs, ys = _points(function)
+    base = float((function.parameters or {}).get("base", 10))
+    share = numpy.clip((x - xs[0]) / (xs[-1] - xs[0]), 0, 1)
+    return ys[0] + (ys[-1] - ys[0]) * numpy.log1p((base - 1) * share) / numpy.log(base)
+
+
+def _logistic(function: DesirabilityFunction, x: numpy.ndarray) -> numpy.ndarray:
+    xs, ys = _points(function)
+    parameters = function.parameters or {}
+    maximum = float(parameters.get("L", ys[0]))
+    steepness = float(parameters.get("K", 1))
+    with numpy.errstate(over="ignore"):
+        return maximum / (1 + numpy.exp(-steepness * (x - xs[0])))
+
+
+def _unit_step(function: DesirabilityFunction, x: numpy.ndarray) -> numpy.ndarray:
+    points = [point for point in function.points or [] if point.x is not None]
+    assert points, f"Desirability function {function.name} has no points"
+    below = points[0].y if points[0].y is not None else 0.0
+    above = points[-1].y if points[-1].y is not None else 1.0
+    return numpy.where(x < points[0].x, below, above).astype(numpy.float64)
+
+
+FUNCTIONS = {
+    DesirabilityFunctionTypes.linear: _piecewise_linear,
+    DesirabilityFunctionTypes.logarithmic: _logarithmic,
+    DesirabilityFunctionTypes.rectangular: _piecewise_linear,
+    DesirabilityFunctionTypes.triangular: _piecewise_linear,
+    DesirabilityFunctionTypes.unit_step: _unit_step,
+    DesirabilityFunctionTypes.logistic: _logistic,
+    DesirabilityFunctionTypes.custom_curve: _piecewise_linear,
+}
+
+
+def evaluate(function: Union[DesirabilityFunction, Dict], x: Iterable[float]) -> numpy.ndarray:
+    """
+    Desirability of every value of a column, NaN stays NaN
+
+    linear, triangular, rectangular and custom_curve interpolate between points and keep the outermost y
+    outside of them; logarithmic maps the points range to log_base(1 + (base - 1) * share);
+    logistic is L / (1 + exp(-K * (x - x0))); unit_step switches from the first point y to the last one at x0.
+    """
+    if isinstance(function, dict):
+        function = DesirabilityFunction(**function)
+    x = numpy.asarray(x, dtype=numpy.float64)
+    result = FUNCTIONS[DesirabilityFunctionTypes(function.type)](function, x)
+    return numpy.where(numpy.isnan(x), numpy.nan, result)
+
+
+def apply_threshold(threshold: Optional[Threshold], x: numpy.ndarray, desirability: numpy.ndarray) -> numpy.ndarray:
+    """
+    Values outside of the threshold get zero desirability
+    """
+    if threshold is None:
+        return desirability
+    outside = numpy.zeros(x.shape, dtype=bool)
+    if threshold.min is not None:
+        outside |= x < threshold.min
+    if threshold.max is not None:
+        outside |= x > threshold.max
+    return numpy.where(outside, 0.0, desirability)
+
+
+def _fill_missing(missing: MissingValues, strategy: MissingValuesTypes, x: numpy.ndarray,
+                  columns: Mapping[str, numpy.ndarray], function: DesirabilityFunction) -> numpy.ndarray:
+    """
+    Desirability with missing x handled by a strategy, rows left NaN are not calculated
+    """
+    absent = numpy.isnan(x)
+    if strategy == MissingValuesTypes.default_x:
+        return evaluate(function, numpy.where(absent, missing.value, x))
+    desirability = evaluate(function, x)
+    if strategy == MissingValuesTypes.default_y:
+        return numpy.where(absent, missing.value, desirability)
+    if strategy == MissingValuesTypes.swap:
+        swapped = numpy.asarray(columns[missing.swap_column], dtype=numpy.float64)
+        swapped_desirability = _fill_missing(missing, MissingValuesTypes(missing.swap_type), swapped, columns,
+                                             function)
+        return numpy.where(absent, swapped_desirability, desirability)
+    return desirability
+
+
+def score_property(template_property: Property, columns: Mapping[str, Iterable[float]]) -> numpy.ndarray:
+    """
+    Desirability of the property column with its missing values strategy and threshold applied
+    """
+    x = numpy.asarray(columns[template_property.column_name], dtype=numpy.float64)
+    missing = template_property.missing_values or MissingValues()
+    desirability = _fill_missing(missing, MissingValuesTypes(missing.type), x, columns,
+                                 template_property.desirability_function)
+    return apply_threshold(template_property.threshold, x, desirability)
+
+
+def score(properties: List[Property], columns: Mapping[str, Iterable[float]]) -> numpy.ndarray:
+    """
+    Scored column of a template: importance weighted mean of desirabilities of properties enabled for scoring
+
+    NaN marks rows the service reports as 'nonquantifiable'.
+    """
+    enabled = [item for item in properties if item.enabled_for_scoring]
+    assert enabled, "No properties enabled for scoring"
+    weights = numpy.array([item.importance if item.importance is not None else 1 for item in enabled],
+                          dtype=numpy.float64)
+    desirabilities = numpy.vstack([score_property(item, columns) for item in enabled])
+    return weights @ desirabilities / weights.sum()
+
+
+def to_scored_column(scores: numpy.ndarray, decimals: int = None) -> List[Union[float, str]]:
+    """
+    Scores in the ScoringResults.scored_column format
+    """
+    if decimals is not None:
+        scores = numpy.round(scores, decimals)
+    return ['nonquantifiable' if numpy.isnan(value) else float(value) for value in scores]
@@ -0,0 +1,305 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional, List, Dict, Set, Tuple, Iterator
+from urllib.parse import urlsplit
+
+from pydantic import BaseModel, Field
+
+import scoring_api
+from decoding import decode_response
+from transport import get_transport
+
+FEEDBACK_URL = "/api/feedback/user-feedback"
+MANIFEST = "manifest.json"
+WINDOWS = "windows"
+SCREENSHOTS = "screenshots"
+EXPORT = "feedback.ndjson"
+CHUNK_SIZE = 1 << 16
+
+
+class ExportWindow(BaseModel):
+    after: str = Field(..., title='First day of the window, yyyy-mm-dd (inclusive)')
+    before: str = Field(..., title='Day after the window, yyyy-mm-dd (exclusive)')
+    items: int = Field(0, title='Feedback items')
+    digest: str = Field('', title='sha256 of the response body')
+    fetched_at: Optional[str] = Field(None, title='UTC time of the last fetch')
+    closed: bool = Field(False, title='The window ended before the fetch day, no feedback can be added to it')
+
+    @property
+    def key(self) -> str:
+        return f"{self.after}_{self.before}"
+
+
+class ExportManifest(BaseModel):
+    windows: Dict[str, ExportWindow] = Field({}, title='Exported windows by key')
+
+
+class FeedbackExportReport(BaseModel):
+    windows: int = Field(0, title='Windows of the range')
+    fetched: int = Field(0, title='Windows requested from the API')
+    changed: int = Field(0, title='Fetched windows that were new or differed from the previous export')
+    skipped: int = Field(0, title='Closed windows kept from the previous export')
+    failed: int = Field(0, title='Windows that could not be fetched, retried by the next run')
+    items: int = Field(0, title='Feedback items in the export')
+    screenshots: int = Field(0, title='Screenshots downloaded')
+    screenshots_cached: int = Field(0, title='Screenshots already on disk or repeated in the export')
+    screenshots_failed: int = Field(0, title='Screenshots that could not be downloaded')
+    errors: List[str] = Field([], title='First errors')
+    wall_time: float = Field(0, title='Seconds')
+
+    def summary(self) -> str:
+        return (f"{self.items} feedback items in {self.windows} windows: {self.fetched} fetched ({self.changed} "
+                f"changed), {self.skipped} kept, {self.failed} failed; {self.screenshots} screenshots downloaded, "
+                f"{self.screenshots_cached} cached, {self.screenshots_failed} failed in {self.wall_time:.1f}s")
+
+
+def date_windows(after: date, before: date, days: int) -> List[Tuple[date, date]]:
+    """
+    [after, before) split into consecutive windows of `days` days, the last one may be shorter
+    """
+    assert days > 0, f"Window must be at least a day long, got {days}"
+    windows = []
+    start = after
+    while start < before:
+        end = min(start + timedelta(days=days), before)
+        windows.append((start, end))
+        start = end
+    return windows
+
+
+def screenshot_path(output: Path, url: str) -> Path:
+    """
+    File a screenshot is saved to, the same URL always maps to the same file
+    """
+    suffix = Path(urlsplit(url).path).suffix or ".bin"
+    return Path(output) / SCREENSHOTS / f"{hashlib.sha1(url.encode()).hexdigest()}{suffix}"
+
+
+def _write_atomic(path: Path, content: bytes):
+    temporary = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    temporary.write_bytes(content)
+    temporary.replace(path)
+
+
+class FeedbackExport:
+    """
+    Export of the feedback posted in a date range into an output directory
+
+        windows/<after>_<before>.ndjson  feedback of a window, one JSON item per line
+        feedback.ndjson                  all windows in date order
+        screenshots/<sha1 of url>.png    screenshots, downloaded once per URL
+        manifest.json                    exported windows, saved after every window
+
+    Windows are fetched concurrently and written as they arrive; at most `workers` responses are held in memory
+    at a time and at most twice `screenshot_workers` screenshots are pending, fetching waits for a free slot.
+    A re-run keeps closed windows of the previous export and fetches the others: new, failed or still open
+    windows (ending on or after the day they were fetched), all of them if refresh.
+    """
+    def __init__(self, output: Path, window_days: int = 30, workers: int = 8, screenshots: bool = False,
+                 screenshot_workers: int = 8, refresh: bool = False):
+        self.output = Path(output)
+        self.window_days = window_days
+        self.workers = max(1, workers)
+        self.screenshots = screenshots
+        self.screenshot_workers = max(1, screenshot_workers)
+        self.refresh = refresh
+        self.report = FeedbackExportReport()
+        self._lock = threading.Lock()
+        self._seen: Set[str] = set()
+        self._download_slots = threading.BoundedSemaphore(2 * self.screenshot_workers)
+        self._screenshot_executor: Optional[ThreadPoolExecutor] = None
+        path = self.output / MANIFEST
+        self.manifest = ExportManifest.parse_file(path) if path.exists() else ExportManifest()
+
+    def window_path(self, window: ExportWindow) -> Path:
+        return self.output / WINDOWS / f"{window.key}.ndjson"
+
+    def _error(self, message: str):
+        with self._lock:
+            if len(self.report.errors) < 20:
+                self.report.errors.append(message)
+
+    def _save_manifest(self):
+        with self._lock:
+            content = self.manifest.json(indent=2).encode()
+        _write_atomic(self.output / MANIFEST, content)
+
+    def current(self, window: ExportWindow) -> bool:
+        """
+        The window was exported by a previous run and can't have changed since
+        """
+        previous = self.manifest.windows.get(window.key)
+        return not self.refresh and previous is not None and previous.closed and self.window_path(window).exists()
+
+    def fetch(self, window: ExportWindow):
+        """
+        Request a window and replace its file if the response differs from the exported one
+        """
+        response = scoring_api.send_request(FEEDBACK_URL, "get", {"after": window.after, "before": window.before})
+        fetched_at = datetime.utcnow()
+        window.digest = hashlib.sha256(response.content).hexdigest()
+        window.fetched_at = fetched_at.isoformat()
+        window.closed = date.fromisoformat(window.before) < fetched_at.date()
+        previous = self.manifest.windows.get(window.key)
+        changed = previous is None or previous.digest != window.digest or not self.window_path(window).exists()
+        items = decode_response(response)
+        del response
+        window.items = len(items)
+        if changed:
+            content = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode()
+            _write_atomic(self.window_path(window), content)
+            del content
+        if self.screenshots:
+            self.download_screenshots(url for item in items for url in _screenshot_urls(item))
+        with self._lock:
+            self.manifest.windows[window.key] = window
+            self.report.fetched += 1
+            self.report.changed += changed
+        self._save_manifest()
+
+    def download_screenshots(self, urls: Iterator[str]):
+        for url in urls:
+            with self._lock:
+                if url in self._seen:
+                    self.report.screenshots_cached += 1
+                    continue
+                self._seen.add(url)
+            # the queue of a multi-year export would grow without bound, finished futures aren't kept
+            self._download_slots.acquire()
+            future = self._screenshot_executor.submit(self.download_screenshot, url)
+            future.add_done_callback(lambda _: self._download_slots.release())
+
+    def download_screenshot(self, url: str):
+        path = screenshot_path(self.output, url)
+        if path.exists():
+            with self._lock:
+                self.report.screenshots_cached += 1
+            return
+        temporary = path.with_name(f".{path.name}.tmp")
+        try:
+            with get_transport().request("get", url, stream=True) as response:
+                assert response.status_code == 200, f"Screenshot {url} returned {response.status_code}"
+                with open(temporary, "wb") as file:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        file.write(chunk)
+            temporary.replace(path)
+        except Exception as error:
+            temporary.unlink(missing_ok=True)
+            self._error(f"{url}: {error!r}")
+            with self._lock:
+                self.report.screenshots_failed += 1
+            return
+        with self._lock:
+            self.report.screenshots += 1
+
+    def _kept(self, window: ExportWindow):
+        with self._lock:
+            self.report.skipped += 1
+        if self.screenshots:
+            with open(self.window_path(window), encoding="utf-8") as file:
+                self.download_screenshots(url for line in file for url in _screenshot_urls(json.loads(line)))
+
+    def _fetched(self, window: ExportWindow, future: Future):
+        try:
+            future.result()
+        except Exception as error:
+            self._error(f"{window.key}: {error!r}")
+            with self._lock:
+                self.report.failed += 1
+
+    def run(self, after: date, before: date) -> FeedbackExportReport:
+        started = time.perf_counter()
+        (self.output / WINDOWS).mkdir(parents=True, exist_ok=True)
+        if self.screenshots:
+            (self.output / SCREENSHOTS).mkdir(exist_ok=True)
+        windows = [ExportWindow(after=f"{start}", before=f"{end}")
+                   for start, end in date_windows(after, before, self.window_days)]
+        self.report.windows = len(windows)
+        with ThreadPoolExecutor(self.screenshot_workers, thread_name_prefix="feedback-screenshot") as screenshots, \
+                ThreadPoolExecutor(self.workers, thread_name_prefix="feedback-window") as executor:
+            self._screenshot_executor = screenshots
+            running: Dict[Future, ExportWindow] = {}
+            for window in windows:
+                if self.current(window):
+                    self._kept(window)
+                    continue
+                # submit lazily, at most `workers` responses are held at once
+                while len(running) >= self.workers:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._fetched(running.pop(future), future)
+                running[executor.submit(self.fetch, window)] = window
+            for future in list(running):
+                self._fetched(running.pop(future), future)
+        # leaving the executors waited for the last screenshots
+        self._save_manifest()
+        self.report.items = self.combine(windows)
+        self.report.wall_time = time.perf_counter() - started
+        return self.report
+
+    def combine(self, windows: List[ExportWindow]) -> int:
+        """
+        Concatenate exported windows into feedback.ndjson in date order, returns the number of items
+        """
+        items = 0
+        temporary = self.output / f".{EXPORT}.tmp"
+        with open(temporary, "wb") as export:
+            for window in windows:
+                path = self.window_path(window)
+                if not path.exists():
+                    continue
+                with open(path, "rb") as file:
+                    for line in file:
+                        export.write(line)
+                        items += 1
+        os.replace(temporary, self.output / EXPORT)
+        return items
+
+
+def _screenshot_urls(item: Dict) -> List[str]:
+    screenshots = item.get("screenshots") or []
+    return [screenshots] if isinstance(screenshots, str) else [url for url in screenshots if url]
+
+
+def export_feedback(after: date, before: date, output: Path, window_days: int = 30, workers: int = 8,
+                    screenshots: bool = False, screenshot_workers: int = 8,
+                    refresh: bool = False) -> FeedbackExportReport:
+    """
+    Export the feedback posted in [after, before) to output, see FeedbackExport
+    """
+    return FeedbackExport(output, window_days, workers, screenshots, screenshot_workers, refresh).run(after, before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export user feedback of a date range to NDJSON")
+    parser.add_argument("after", type=date.fromisoformat, help="first day, yyyy-mm-dd")
+    parser.add_argument("before", type=date.fromisoformat, nargs="?", default=date.today() + timedelta(days=1),
+                        help="day after the last one, tomorrow by default")
+    parser.add_argument("--output", required=True, help="export directory, a previous export there is updated")
+    parser.add_argument("--env", help="host to export from, variables.ENV by default")
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=8, help="windows fetched at once")
+    parser.add_argument("--screenshots", action="store_true", help="download screenshots of the feedback")
+    parser.add_argument("--screenshot-workers", type=int, default=8)
+    parser.add_argument("--refresh", action="store_true", help="fetch closed windows of a previous export too")
+    options = parser.parse_args()
+    if options.env:
+        scoring_api.set_environment(options.env)
+    report = export_feedback(options.after, options.before, Path(options.output), options.window_days,
+                             options.workers, options.screenshots, options.screenshot_workers, options.refresh)
+    print(report.summary())
+    for error in report.errors:
+        print(error)
+    raise SystemExit(1 if report.failed or report.screenshots_failed else 0)
+
+
+if __name__ == "__main__":
+    main()
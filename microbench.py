@@ -0,0 +1,149 @@
+import argparse
+import gc
+import json
+import random
+import statistics
+import time
+import tracemalloc
+
+from types import SimpleNamespace
+from typing import Dict, List, Any, Callable
+
+from pydantic import BaseModel, Field
+
+from decoding import Decoder, JSON_BACKENDS, MODEL_KINDS
+from models import ResultModel
+
+
+class Measurement(BaseModel):
+    name: str = Field(..., title='Measured step')
+    seconds: float = Field(..., title='Median seconds of a run')
+    peak_bytes: int = Field(..., title='Peak traced memory of a run')
+    retained_bytes: int = Field(..., title='Memory held by the result')
+    retained_blocks: int = Field(..., title='Allocations held by the result')
+    cells: int = Field(0, title='Cells in the result, 0 if not applicable')
+
+    @property
+    def bytes_per_cell(self) -> float:
+        return self.retained_bytes / self.cells if self.cells else 0.0
+
+    def __str__(self):
+        per_cell = f"{self.bytes_per_cell:>9.1f}" if self.cells else f"{'':>9}"
+        return (f"{self.name:<36}{self.seconds * 1000:>10.2f}{self.peak_bytes / 2 ** 20:>10.2f}"
+                f"{self.retained_bytes / 2 ** 20:>10.2f}{self.retained_blocks:>10}{per_cell}")
+
+
+HEADER = f"{'step':<36}{'ms':>10}{'peak MiB':>10}{'held MiB':>10}{'blocks':>10}{'B/cell':>9}"
+
+
+def result_model_payload(columns: int = 100, rows: int = 1000, seed: int = 0) -> Dict[str, Any]:
+    """
+    /result_model body of a page with `rows` rows of numeric columns, as the backend sends it
+    """
+    generator = random.Random(seed)
+    names = [f"Column_{index}" for index in range(1, columns + 1)]
+    rows_order = list(range(rows))
+    generator.shuffle(rows_order)
+    return {"dataset": {"user_id": "user", "allocated_memory": columns * rows * 8,
+                        "associated_scored_dataset_id": "scored", "associated_scoring_template_id": "template",
+                        "associated_scoring_template_md5_hash": "hash", "columns_order": list(range(columns)),
+                        "delimiter": "\t", "id": "dataset", "model_type": "dataset", "name": "bench.csv",
+                        "rows_order": rows_order, "upload_date": "2022-01-01T00:00:00",
+                        "columns": [{"_id": f"dataset-{index}", "name": name, "visible": True, "pinned": False,
+                                     "scored": False, "numeric": True, "max": "", "min": "", "color": "",
+                                     "model_type": "dataset_column",
+                                     "values": [{"order": row, "value": f"{generator.uniform(0, 1000):.4f}"}
+                                                for row in rows_order]}
+                                    for index, name in enumerate(names)]},
+            "radar": None,
+            "scored": {"column_meta": [], "counted_columns": [],
+                       "scored_column": [round(generator.random(), 6) for _ in rows_order]},
+            "rendered_images": {"values": []}}
+
+
+def measure(name: str, function: Callable[[], Any], repeats: int = 5, cells: int = 0) -> Measurement:
+    """
+    Median time of function() over repeats, then its allocations in one run under tracemalloc
+    """
+    times = []
+    for _ in range(max(1, repeats)):
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    gc.collect()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    blocks = sum(item.count_diff for item in after.compare_to(before, "filename"))
+    del result
+    return Measurement(name=name, seconds=statistics.median(times), peak_bytes=peak - baseline,
+                       retained_bytes=current - baseline, retained_blocks=blocks, cells=cells)
+
+
+def decoding_benchmark(columns: int = 100, rows: int = 1000, repeats: int = 5) -> List[Measurement]:
+    """
+    Decode time and allocations of a result_model body with every installed JSON backend and model kind
+    """
+    body = json.dumps(result_model_payload(columns, rows)).encode()
+    cells = columns * rows
+    measurements = []
+    for backend in JSON_BACKENDS:
+        try:
+            decoder = Decoder(backend)
+        except ImportError:
+            continue
+        measurements.append(measure(f"loads[{backend}]", lambda: decoder.loads(body), repeats, cells))
+    data = Decoder("json").loads(body)
+    for kind in MODEL_KINDS:
+        decoder = Decoder(models=kind)
+        measurements.append(measure(f"build[{kind}]", lambda: decoder.build(ResultModel, data), repeats, cells))
+    return measurements
+
+
+def memory_benchmark(columns: int = 100, rows: int = 1000, repeats: int = 3) -> List[Measurement]:
+    """
+    Memory held by a decoded result_model of every model kind once the decoded JSON is gone
+    """
+    response = SimpleNamespace(content=json.dumps(result_model_payload(columns, rows)).encode())
+    return [measure(f"result_model[{kind}]", lambda: Decoder(models=kind).decode(response, ResultModel), repeats,
+                    columns * rows)
+            for kind in MODEL_KINDS]
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Client-side decode micro-benchmarks of result_model payloads")
+    parser.add_argument("--columns", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="save the measurements as JSON")
+    options = parser.parse_args(arguments)
+    measurements = decoding_benchmark(options.columns, options.rows, options.repeats)
+    print(f"result_model of {options.columns} columns x {options.rows} rows")
+    print(HEADER)
+    for item in measurements:
+        print(item)
+    memory = memory_benchmark(options.columns, options.rows, options.repeats)
+    print("\nbody decoded and built, decoded JSON released")
+    print(HEADER)
+    for item in memory:
+        print(item)
+    measurements += memory
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump([item.dict() for item in measurements], file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,127 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, Dict, List, Iterator, Iterable, Deque, Any
+
+import scoring_api
+from columnar import ColumnarResult
+
+
+class ResultPage:
+    """
+    One page of /result_model kept as decoded JSON, values are read on demand without building ResultModel
+    """
+    __slots__ = ("page", "per_page", "payload", "_columns")
+
+    def __init__(self, page: int, per_page: int, payload: Dict[str, Any]):
+        self.page = page
+        self.per_page = per_page
+        self.payload = payload
+        self._columns = {column["name"]: column for column in payload["dataset"].get("columns") or []}
+
+    def __len__(self) -> int:
+        return max((len(column["values"]) for column in self._columns.values()),
+                   default=len(self.scored_column or []))
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self._columns)
+
+    @property
+    def rows_order(self) -> List[int]:
+        return self.payload["dataset"]["rows_order"]
+
+    @property
+    def scored_column(self) -> Optional[List]:
+        scored = self.payload.get("scored")
+        return scored["scored_column"] if scored else None
+
+    @property
+    def offset(self) -> int:
+        """
+        Index of the first row of the page in the sorted dataset
+        """
+        return (self.page - 1) * self.per_page
+
+    def column(self, name: str) -> List[str]:
+        """
+        Raw cell values of a column slice
+        """
+        return [cell["value"] for cell in self._columns[name]["values"]]
+
+    def orders(self, name: str) -> List[int]:
+        return [cell["order"] for cell in self._columns[name]["values"]]
+
+    def columnar(self, columns: Iterable[str] = None, validation: str = "skip",
+                 numeric: Dict[str, bool] = None) -> ColumnarResult:
+        """
+        Page decoded into typed column arrays, see ColumnarResult for numeric
+        """
+        return ColumnarResult(self.payload, columns, validation, numeric)
+
+    def rows(self, columns: Iterable[str] = None) -> Iterator[Dict[str, str]]:
+        names = list(columns) if columns is not None else self.column_names
+        values = [self._columns[name]["values"] for name in names]
+        for index in range(len(self)):
+            yield {name: cells[index]["value"] for name, cells in zip(names, values)}
+
+
+def count_pages(rows: int, per_page: int) -> int:
+    if rows % per_page == 0:
+        return rows // per_page
+    return rows // per_page + 1
+
+
+def iter_result_pages(dataset_id: str, sort: str = None, order: str = None, per_page: int = 100,
+                      prefetch: int = 4, rows: int = None, first_page: int = 1) -> Iterator[ResultPage]:
+    """
+    Walk all pages of a dataset result model, fetching the next `prefetch` pages while the current one is consumed
+
+    rows: number of rows in the dataset if known (DatasetExtendedCardOut.rows_num), otherwise pages are
+        requested until a short or empty one comes back
+    Memory is bounded by prefetch + 1 pages.
+    """
+    last_page = count_pages(rows, per_page) if rows is not None else None
+    next_page = first_page
+    window: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=max(1, prefetch), thread_name_prefix="result-page") as executor:
+        def fill():
+            nonlocal next_page
+            while len(window) < max(1, prefetch) and (last_page is None or next_page <= last_page):
+                window.append(executor.submit(scoring_api.get_dataset_result_model_json, dataset_id, next_page,
+                                              per_page, sort, order))
+                next_page += 1
+
+        fill()
+        page = first_page
+        try:
+            while window:
+                result_page = ResultPage(page, per_page, window.popleft().result())
+                page += 1
+                if not len(result_page):
+                    break
+                yield result_page
+                if last_page is None and len(result_page) < per_page:
+                    break
+                fill()
+        finally:
+            for future in window:
+                future.cancel()
+
+
+def iter_result_rows(dataset_id: str, sort: str = None, order: str = None, per_page: int = 100,
+                     prefetch: int = 4, rows: int = None, columns: Iterable[str] = None) -> Iterator[Dict[str, str]]:
+    """
+    Walk all rows of a dataset result model as {column name: raw value} dicts
+    """
+    columns = list(columns) if columns is not None else None
+    for page in iter_result_pages(dataset_id, sort, order, per_page, prefetch, rows):
+        yield from page.rows(columns)
+
+
+def iter_column_slices(dataset_id: str, column: str, sort: str = None, order: str = None, per_page: int = 100,
+                       prefetch: int = 4, rows: int = None) -> Iterator[List[str]]:
+    """
+    Walk one column page by page, yields raw values of every page
+    """
+    for page in iter_result_pages(dataset_id, sort, order, per_page, prefetch, rows):
+        yield page.column(column)
@@ -0,0 +1,371 @@
+import asyncio
+import contextvars
+import random
+import threading
+import time
+
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, List, Set, Tuple, Callable, Awaitable, Any, Iterator
+from urllib.parse import urlsplit
+
+import requests
+from pydantic import BaseModel, Field
+
+from tasks import Backoff
+from transport import endpoint_template
+
+try:
+    import httpx
+    CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError)
+except ImportError:
+    CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+IDEMPOTENT_METHODS = {"get", "head", "options", "put", "delete"}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit breaker of {endpoint} is open, next trial in {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class SchedulerConfig(BaseModel):
+    max_retries: int = Field(0, title='Retries of a failed call, off by default')
+    backoff: Backoff = Field(Backoff(initial=0.2, factor=2, max_delay=10), title='Delays between retries')
+    retry_statuses: Set[int] = Field({429, 502, 503, 504}, title='Statuses retried for idempotent methods')
+    retry_non_idempotent: bool = Field(False, title='Retry POST and PATCH on retry_statuses and connection errors')
+    max_retry_after: float = Field(60, title='Upper bound of an honoured Retry-After, seconds')
+    failure_threshold: int = Field(0, title='Consecutive failures opening the circuit of an endpoint, 0 disables')
+    reset_timeout: float = Field(10, title='Seconds before an open circuit lets a trial call through')
+    rate: Optional[float] = Field(None, title='Calls per second of all endpoints, unlimited if None')
+    burst: int = Field(1, title='Calls allowed at once above the rate')
+    endpoint_rates: Dict[str, float] = Field({}, title='Calls per second of single endpoints, by endpoint template')
+
+
+class EndpointStats(BaseModel):
+    endpoint: str = Field(..., title='Endpoint template')
+    host: str = Field('', title='scheme://host the calls went to, empty for relative URLs')
+    calls: int = Field(0, title='Calls made by callers')
+    attempts: int = Field(0, title='Requests sent, retries included')
+    retries: int = Field(0, title='Requests sent again')
+    throttled: int = Field(0, title='429 responses')
+    failures: int = Field(0, title='Connection errors and 5xx responses')
+    rate_limited: int = Field(0, title='Requests delayed by the rate limiter')
+    rate_limit_wait: float = Field(0, title='Seconds spent waiting for the rate limiter')
+    breaker_trips: int = Field(0, title='Times the circuit opened')
+    breaker_rejections: int = Field(0, title='Calls rejected while the circuit was open')
+
+
+class TokenBucket:
+    """
+    Rate limiter handing out `rate` tokens per second with up to `burst` saved up
+
+    reserve() takes a token right away and returns how long the caller has to wait before using it,
+    so threads and coroutines can share one bucket and sleep their own way.
+    """
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class CircuitBreaker:
+    """
+    Closed until failure_threshold consecutive failures, then open for reset_timeout seconds;
+    after that one trial call is let through (half-open) and its outcome closes or reopens the circuit
+    """
+    __slots__ = ("failure_threshold", "reset_timeout", "clock", "failures", "opened_at", "trial", "_lock")
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.trial or self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> float:
+        """
+        0 if a call may go now, otherwise seconds until the next trial
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            retry_in = self.opened_at + self.reset_timeout - self.clock()
+            if retry_in > 0 or self.trial:
+                return max(retry_in, 0.001)
+            self.trial = True
+            return 0.0
+
+    def record(self, success: bool) -> bool:
+        """
+        Account the outcome of a call, True if it opened the circuit
+        """
+        with self._lock:
+            if success:
+                self.failures, self.opened_at, self.trial = 0, None, False
+                return False
+            self.failures += 1
+            if self.trial or self.opened_at is None and 0 < self.failure_threshold <= self.failures:
+                self.opened_at, self.trial = self.clock(), False
+                return True
+            return False
+
+
+def endpoint_key(method: str, url: str) -> Tuple[str, str]:
+    """
+    (scheme://host, endpoint template) of a call, the same path on two hosts is two endpoints
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}" if parts.netloc else ""
+    return host, endpoint_template(method, url)
+
+
+def retry_after(response: Any) -> Optional[float]:
+    """
+    Seconds from the Retry-After header, given as a number or an HTTP date
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """
+    Retries, per-endpoint circuit breakers and a token-bucket rate limit around every API call
+
+    Breakers and stats are kept per host and endpoint template, endpoint_rates apply to a template on any host.
+
+    Idempotent methods are retried on connection errors and retry_statuses; POST and PATCH only on 429,
+    which the server answers before doing anything, unless retry_non_idempotent is set.
+    A status the caller expects is never retried. Delays follow backoff and honour Retry-After.
+    """
+    def __init__(self, config: SchedulerConfig = None):
+        self.config = config or SchedulerConfig()
+        self.bucket = TokenBucket(self.config.rate, self.config.burst) if self.config.rate else None
+        self.endpoint_buckets = {endpoint: TokenBucket(rate, self.config.burst)
+                                 for endpoint, rate in self.config.endpoint_rates.items()}
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._stats: Dict[Tuple[str, str], EndpointStats] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def _endpoint(self, key: Tuple[str, str]):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                host, endpoint = key
+                stats = self._stats[key] = EndpointStats(endpoint=endpoint, host=host)
+                self._breakers[key] = CircuitBreaker(self.config.failure_threshold, self.config.reset_timeout)
+            return stats, self._breakers[key]
+
+    def stats(self) -> List[EndpointStats]:
+        with self._lock:
+            return [item.copy() for item in self._stats.values()]
+
+    def breaker_state(self, endpoint: str, host: str = None) -> str:
+        """
+        State of the endpoint's breaker on host, the least available one of all hosts if host is None
+        """
+        states = [breaker.state for (breaker_host, breaker_endpoint), breaker in list(self._breakers.items())
+                  if breaker_endpoint == endpoint and (host is None or breaker_host == host)]
+        for state in ("open", "half-open"):
+            if state in states:
+                return state
+        return "closed"
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._breakers.clear()
+
+    def single_attempt(self) -> "RequestScheduler":
+        """
+        Scheduler sending every call once without a breaker, drawing from the rate limits of this one
+        """
+        scheduler = RequestScheduler(self.config.copy(update={"max_retries": 0, "failure_threshold": 0}))
+        scheduler.bucket, scheduler.endpoint_buckets = self.bucket, self.endpoint_buckets
+        return scheduler
+
+    def _rate_limit_delay(self, endpoint: str, stats: EndpointStats) -> float:
+        delay = 0.0
+        for bucket in (self.bucket, self.endpoint_buckets.get(endpoint)):
+            if bucket is not None:
+                delay = max(delay, bucket.reserve())
+        if delay:
+            with self._lock:
+                stats.rate_limited += 1
+                stats.rate_limit_wait += delay
+        return delay
+
+    def _before_attempt(self, endpoint: str, stats: EndpointStats, breaker: CircuitBreaker, attempt: int):
+        retry_in = breaker.allow()
+        with self._lock:
+            if retry_in:
+                stats.breaker_rejections += 1
+            else:
+                stats.attempts += 1
+                stats.retries += attempt > 0
+        if retry_in:
+            raise CircuitOpenError(endpoint, retry_in)
+
+    def _outcome(self, method: str, expected_code, response: Any, error: Optional[BaseException],
+                 stats: EndpointStats, breaker: CircuitBreaker, attempt: int) -> Optional[float]:
+        """
+        Account an attempt, returns the delay before the next one or None if the call is done
+        """
+        status = response.status_code if response is not None else None
+        failure = error is not None or status >= 500 and status != expected_code
+        with self._lock:
+            stats.throttled += status == 429
+            stats.failures += failure
+        if breaker.record(not failure):
+            with self._lock:
+                stats.breaker_trips += 1
+        if attempt >= self.config.max_retries or status is not None and status == expected_code:
+            return None
+        idempotent = method in IDEMPOTENT_METHODS or self.config.retry_non_idempotent
+        if error is not None:
+            if not idempotent or not isinstance(error, CONNECTION_ERRORS):
+                return None
+        elif status not in self.config.retry_statuses or not idempotent and status != 429:
+            return None
+        delay = self.config.backoff.delay(attempt, self._random)
+        server_delay = retry_after(response) if response is not None else None
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.config.max_retry_after))
+        return delay
+
+    def send(self, send: Callable[..., Any], method: str, request_parameters: Dict[str, Any],
+             expected_code=None) -> Any:
+        """
+        Call send(method, **request_parameters) under the policy, returns the last response
+        """
+        host, endpoint = endpoint_key(method, request_parameters["url"])
+        stats, breaker = self._endpoint((host, endpoint))
+        with self._lock:
+            stats.calls += 1
+        attempt = 0
+        while True:
+            self._before_attempt(f"{endpoint} at {host}" if host else endpoint, stats, breaker, attempt)
+            delay = self._rate_limit_delay(endpoint, stats)
+            if delay:
+                time.sleep(delay)
+            response, error = None, None
+            try:
+                response = send(method, **request_parameters)
+            except Exception as exception:
+                error = exception
+            delay = self._outcome(method, expected_code, response, error, stats, breaker, attempt)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def send_async(self, send: Callable[..., Awaitable[Any]], method: str, request_parameters: Dict[str, Any],
+                         expected_code=None) -> Any:
+        host, endpoint = endpoint_key(method, request_parameters["url"])
+        stats, breaker = self._endpoint((host, endpoint))
+        with self._lock:
+            stats.calls += 1
+        attempt = 0
+        while True:
+            self._before_attempt(f"{endpoint} at {host}" if host else endpoint, stats, breaker, attempt)
+            delay = self._rate_limit_delay(endpoint, stats)
+            if delay:
+                await asyncio.sleep(delay)
+            response, error = None, None
+            try:
+                response = await send(method, **request_parameters)
+            except Exception as exception:
+                error = exception
+            delay = self._outcome(method, expected_code, response, error, stats, breaker, attempt)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+_scoped_scheduler: contextvars.ContextVar = contextvars.ContextVar("scoring_api_scheduler", default=None)
+
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler()
+    return _scheduler
+
+
+def set_scheduler(scheduler: RequestScheduler) -> Optional[RequestScheduler]:
+    """
+    Replace the shared scheduler, returns the previous one
+    """
+    global _scheduler
+    with _scheduler_lock:
+        previous, _scheduler = _scheduler, scheduler
+    return previous
+
+
+def current_scheduler() -> RequestScheduler:
+    """
+    Scheduler of the calls made in this context: the one of use_scheduler(), the shared one outside of it
+    """
+    return _scoped_scheduler.get() or get_scheduler()
+
+
+@contextmanager
+def use_scheduler(scheduler: RequestScheduler) -> Iterator[RequestScheduler]:
+    """
+    Send the calls of the block (in this thread or task) through scheduler, other threads keep the shared one
+    """
+    token = _scoped_scheduler.set(scheduler)
+    try:
+        yield scheduler
+    finally:
+        _scoped_scheduler.reset(token)
+
+
+def configure_scheduler(**kwargs) -> RequestScheduler:
+    """
+    Create a shared scheduler from SchedulerConfig fields, e.g. configure_scheduler(max_retries=3, failure_threshold=5)
+
+    Retries and circuit breakers are off until configured, callers see every response as the server sent it.
+    """
+    set_scheduler(RequestScheduler(SchedulerConfig(**kwargs)))
+    return get_scheduler()
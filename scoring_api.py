@@ -1,25 +1,78 @@
-import requests
+import threading
 import time
+import requests
 
 from typing import Tuple
 from json import JSONDecodeError
 from pathlib import Path
+from cache import get_response_cache, invalidate_cached
+from decoding import decode_response
 from models import *
+from streaming import MultipartFileStream, GzipMultipartFileStream, ProgressCallback, DEFAULT_CHUNK_SIZE
+from scheduler import RequestScheduler, get_scheduler, current_scheduler
+from tasks import wait_for_task
+from tokens import TokenManager
+from tracing import traced, trace_call
+from transport import get_transport
 from variables import ENV, ACCESS_TOKEN, REFRESH_TOKEN
 
 
-def send_request(url: str, method: str, query_params: dict = None,
-                 body_parameters: Union[Dict, Tuple, List, BaseModel] = None, headers: dict = None, files: dict = None,
-                 data: dict = None, expected_code: Union[str, int] = None, check_code=True, allow_redirects=True,
-                 token: str = None) -> requests.Response:
+def set_environment(env: str) -> str:
+    """
+    Point all endpoint wrappers at another host, e.g. a local stub server. Returns the previous host
+    """
+    global ENV
+    previous, ENV = ENV, env.rstrip("/")
+    # breakers tripped by the previous host mustn't reject calls to the new one
+    get_scheduler().reset()
+    return previous
+
+
+_token_manager: Optional[TokenManager] = None
+_token_manager_lock = threading.Lock()
+
+
+@traced
+def refresh_access_token(refresh_token: str) -> str:
+    response = send_request("/api/authorization/refresh", "post", token=refresh_token)
+    return f"Bearer {RefreshResponse(**decode_response(response)).access_token}"
+
+
+def get_token_manager() -> TokenManager:
+    """
+    Tokens used by endpoint wrappers, created from variables.py on first use
+    """
+    global _token_manager
+    if _token_manager is None:
+        with _token_manager_lock:
+            if _token_manager is None:
+                _token_manager = TokenManager(ACCESS_TOKEN, REFRESH_TOKEN, refresh=refresh_access_token)
+    return _token_manager
+
+
+def set_token_manager(token_manager: TokenManager) -> Optional[TokenManager]:
+    """
+    Replace the shared token manager, returns the previous one
+    """
+    global _token_manager
+    with _token_manager_lock:
+        previous, _token_manager = _token_manager, token_manager
+    return previous
+
+
+def prepare_request(url: str, query_params: dict = None,
+                    body_parameters: Union[Dict, Tuple, List, BaseModel] = None, headers: dict = None,
+                    files: dict = None, data: dict = None, allow_redirects=True, token: str = None) -> dict:
+    """
+    Build keyword arguments of an API call, shared by the sync and async clients
+    """
     full_url = "{}{}".format(ENV, url)
-    method_lower = method.lower()
     if token:
         request_headers = {'Authorization': token}
     elif "refresh" in full_url:
-        request_headers = {'Authorization': REFRESH_TOKEN}
+        request_headers = {'Authorization': get_token_manager().refresh_token}
     else:
-        request_headers = {'Authorization': ACCESS_TOKEN}
+        request_headers = {'Authorization': get_token_manager().access_token}
     if headers:
         request_headers.update(headers)
     if query_params:
@@ -40,16 +93,64 @@ def send_request(url: str, method: str, query_params: dict = None,
             request_parameters['json'] = body_parameters
     if data:
         request_parameters['data'] = data
+    return request_parameters
 
-    response = requests.request(method_lower, **request_parameters)
+
+def check_response_code(response, expected_code: Union[str, int] = None):
+    if expected_code is not None:
+        assert response.status_code == expected_code, f"Response code is not expected: " \
+                                                      f"{response.status_code} != {expected_code}. {response.content}"
+    else:
+        assert response.status_code == requests.codes.ok, f"Response code is not expected: " \
+                                                          f"{response.status_code} != {requests.codes.ok}. {response.content}"
+
+
+def send_request(url: str, method: str, query_params: dict = None,
+                 body_parameters: Union[Dict, Tuple, List, BaseModel] = None, headers: dict = None, files: dict = None,
+                 data: dict = None, expected_code: Union[str, int] = None, check_code=True, allow_redirects=True,
+                 token: str = None, cache: bool = False, scheduler: RequestScheduler = None) -> requests.Response:
+    """
+    cache: serve the GET from the response cache if it's enabled (see cache.configure_response_cache)
+    scheduler: retry and circuit breaker policy of the call, the one of use_scheduler() or the shared one by default
+    """
+    started = time.perf_counter()
+    method_lower = method.lower()
+    # requests without an explicit token get a fresh access token and are retried once after a 401
+    managed = not token and "refresh" not in url and "Authorization" not in (headers or {})
+    if managed:
+        token = get_token_manager().get()
+    request_parameters = prepare_request(url, query_params, body_parameters, headers, files, data, allow_redirects,
+                                         token)
+    response_cache = get_response_cache() if cache and method_lower == "get" and expected_code in (None, 200) \
+        else None
+    if response_cache is not None:
+        key = response_cache.key(request_parameters['url'], request_parameters['params'],
+                                 request_parameters['headers'])
+        generation = response_cache.generation()
+        response, entry = response_cache.lookup(key)
+        if response is not None:
+            trace_call(method_lower, request_parameters['url'], started, response=response)
+            return response
+        if entry is not None:
+            request_parameters['headers']['If-None-Match'] = entry.etag
+
+    scheduler = scheduler or current_scheduler()
+    response = scheduler.send(get_transport().request, method_lower, request_parameters, expected_code)
+    if managed and response.status_code == 401 and expected_code != 401:
+        request_parameters['headers']['Authorization'] = get_token_manager().invalidate(token)
+        response = scheduler.send(get_transport().request, method_lower, request_parameters, expected_code)
+
+    sent = response
+    if response_cache is not None:
+        if response.status_code == 304 and entry is not None:
+            response = response_cache.revalidated(key, entry, generation)
+        elif response.status_code == 200:
+            response_cache.store(response_cache.key(request_parameters['url'], request_parameters['params'],
+                                                    request_parameters['headers']), response, generation)
+    trace_call(method_lower, request_parameters['url'], started, sent, response)
 
     if check_code:
-        if expected_code is not None:
-            assert response.status_code == expected_code, f"Response code is not expected: " \
-                                                          f"{response.status_code} != {expected_code}. {response.content}"
-        else:
-            assert response.status_code == requests.codes.ok, f"Response code is not expected: " \
-                                                              f"{response.status_code} != {requests.codes.ok}. {response.content}"
+        check_response_code(response, expected_code)
 
     return response
 
@@ -58,6 +159,7 @@ def send_request(url: str, method: str, query_params: dict = None,
 # -------------------------
 
 
+@traced
 def authorization_me_get(token=None, expected_code=None) -> UserResponse:
     """
     Test User
@@ -67,15 +169,17 @@ def authorization_me_get(token=None, expected_code=None) -> UserResponse:
     query = None
     body_parameters = None
     file = None
-    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code, token=token)
+    response = send_request(url, method, query, body_parameters, files=file,
+                            expected_code=expected_code, token=token, cache=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = UserResponse(**result_object)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def authorization_refresh_get(expected_code=None) -> RefreshResponse:
     """
     Refresh Jwt Token
@@ -87,13 +191,14 @@ def authorization_refresh_get(expected_code=None) -> RefreshResponse:
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = RefreshResponse(**result_object)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def authorization_name_patch(name, expected_code):
     """
     Rename User
@@ -104,8 +209,9 @@ def authorization_name_patch(name, expected_code):
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/authorization/me")
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = UserResponse(**result_object)
     except JSONDecodeError:
         result_object = response.content
@@ -116,6 +222,7 @@ def authorization_name_patch(name, expected_code):
 # ---------------------------
 
 
+@traced
 def upload_datasets_upload_params_get(filename: str, expected_code=None) -> UploadParams:
     """
     Dataset Upload Params
@@ -127,13 +234,14 @@ def upload_datasets_upload_params_get(filename: str, expected_code=None) -> Uplo
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = UploadParams(**result_object)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def upload_datasets_validate_post(request_body: ValidateDataset, expected_code=None) -> Task:
     """
     Dataset Validate
@@ -144,32 +252,34 @@ def upload_datasets_validate_post(request_body: ValidateDataset, expected_code=N
     body_parameters = request_body
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", "/api/authorization/me")
     try:
-        result_object = response.json()
-        result_object = Task(**result_object)
+        result_object = decode_response(response, Task)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
-def task_task_id_status_get(task_id: str, expected_code=None) -> Task:
+@traced
+def task_task_id_status_get(task_id: str, expected_code=None, wait: float = None) -> Task:
     """
     Task Status
+    wait: seconds the server may hold the request until the status changes (long-poll)
     """
     url = f"/api/task/{task_id}/status"
     method = "get"
-    query = None
+    query = {"wait": wait}
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
     try:
-        result_object = response.json()
-        result_object = Task(**result_object)
+        result_object = decode_response(response, Task)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def task_task_id_result_get(task_id: str, expected_code=None) -> Task:
     """
     Task Result Status
@@ -181,38 +291,49 @@ def task_task_id_result_get(task_id: str, expected_code=None) -> Task:
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
     try:
-        result_object = response.json()
-        result_object = Task(**result_object)
+        result_object = decode_response(response, Task)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
+def upload_file_to_bucket(upload_params: UploadParams, filename: str, path_to_file: Path,
+                          chunk_size: int = DEFAULT_CHUNK_SIZE, progress: ProgressCallback = None,
+                          use_mmap: bool = False, gzip: bool = False):
+    """
+    Stream file to the presigned bucket URL from upload params
+    chunk_size: bytes read from the file at once, memory use doesn't depend on the file size
+    progress: callback(bytes_sent, total_bytes, bytes_per_second)
+    gzip: compress the file on the fly, only for backends accepting chunked gzip uploads
+    """
+    if gzip:
+        stream = GzipMultipartFileStream(upload_params.data["fields"], "file", filename, path_to_file,
+                                         chunk_size=chunk_size, use_mmap=use_mmap, progress=progress)
+        body = iter(stream)
+    else:
+        stream = body = MultipartFileStream(upload_params.data["fields"], "file", filename, path_to_file,
+                                            chunk_size=chunk_size, use_mmap=use_mmap, progress=progress)
+    started = time.perf_counter()
+    response = get_transport().request("post", upload_params.data["url"], data=body, headers=stream.headers)
+    trace_call("post", upload_params.data["url"], started, response, response)
+    assert response.status_code == 204, \
+        f"Uploading file to bucket returned unexpected code: {response.content}"
+
+
+@traced
 def upload_dataset(filename: str, path_to_file: Path, timeout: int = 300) -> Task:
     """
     Upload dataset using new mechanism
     """
     upload_params = upload_datasets_upload_params_get(filename)
-
-    with open(path_to_file, 'rb') as file:
-        files = {'file': (filename, file, "text/csv")}
-        response = requests.post(upload_params.data["url"], data=upload_params.data["fields"], files=files)
-        assert response.status_code == 204, \
-            f"Uploading file to bucket returned unexpected code: {response.content}"
+    upload_file_to_bucket(upload_params, filename, path_to_file)
 
     validate_dataset = ValidateDataset(filepath=upload_params.data["fields"]["key"])
     task = upload_datasets_validate_post(validate_dataset)
-    task = task_task_id_status_get(task.id)
-
-    wait_period = 0.5
-    ticks_to_timeout = timeout / wait_period
-    while task.status in {"PENDING", "STARTED"}:
-        time.sleep(0.5)
-        task = task_task_id_status_get(task.id)
-        ticks_to_timeout -= 1
-        if ticks_to_timeout == 0:
-            raise Exception("Uploading reached timeout")
+    wait_for_task(task.id, task_task_id_status_get, timeout=timeout)
     task_result = task_task_id_result_get(task.id)
+    invalidate_cached("/api/datasets", "/api/authorization/me")
     return task_result
 
 # ---------------------------
@@ -220,6 +341,7 @@ def upload_dataset(filename: str, path_to_file: Path, timeout: int = 300) -> Tas
 # ---------------------------
 
 
+@traced
 def get_datasets_list(limit: int=None, expected_code=None) -> List[DatasetExtendedCardOut]:
     """
     Datasets List
@@ -229,15 +351,15 @@ def get_datasets_list(limit: int=None, expected_code=None) -> List[DatasetExtend
     query = {"limit": limit}
     body_parameters = None
     file = None
-    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code, cache=True)
     try:
-        result_object = response.json()
-        result_object = [DatasetExtendedCardOut(**item) for item in result_object]
+        result_object = decode_response(response, DatasetExtendedCardOut, many=True)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def get_dataset_result_model(dataset_id: str, page: int = None, per_page: int = None, sort: str = None,
                              order: str = None, expected_code=None) -> ResultModel:
     """
@@ -251,15 +373,37 @@ def get_dataset_result_model(dataset_id: str, page: int = None, per_page: int =
              "order": order}
     body_parameters = None
     file = None
-    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code, cache=True)
+    try:
+        result_object = decode_response(response, ResultModel)
+    except JSONDecodeError:
+        result_object = response.content
+    return result_object
+
+
+@traced
+def get_dataset_result_model_json(dataset_id: str, page: int = None, per_page: int = None, sort: str = None,
+                                  order: str = None, expected_code=None) -> Dict:
+    """
+    Get Dataset without building ResultModel, returns the decoded JSON
+    """
+    url = f"/api/datasets/{dataset_id}/result_model"
+    method = "get"
+    query = {"page": page,
+             "per_page": per_page,
+             "sort": sort,
+             "order": order}
+    body_parameters = None
+    file = None
+    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code, cache=True)
     try:
-        result_object = response.json()
-        result_object = ResultModel(**result_object)
+        result_object = decode_response(response)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def delete_dataset(dataset_id: str, expected_code=None) -> Dict:
     """
     Dataset Delete
@@ -270,13 +414,16 @@ def delete_dataset(dataset_id: str, expected_code=None) -> Dict:
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", "/api/authorization/me")
+    invalidate_cached(f"/api/datasets/{dataset_id}", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def restore_dataset(dataset_id: str, expected_code=None) -> Dict:
     """
     Restore Dataset
@@ -287,8 +434,10 @@ def restore_dataset(dataset_id: str, expected_code=None) -> Dict:
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", "/api/authorization/me")
+    invalidate_cached(f"/api/datasets/{dataset_id}", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
     except JSONDecodeError:
         result_object = response.content
     return result_object
@@ -298,6 +447,7 @@ def restore_dataset(dataset_id: str, expected_code=None) -> Dict:
 # ---------------------------
 
 
+@traced
 def scoring_template_post(request_body: PostScoringTemplate, expected_code=None) -> CreateResponse:
     """
     Add Scoring Template
@@ -308,14 +458,17 @@ def scoring_template_post(request_body: PostScoringTemplate, expected_code=None)
     body_parameters = request_body
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets")
+    invalidate_cached(f"/api/datasets/{request_body.dataset_id}", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = CreateResponse(**result_object)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def scoring_template_delete(template_id: str, expected_code=None):
     """
     Delete Scoring Template
@@ -326,13 +479,15 @@ def scoring_template_delete(template_id: str, expected_code=None):
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def scoring_template_properties_post(request_body: RequestTemplateProperty, template_id: str,
                                      expected_code=None) -> CreateResponse:
     """
@@ -344,14 +499,16 @@ def scoring_template_properties_post(request_body: RequestTemplateProperty, temp
     body_parameters = request_body
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = CreateResponse(**result_object)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def scoring_template_properties_delete(template_id: str, template_property_id: str, expected_code=None):
     """
     Delete Template Property
@@ -362,13 +519,15 @@ def scoring_template_properties_delete(template_id: str, template_property_id: s
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def scored_dataset_post(dataset_id: str, template_id: str, expected_code=None) -> CreateResponse:
     """
     Add Scored Dataset
@@ -380,14 +539,17 @@ def scored_dataset_post(dataset_id: str, template_id: str, expected_code=None) -
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets")
+    invalidate_cached(f"/api/datasets/{dataset_id}", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = CreateResponse(**result_object)
     except JSONDecodeError:
         result_object = response.content
     return result_object
 
 
+@traced
 def scored_dataset_delete(scored_dataset_id: str, expected_code=None):
     """
     Delete Scored Dataset
@@ -398,8 +560,9 @@ def scored_dataset_delete(scored_dataset_id: str, expected_code=None):
     body_parameters = None
     file = None
     response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    invalidate_cached("/api/datasets", subtree=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
     except JSONDecodeError:
         result_object = response.content
     return result_object
@@ -410,6 +573,7 @@ def scored_dataset_delete(scored_dataset_id: str, expected_code=None):
 # ---------------------------
 
 
+@traced
 def feedback_get(after: str, before: str, expected_code=None) -> Dict:
     """
     Get the list with users feedbacks
@@ -423,9 +587,9 @@ def feedback_get(after: str, before: str, expected_code=None) -> Dict:
              "before": before}
     body_parameters = None
     file = None
-    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code)
+    response = send_request(url, method, query, body_parameters, files=file, expected_code=expected_code, cache=True)
     try:
-        result_object = response.json()
+        result_object = decode_response(response)
         result_object = [UserFeedback(**item) for item in result_object]
     except JSONDecodeError:
         result_object = response.content
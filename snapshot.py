@@ -0,0 +1,273 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Union
+
+import numpy
+from pydantic import BaseModel, Field
+
+import scoring_api
+from columnar import looks_numeric, parse_floats
+from pagination import iter_result_pages
+
+DEFAULT_DIRECTORY = Path.home() / ".cache" / "scoring_auto_qa" / "snapshots"
+UNSCORED = "unscored"
+META = "meta.json"
+SCORED_COLUMN = "Scored_column"
+# fields of the dataset part of /result_model that change when the dataset or its scoring changes
+FINGERPRINT = ("associated_scoring_template_md5_hash", "associated_scored_dataset_id",
+               "associated_scoring_template_id", "upload_date", "allocated_memory", "columns_order")
+
+
+class SnapshotColumn(BaseModel):
+    name: str = Field(..., title='Column name')
+    file: str = Field(..., title='File of the values, the mask is <file>.mask.npy')
+    numeric: bool = Field(..., title='float64 with NaN for empty cells if every other cell is a number, str otherwise')
+
+
+class SnapshotMeta(BaseModel):
+    dataset_id: str = Field(..., title='Dataset Id')
+    md5_hash: str = Field('', title='associated_scoring_template_md5_hash, empty for unscored datasets')
+    fingerprint: Dict[str, Any] = Field({}, title='Dataset fields the snapshot was taken at')
+    rows: int = Field(..., title='Rows')
+    columns: List[SnapshotColumn] = Field([], title='Columns in dataset order')
+    scored: bool = Field(False, title='Snapshot holds the scored column')
+    pages: int = Field(0, title='Pages downloaded')
+    download_time: float = Field(0, title='Seconds spent downloading')
+    created: float = Field(0, title='Unix time of the download')
+
+
+class SnapshotStats(BaseModel):
+    hits: int = Field(0, title='Snapshots read from disk')
+    downloads: int = Field(0, title='Snapshots downloaded')
+    stale: int = Field(0, title='Downloads replacing a snapshot of another hash or dataset state')
+
+
+class Snapshot:
+    """
+    Columns and the scored column of a dataset in upload row order, memory-mapped from .npy files
+
+    Row i of every array is row i of the uploaded file (the `order` of its cells); masks are True for empty cells
+    and 'nonquantifiable' scores.
+    """
+    __slots__ = ("directory", "meta", "_arrays")
+
+    def __init__(self, directory: Path, meta: SnapshotMeta):
+        self.directory = directory
+        self.meta = meta
+        self._arrays: Dict[str, numpy.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.meta.rows
+
+    def __repr__(self):
+        return f"Snapshot({self.meta.dataset_id!r}, {self.meta.md5_hash or UNSCORED!r}, rows={self.meta.rows})"
+
+    @property
+    def dataset_id(self) -> str:
+        return self.meta.dataset_id
+
+    @property
+    def md5_hash(self) -> str:
+        return self.meta.md5_hash
+
+    @property
+    def column_names(self) -> List[str]:
+        return [column.name for column in self.meta.columns]
+
+    def _column(self, name: str) -> SnapshotColumn:
+        column = next((column for column in self.meta.columns if column.name == name), None)
+        if column is None:
+            raise KeyError(name)
+        return column
+
+    def _load(self, file: str) -> numpy.ndarray:
+        array = self._arrays.get(file)
+        if array is None:
+            array = self._arrays[file] = numpy.load(self.directory / file, mmap_mode="r", allow_pickle=False)
+        return array
+
+    def column(self, name: str) -> numpy.ndarray:
+        return self._load(self._column(name).file)
+
+    def mask(self, name: str) -> numpy.ndarray:
+        return self._load(f"{self._column(name).file[:-len('.npy')]}.mask.npy")
+
+    def masked(self, name: str) -> numpy.ma.MaskedArray:
+        return numpy.ma.MaskedArray(self.column(name), mask=self.mask(name))
+
+    @property
+    def scored(self) -> Optional[numpy.ndarray]:
+        return self._load(f"{SCORED_COLUMN}.npy") if self.meta.scored else None
+
+    @property
+    def scored_mask(self) -> Optional[numpy.ndarray]:
+        return self._load(f"{SCORED_COLUMN}.mask.npy") if self.meta.scored else None
+
+
+def _save(directory: Path, name: str, values: numpy.ndarray, mask: numpy.ndarray):
+    numpy.save(directory / f"{name}.npy", values, allow_pickle=False)
+    numpy.save(directory / f"{name}.mask.npy", mask, allow_pickle=False)
+
+
+class SnapshotCache:
+    """
+    On-disk snapshots of datasets keyed by dataset_id and associated_scoring_template_md5_hash
+
+    get() asks for one row of the dataset to compare its hash and FINGERPRINT fields with the stored snapshot and
+    pages through the whole result model only if they differ; a snapshot of an older hash is replaced.
+    Layout: <directory>/<dataset_id>/<md5 hash or "unscored">/{meta.json, <column>.npy, <column>.mask.npy}
+    """
+    def __init__(self, directory: Union[str, Path] = DEFAULT_DIRECTORY, per_page: int = 1000, prefetch: int = 4):
+        self.directory = Path(directory)
+        self.per_page = per_page
+        self.prefetch = prefetch
+        self.stats = SnapshotStats()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def path(self, dataset_id: str, md5_hash: str = "") -> Path:
+        return self.directory / dataset_id / (md5_hash or UNSCORED)
+
+    def _lock(self, dataset_id: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(dataset_id, threading.Lock())
+
+    @staticmethod
+    def probe(dataset_id: str) -> Dict[str, Any]:
+        """
+        Current FINGERPRINT fields of a dataset, from a one-row page
+        """
+        dataset = scoring_api.get_dataset_result_model_json(dataset_id, page=1, per_page=1)["dataset"]
+        return {name: dataset.get(name) for name in FINGERPRINT}
+
+    def cached(self, dataset_id: str, md5_hash: str = "") -> Optional[Snapshot]:
+        """
+        Stored snapshot without asking the backend whether it is current
+        """
+        path = self.path(dataset_id, md5_hash)
+        try:
+            meta = SnapshotMeta.parse_file(path / META)
+        except (OSError, ValueError):
+            return None
+        return Snapshot(path, meta)
+
+    def get(self, dataset_id: str, refresh: bool = False) -> Snapshot:
+        """
+        Snapshot of the current state of a dataset, downloaded if there is none or it is outdated
+        """
+        with self._lock(dataset_id):
+            fingerprint = self.probe(dataset_id)
+            md5_hash = fingerprint["associated_scoring_template_md5_hash"] or ""
+            snapshot = None if refresh else self.cached(dataset_id, md5_hash)
+            if snapshot is not None and snapshot.meta.fingerprint == fingerprint:
+                self.stats.hits += 1
+                return snapshot
+            if snapshot is not None or any(path.is_dir() for path in (self.directory / dataset_id).glob("*")):
+                self.stats.stale += 1
+            return self.download(dataset_id, fingerprint)
+
+    def download(self, dataset_id: str, fingerprint: Dict[str, Any]) -> Snapshot:
+        """
+        Page through the unsorted result model and store it, replacing other snapshots of the dataset
+        """
+        started = time.monotonic()
+        names: List[str] = []
+        chunks: Dict[str, List[numpy.ndarray]] = {}
+        masks: Dict[str, List[numpy.ndarray]] = {}
+        orders: Dict[str, List[numpy.ndarray]] = {}
+        scored, scored_masks, scored_orders = [], [], []
+        pages = 0
+        for page in iter_result_pages(dataset_id, per_page=self.per_page, prefetch=self.prefetch):
+            # pages are kept as str, column types are decided once all cells are in
+            columnar = page.columnar(validation="skip", numeric=dict.fromkeys(page.column_names, False))
+            pages += 1
+            for name, values in columnar.columns.items():
+                if name not in chunks:
+                    names.append(name)
+                    chunks[name], masks[name], orders[name] = [], [], []
+                chunks[name].append(values)
+                masks[name].append(columnar.masks[name])
+                orders[name].append(columnar.orders[name])
+            if columnar.scored is not None and columnar.orders:
+                scored.append(columnar.scored)
+                scored_masks.append(columnar.scored_mask)
+                scored_orders.append(next(iter(columnar.orders.values())))
+        rows = sum(len(chunk) for chunk in chunks[names[0]]) if names else 0
+
+        md5_hash = fingerprint.get("associated_scoring_template_md5_hash") or ""
+        target = self.path(dataset_id, md5_hash)
+        temporary = target.parent / f".{target.name}-{uuid.uuid4().hex}"
+        temporary.mkdir(parents=True)
+        try:
+            columns = []
+            for index, name in enumerate(names):
+                values, mask = _in_row_order(chunks.pop(name), masks.pop(name), orders.pop(name), rows)
+                numeric = looks_numeric(values)
+                if numeric:
+                    values, mask = parse_floats(values)
+                _save(temporary, str(index), values, mask)
+                columns.append(SnapshotColumn(name=name, file=f"{index}.npy", numeric=numeric))
+            if scored:
+                values, mask = _in_row_order(scored, scored_masks, scored_orders, rows)
+                _save(temporary, SCORED_COLUMN, values, mask)
+            meta = SnapshotMeta(dataset_id=dataset_id, md5_hash=md5_hash, fingerprint=fingerprint, rows=rows,
+                                columns=columns, scored=bool(scored), pages=pages,
+                                download_time=time.monotonic() - started, created=time.time())
+            (temporary / META).write_text(meta.json())
+            for path in target.parent.iterdir():
+                if path != temporary and path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+            os.replace(temporary, target)
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        self.stats.downloads += 1
+        return Snapshot(target, meta)
+
+    def evict(self, dataset_id: str):
+        shutil.rmtree(self.directory / dataset_id, ignore_errors=True)
+
+
+def _in_row_order(chunks: List[numpy.ndarray], masks: List[numpy.ndarray], orders: List[numpy.ndarray],
+                  rows: int):
+    values = numpy.concatenate(chunks) if chunks else numpy.empty(0)
+    mask = numpy.concatenate(masks) if masks else numpy.empty(0, dtype=bool)
+    order = numpy.concatenate(orders) if orders else numpy.empty(0, dtype=numpy.int64)
+    assert len(values) == rows and numpy.array_equal(numpy.sort(order), numpy.arange(rows)), \
+        f"Pages don't cover rows 0..{rows - 1} exactly once, the dataset changed while downloading"
+    index = numpy.argsort(order, kind="stable")
+    return values[index], mask[index]
+
+
+_snapshots: Optional[SnapshotCache] = None
+
+
+def get_snapshot_cache() -> SnapshotCache:
+    """
+    Shared snapshot cache, created in DEFAULT_DIRECTORY on first use
+    """
+    global _snapshots
+    if _snapshots is None:
+        _snapshots = SnapshotCache()
+    return _snapshots
+
+
+def set_snapshot_cache(cache: Optional[SnapshotCache]) -> Optional[SnapshotCache]:
+    global _snapshots
+    previous, _snapshots = _snapshots, cache
+    return previous
+
+
+def configure_snapshots(directory: Union[str, Path] = DEFAULT_DIRECTORY, per_page: int = 1000,
+                        prefetch: int = 4) -> SnapshotCache:
+    set_snapshot_cache(SnapshotCache(directory, per_page, prefetch))
+    return _snapshots
+
+
+def get_dataset_snapshot(dataset_id: str, refresh: bool = False) -> Snapshot:
+    return get_snapshot_cache().get(dataset_id, refresh)
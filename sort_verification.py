@@ -0,0 +1,278 @@
+import argparse
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Any, Iterable, Tuple
+
+import numpy
+import pandas
+from pydantic import BaseModel, Field
+
+import scoring_api
+from columnar import parse_floats
+from pagination import count_pages
+
+ORDERS = ("asc", "desc")
+TIES = ("any", "stable")
+NAN_POSITIONS = ("last", "first")
+SCORED_COLUMN = "Scored_column"
+
+
+class SortExpectation:
+    """
+    Expected order of a dataset sorted by one key, permutations are computed once per order and sliced per page
+
+    values: keys in upload row order; numeric keys are float64 with NaN for missing cells, other keys are str
+    Permutations are stable: tied rows keep upload order in both directions, missing keys go to nan_position.
+    """
+    __slots__ = ("keys", "missing", "numeric", "nan_position", "_ranks", "_permutations")
+
+    def __init__(self, values: Iterable[Any], numeric: bool = None, nan_position: str = "last"):
+        assert nan_position in NAN_POSITIONS, f"Unknown nan_position {nan_position}, use one of {NAN_POSITIONS}"
+        values = list(values)
+        floats, mask = parse_floats(values)
+        if numeric is None:
+            numeric = not any(missing and isinstance(value, str) and value != ""
+                              for missing, value in zip(mask, values))
+        self.numeric = numeric
+        if self.numeric:
+            self.keys, self.missing = floats, mask
+        else:
+            self.keys = numpy.array(["" if value is None else str(value) for value in values], dtype=str)
+            self.missing = numpy.zeros(len(values), dtype=bool)
+        self.nan_position = nan_position
+        ranks = numpy.zeros(len(values), dtype=numpy.int64)
+        if (~self.missing).any():
+            ranks[~self.missing] = numpy.unique(self.keys[~self.missing], return_inverse=True)[1]
+        self._ranks = ranks
+        self._permutations: Dict[str, numpy.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def permutation(self, order: str) -> numpy.ndarray:
+        """
+        Rows (upload order indexes) of the sorted dataset
+        """
+        permutation = self._permutations.get(order)
+        if permutation is None:
+            assert order in ORDERS, f"Unknown order {order}, use one of {ORDERS}"
+            ranks = self._ranks if order == "asc" else -self._ranks
+            missing = len(self) + 1 if self.nan_position == "last" else -len(self) - 1
+            permutation = numpy.argsort(numpy.where(self.missing, missing, ranks), kind="stable")
+            self._permutations[order] = permutation
+        return permutation
+
+    def page(self, order: str, page: int, per_page: int) -> numpy.ndarray:
+        """
+        Rows expected on a page
+        """
+        return self.permutation(order)[(page - 1) * per_page:page * per_page]
+
+    def parse(self, values: List[Any]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Cell values of a page as (keys, missing) comparable with self.keys
+        """
+        if self.numeric:
+            return parse_floats(values)
+        return numpy.array(["" if value is None else str(value) for value in values], dtype=str), \
+            numpy.zeros(len(values), dtype=bool)
+
+    def same(self, actual: numpy.ndarray, actual_missing: numpy.ndarray, rows: numpy.ndarray,
+             rtol: float) -> numpy.ndarray:
+        """
+        Positions where actual keys equal the keys of `rows`, missing cells equal each other
+        """
+        expected, expected_missing = self.keys[rows], self.missing[rows]
+        if self.numeric:
+            equal = numpy.isclose(numpy.where(actual_missing, 0, actual), numpy.where(expected_missing, 0, expected),
+                                  rtol=rtol, atol=0)
+        else:
+            equal = actual == expected
+        return numpy.where(actual_missing | expected_missing, actual_missing == expected_missing, equal)
+
+
+def expectations_from_dataframe(dataframe: pandas.DataFrame, columns: Iterable[str] = None,
+                                scored: str = None, nan_position: str = "last") -> Dict[str, SortExpectation]:
+    """
+    Expectations for sorting by every column (or `columns`) of the uploaded file
+
+    scored: column holding the expected scores, verified as the Scored_column sort
+    Empty cells are missing in numeric columns and empty strings in the others, as the backend reads them.
+    """
+    expectations = {}
+    for name in columns if columns is not None else dataframe.columns:
+        column = dataframe[name]
+        numeric = pandas.api.types.is_numeric_dtype(column)
+        values = column.tolist() if numeric else column.fillna("").astype(str).tolist()
+        expectations[name] = SortExpectation(values, numeric, nan_position)
+    if scored is not None:
+        expectations[SCORED_COLUMN] = SortExpectation(dataframe[scored].tolist(), True, nan_position)
+    return expectations
+
+
+class PageCheck(BaseModel):
+    sort: str = Field(..., title='Sort column')
+    order: str = Field(..., title='Sort order')
+    page: int = Field(..., title='Page')
+    per_page: int = Field(..., title='Page size')
+    rows: List[int] = Field([], title='Rows of the page in upload order indexes')
+    error: Optional[str] = Field(None, title='First mismatch, None if the page is as expected')
+    time: float = Field(0, title='Seconds spent on the request')
+
+
+class SortVerificationReport(BaseModel):
+    dataset_id: str = Field(..., title='Dataset Id')
+    rows: int = Field(..., title='Rows')
+    per_page: int = Field(..., title='Page size')
+    ties: str = Field(..., title='Tie handling, one of TIES')
+    checks: List[PageCheck] = Field([], title='Checked pages')
+    errors: List[str] = Field([], title='Mismatches spanning pages, e.g. missing or repeated rows')
+    wall_time: float = Field(0, title='Seconds')
+
+    @property
+    def failed(self) -> List[PageCheck]:
+        return [item for item in self.checks if item.error is not None]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed and not self.errors
+
+    def summary(self) -> str:
+        sorts = len({(item.sort, item.order) for item in self.checks})
+        return (f"{len(self.checks)} pages of {sorts} sorts checked in {self.wall_time:.1f}s, "
+                f"{len(self.failed)} failed, {len(self.errors)} cross-page errors")
+
+
+def _first_mismatch(positions: numpy.ndarray) -> Optional[int]:
+    wrong = numpy.flatnonzero(~positions)
+    return int(wrong[0]) if len(wrong) else None
+
+
+def check_page(payload: Dict[str, Any], sort: str, expectation: SortExpectation, order: str, page: int,
+               per_page: int, ties: str = "any", rtol: float = 1e-3) -> Optional[str]:
+    """
+    First mismatch of a /result_model page with the expectation, None if there is none
+
+    ties="any": tied rows may come in any order, every position must hold a row with the expected key
+    ties="stable": rows must come in the expected order exactly
+    """
+    assert ties in TIES, f"Unknown ties {ties}, use one of {TIES}"
+    expected_rows = expectation.page(order, page, per_page)
+    columns = payload["dataset"].get("columns") or []
+    orders = [[cell["order"] for cell in column["values"]] for column in columns]
+    if not orders:
+        return "Page has no columns"
+    rows = numpy.array(orders[0], dtype=numpy.int64)
+    misaligned = next((column["name"] for column, column_orders in zip(columns, orders)
+                       if column_orders != orders[0]), None)
+    if misaligned is not None:
+        return f"Rows of column {misaligned} differ from the rows of {columns[0]['name']}"
+    if len(rows) != len(expected_rows):
+        return f"{len(rows)} rows instead of {len(expected_rows)}"
+    if len(rows) and (rows.min() < 0 or rows.max() >= len(expectation)):
+        return f"Unknown rows {rows[(rows < 0) | (rows >= len(expectation))].tolist()}"
+    if sort == SCORED_COLUMN:
+        scored = payload.get("scored")
+        if not scored:
+            return "Page has no scored column"
+        cells = scored["scored_column"]
+    else:
+        column = next((column for column in columns if column["name"] == sort), None)
+        if column is None:
+            return f"Page has no column {sort}"
+        cells = [cell["value"] for cell in column["values"]]
+    if len(cells) != len(rows):
+        return f"{len(cells)} sorted values for {len(rows)} rows"
+    actual, actual_missing = expectation.parse(cells)
+    position = _first_mismatch(expectation.same(actual, actual_missing, rows, rtol))
+    if position is not None:
+        return (f"Row {rows[position]} at position {position} holds {cells[position]!r}, "
+                f"the file has {expectation.keys[rows[position]].item()!r}")
+    position = _first_mismatch(expectation.same(actual, actual_missing, expected_rows, rtol))
+    if position is not None:
+        return (f"Position {position} holds {cells[position]!r} of row {rows[position]}, expected "
+                f"{expectation.keys[expected_rows[position]].item()!r} of row {expected_rows[position]}")
+    if ties == "stable" and not numpy.array_equal(rows, expected_rows):
+        position = _first_mismatch(rows == expected_rows)
+        return f"Tied row {rows[position]} at position {position}, stable order has row {expected_rows[position]}"
+    return None
+
+
+def _check(dataset_id: str, sort: str, expectation: SortExpectation, order: str, page: int, per_page: int,
+           ties: str, rtol: float) -> PageCheck:
+    result = PageCheck(sort=sort, order=order, page=page, per_page=per_page)
+    started = time.monotonic()
+    try:
+        payload = scoring_api.get_dataset_result_model_json(dataset_id, page, per_page, sort, order)
+        result.rows = [cell["order"] for cell in (payload["dataset"].get("columns") or [{"values": []}])[0]["values"]]
+        result.error = check_page(payload, sort, expectation, order, page, per_page, ties, rtol)
+    except Exception as error:
+        result.error = repr(error)
+    result.time = time.monotonic() - started
+    return result
+
+
+def verify_sorting(dataset_id: str, expectations: Dict[str, SortExpectation], orders: Iterable[str] = ORDERS,
+                   per_page: int = 100, pages: Iterable[int] = None, workers: int = 16, ties: str = "any",
+                   rtol: float = 1e-3) -> SortVerificationReport:
+    """
+    Check pages of a dataset sorted by every expectation key in every order, requests go through a pool of workers
+
+    pages: pages to check, all by default; with all pages every row must come exactly once per sort
+    """
+    rows = len(next(iter(expectations.values()))) if expectations else 0
+    report = SortVerificationReport(dataset_id=dataset_id, rows=rows, per_page=per_page, ties=ties)
+    numbers = list(pages) if pages is not None else list(range(1, count_pages(rows, per_page) + 1))
+    jobs = [(sort, expectation, order, page) for sort, expectation in expectations.items() for order in orders
+            for page in numbers]
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs) or 1)),
+                            thread_name_prefix="sort-verification") as executor:
+        report.checks = list(executor.map(lambda job: _check(dataset_id, *job, per_page, ties, rtol), jobs))
+    report.wall_time = time.monotonic() - started
+    if pages is None:
+        walked: Dict[Tuple[str, str], List[int]] = {}
+        for item in report.checks:
+            walked.setdefault((item.sort, item.order), []).extend(item.rows)
+        for (sort, order), walked_rows in walked.items():
+            counts = numpy.bincount(numpy.array(walked_rows, dtype=numpy.int64), minlength=rows) \
+                if walked_rows and min(walked_rows) >= 0 else numpy.zeros(rows, dtype=numpy.int64)
+            if len(counts) != rows or not (counts == 1).all():
+                report.errors.append(f"{sort} {order}: rows {numpy.flatnonzero(counts[:rows] != 1)[:10].tolist()} "
+                                     f"don't come exactly once over {len(numbers)} pages")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every page of a dataset sorted by every column")
+    parser.add_argument("dataset_id")
+    parser.add_argument("file", help="the uploaded file, expected order is computed from it")
+    parser.add_argument("--env", help="host to check, variables.ENV by default")
+    parser.add_argument("--delimiter", default="\t")
+    parser.add_argument("--columns", nargs="*", help="sort columns, all by default")
+    parser.add_argument("--scored", help="column of the file holding the expected scores")
+    parser.add_argument("--per-page", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--ties", choices=TIES, default="any")
+    parser.add_argument("--output", help="save the report as JSON")
+    options = parser.parse_args()
+    if options.env:
+        scoring_api.set_environment(options.env)
+    dataframe = pandas.read_csv(options.file, sep=options.delimiter)
+    expectations = expectations_from_dataframe(dataframe, options.columns, options.scored)
+    report = verify_sorting(options.dataset_id, expectations, per_page=options.per_page, workers=options.workers,
+                            ties=options.ties)
+    for item in report.failed:
+        print(f"{item.sort}\t{item.order}\tpage {item.page}\t{item.error}")
+    for error in report.errors:
+        print(error)
+    print(report.summary())
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(report.json(indent=2))
+    raise SystemExit(0 if report.ok else 1)
+
+
+if __name__ == "__main__":
+    main()
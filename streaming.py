@@ -0,0 +1,148 @@
+import mmap
+import os
+import time
+import uuid
+import zlib
+
+from pathlib import Path
+from typing import Optional, Dict, Callable, Iterator
+
+# progress(bytes_sent, total_bytes, bytes_per_second), total_bytes is None for gzip uploads
+ProgressCallback = Callable[[int, Optional[int], float], None]
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class _Progress:
+    def __init__(self, total: Optional[int], callback: Optional[ProgressCallback]):
+        self.total = total
+        self.callback = callback
+        self.sent = 0
+        self.started = None
+
+    def update(self, size: int):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.sent += size
+        if self.callback:
+            elapsed = time.monotonic() - self.started
+            self.callback(self.sent, self.total, self.sent / elapsed if elapsed > 0 else 0.0)
+
+
+class MultipartFileStream:
+    """
+    multipart/form-data body of form fields and one file, read lazily in fixed-size chunks
+
+    Memory use doesn't depend on the file size. The length is known upfront, so the body is sent
+    with Content-Length as presigned bucket POSTs require:
+
+        stream = MultipartFileStream(fields, "file", filename, path, progress=print)
+        requests.post(url, data=stream, headers=stream.headers)
+    """
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str, path: Path,
+                 content_type: str = "text/csv", chunk_size: int = DEFAULT_CHUNK_SIZE, use_mmap: bool = False,
+                 progress: ProgressCallback = None):
+        self.boundary = uuid.uuid4().hex
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+        self._head = b"".join(self._field_part(name, value) for name, value in fields.items())
+        self._head += (f"--{self.boundary}\r\n"
+                       f"Content-Disposition: form-data; name=\"{file_field}\"; filename=\"{filename}\"\r\n"
+                       f"Content-Type: {content_type}\r\n\r\n").encode()
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self._file_size = os.path.getsize(self.path)
+        self._length = len(self._head) + self._file_size + len(self._tail)
+        self._progress = _Progress(self._length, progress)
+        self._chunks: Optional[Iterator[bytes]] = None
+        self._buffer = b""
+        self._offset = 0
+
+    def _field_part(self, name: str, value: str) -> bytes:
+        return (f"--{self.boundary}\r\n"
+                f"Content-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n").encode()
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": self.content_type, "Content-Length": str(self._length)}
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _file_chunks(self) -> Iterator[bytes]:
+        with open(self.path, "rb") as file:
+            if self.use_mmap and self._file_size:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    for offset in range(0, self._file_size, self.chunk_size):
+                        yield mapped[offset:offset + self.chunk_size]
+                        if hasattr(mapped, "madvise"):
+                            # drop consumed pages so resident memory stays at one chunk
+                            mapped.madvise(mmap.MADV_DONTNEED, offset - offset % mmap.PAGESIZE,
+                                           min(self.chunk_size, self._file_size - offset))
+            else:
+                while True:
+                    chunk = file.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def _iter_body(self) -> Iterator[bytes]:
+        yield self._head
+        yield from self._file_chunks()
+        yield self._tail
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._iter_body():
+            self._progress.update(len(chunk))
+            yield chunk
+
+    def read(self, size: int = -1) -> bytes:
+        if self._chunks is None:
+            self._chunks = iter(self)
+        if size is None or size < 0:
+            data = self._buffer[self._offset:] + b"".join(self._chunks)
+            self._buffer, self._offset = b"", 0
+            return data
+        while self._offset >= len(self._buffer):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b""
+            self._buffer, self._offset = chunk, 0
+        data = self._buffer[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+
+class GzipMultipartFileStream(MultipartFileStream):
+    """
+    MultipartFileStream compressing the file part on the fly
+
+    The compressed length is unknown upfront, so the body goes out with chunked transfer encoding:
+    use it only with backends accepting chunked gzip uploads, presigned S3 POSTs don't.
+    """
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str, path: Path,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, use_mmap: bool = False, progress: ProgressCallback = None,
+                 compression_level: int = 6):
+        super().__init__(fields, file_field, f"{filename}.gz", path, "application/gzip", chunk_size, use_mmap,
+                         progress)
+        self.compression_level = compression_level
+        self._progress.total = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Content-Type": self.content_type}
+
+    def __len__(self):
+        raise TypeError("Length of a gzip stream is unknown until it's sent, send iter(stream) instead")
+
+    def _file_chunks(self) -> Iterator[bytes]:
+        compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in super()._file_chunks():
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
@@ -0,0 +1,658 @@
+import argparse
+import base64
+import csv
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Optional, Dict, List, Tuple, Any, Callable
+from urllib.parse import urlsplit, parse_qs
+
+import numpy
+from pydantic import BaseModel, Field
+
+import desirability
+from models import TemplateProperty
+
+try:
+    import orjson
+
+    def dumps(payload: Any) -> bytes:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:
+    def dumps(payload: Any) -> bytes:
+        return json.dumps(payload).encode()
+
+BUCKET_PATH = "/bucket"
+SCREENSHOTS_PATH = "/screenshots"
+FILENAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{2,100}\.(csv|tsv|txt)$")
+USER_NAME_PATTERN = re.compile(r"^[A-Za-z0-9 _-]{2,30}$")
+# smallest valid PNG, served for every feedback screenshot
+PNG_PIXEL = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJ"
+                             "RU5ErkJggg==")
+
+
+class StubError(Exception):
+    def __init__(self, status: int, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class FaultInjection(BaseModel):
+    """
+    Latency and failures added to stub responses
+
+    routes: handler names affected (e.g. "result_model", "task_status"), all routes if empty
+    """
+    latency: float = Field(0, title='Latency added to every response, seconds')
+    jitter: float = Field(0, title='Uniform random latency on top of latency, seconds')
+    error_rate: float = Field(0, title='Share of requests answered with error_status')
+    error_status: int = Field(503, title='Status of injected failures')
+    retry_after: Optional[float] = Field(None, title='Retry-After header of injected failures')
+    routes: List[str] = Field([], title='Affected routes')
+    seed: Optional[int] = Field(None, title='Random seed')
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def make_token(subject: str, kind: str = "access", ttl: float = 3600) -> str:
+    """
+    Unsigned JWT with the exp claim, the stub's stand-in for access and refresh tokens
+    """
+    claims = {"sub": subject, "type": kind, "exp": int(time.time() + ttl), "jti": uuid.uuid4().hex}
+    return ".".join([_b64(b'{"alg":"none","typ":"JWT"}'), _b64(json.dumps(claims).encode()), ""])
+
+
+def token_claims(authorization: str) -> Optional[Dict[str, Any]]:
+    """
+    Claims of a "Bearer <jwt>" header, None if it isn't a JWT
+    """
+    try:
+        payload = authorization.split(" ", 1)[-1].split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+
+
+class StubDataset:
+    def __init__(self, dataset_id: str, name: str, user_id: str, delimiter: str, names: List[str],
+                 rows: List[List[str]], size: int):
+        self.dataset_id = dataset_id
+        self.name = name
+        self.user_id = user_id
+        self.delimiter = delimiter
+        self.upload_date = datetime.utcnow().isoformat()
+        self.allocated_memory = size
+        self.deleted = False
+        self.names = names
+        self.values: Dict[str, List[str]] = {name: [row[index] if index < len(row) else "" for row in rows]
+                                             for index, name in enumerate(names)}
+        self.numeric: Dict[str, Optional[numpy.ndarray]] = {name: self._to_numeric(values)
+                                                             for name, values in self.values.items()}
+        self.rows = len(rows)
+        self.missing = sum(value == "" for values in self.values.values() for value in values)
+        self.template_id = ""
+        self.template_name = ""
+        self.template_hash = ""
+        self.scored_dataset_id = ""
+        self.scores: Optional[numpy.ndarray] = None
+        self._sort_cache: Dict[Tuple[Optional[str], Optional[str]], numpy.ndarray] = {}
+
+    @staticmethod
+    def _to_numeric(values: List[str]) -> Optional[numpy.ndarray]:
+        try:
+            return numpy.array([float(value) if value != "" else numpy.nan for value in values], dtype=numpy.float64)
+        except ValueError:
+            return None
+
+    def card(self) -> Dict[str, Any]:
+        return {"user_id": self.user_id, "name": self.name, "_id": self.dataset_id, "dataset_id": self.dataset_id,
+                "rows_num": self.rows, "cols_num": len(self.names),
+                "missing_num": self.missing,
+                "upload_date": self.upload_date, "allocated_memory": self.allocated_memory,
+                "delimiter": self.delimiter, "deleted_at": self.deleted,
+                "associated_scoring_template_id": self.template_id,
+                "associated_scoring_template_name": self.template_name, "model_type": "dataset_card"}
+
+    def sort_index(self, sort: Optional[str], order: Optional[str]) -> numpy.ndarray:
+        """
+        Row order of the sorted dataset, cached until the dataset is rescored
+        """
+        index = self._sort_cache.get((sort, order))
+        if index is None:
+            index = self._sort_cache[(sort, order)] = self._sort(sort, order)
+        return index
+
+    def set_scores(self, scores: Optional[numpy.ndarray]):
+        self.scores = scores
+        self._sort_cache.clear()
+
+    def _sort(self, sort: Optional[str], order: Optional[str]) -> numpy.ndarray:
+        if not sort:
+            return numpy.arange(self.rows)
+        if sort == "Scored_column":
+            keys = self.scores if self.scores is not None else numpy.zeros(self.rows)
+        elif sort in self.values:
+            keys = self.numeric[sort]
+            if keys is None:
+                # ranks of the texts, negated like numbers so that tied rows keep upload order in both directions
+                keys = numpy.unique(numpy.array(self.values[sort], dtype=str), return_inverse=True)[1]
+        else:
+            raise StubError(400, f"Unknown sort column {sort}")
+        if order == "desc":
+            return numpy.argsort(-keys, kind="stable")
+        return numpy.argsort(keys, kind="stable")
+
+    def result_model(self, page: int, per_page: int, sort: Optional[str], order: Optional[str]) -> Dict[str, Any]:
+        index = self.sort_index(sort, order)[(page - 1) * per_page:page * per_page].tolist()
+        columns = [{"_id": f"{self.dataset_id}-{position}", "name": name,
+                    "values": [{"order": row, "value": self.values[name][row]} for row in index],
+                    "visible": True, "pinned": False, "scored": False, "numeric": self.numeric[name] is not None,
+                    "max": "", "min": "", "color": "", "model_type": "dataset_column"}
+                   for position, name in enumerate(self.names)]
+        scored = None
+        if self.scores is not None:
+            scored = {"column_meta": [], "counted_columns": [],
+                      "scored_column": desirability.to_scored_column(self.scores[index])}
+        return {"dataset": {"user_id": self.user_id, "columns": columns, "allocated_memory": self.allocated_memory,
+                            "associated_scored_dataset_id": self.scored_dataset_id,
+                            "associated_scoring_template_id": self.template_id,
+                            "associated_scoring_template_md5_hash": self.template_hash,
+                            "columns_order": list(range(len(self.names))), "delimiter": self.delimiter,
+                            "id": self.dataset_id, "model_type": "dataset", "name": self.name,
+                            "rows_order": index, "upload_date": self.upload_date},
+                "radar": None, "scored": scored, "rendered_images": {"values": []}}
+
+
+class StubBackend:
+    """
+    In-memory state and endpoint logic of the stand-in Scoring backend
+
+    task_polls: status polls a validation task stays STARTED for
+    verify_tokens: answer 401 to requests without a live token issued by issue_token / the refresh endpoint
+    token_ttl: lifetime of tokens issued by the refresh endpoint, seconds
+    faults: latency and failure injection, can be replaced at any time
+    """
+    def __init__(self, base_url: str = "", task_polls: int = 1, user_name: str = "stub-user",
+                 verify_tokens: bool = False, token_ttl: float = 3600, faults: FaultInjection = None):
+        self.base_url = base_url
+        self.task_polls = task_polls
+        self.user_id = "stub-user-id"
+        self.user_name = user_name
+        self.verify_tokens = verify_tokens
+        self.token_ttl = token_ttl
+        self.faults = faults or FaultInjection()
+        self.lock = threading.RLock()
+        self.uploads: Dict[str, Tuple[str, bytes]] = {}
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.datasets: Dict[str, StubDataset] = {}
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        self.scored_datasets: Dict[str, Dict[str, str]] = {}
+        self.feedback: List[Dict[str, Any]] = []
+        self.calls: Dict[str, int] = {}
+        routes = [
+            ("GET", r"^/api/authorization/me$", self.authorization_me),
+            ("POST", r"^/api/authorization/refresh$", self.authorization_refresh),
+            ("PATCH", r"^/api/authorization/name$", self.authorization_name),
+            ("GET", r"^/api/upload/datasets/upload_params$", self.upload_params),
+            ("POST", f"^{BUCKET_PATH}$", self.bucket_post),
+            ("POST", r"^/api/upload/datasets/validate$", self.validate),
+            ("GET", r"^/api/task/(?P<task_id>[^/]+)/status$", self.task_status),
+            ("GET", r"^/api/task/(?P<task_id>[^/]+)/result$", self.task_result),
+            ("GET", r"^/api/datasets$", self.datasets_list),
+            ("GET", r"^/api/datasets/(?P<dataset_id>[^/]+)/result_model$", self.result_model),
+            ("DELETE", r"^/api/datasets/(?P<dataset_id>[^/]+)$", self.dataset_delete),
+            ("POST", r"^/api/datasets/(?P<dataset_id>[^/]+)/restore$", self.dataset_restore),
+            ("POST", r"^/api/scoring$", self.template_post),
+            ("DELETE", r"^/api/scoring/(?P<template_id>[^/]+)$", self.template_delete),
+            ("POST", r"^/api/scoring/(?P<template_id>[^/]+)/template_properties$", self.property_post),
+            ("DELETE", r"^/api/scoring/(?P<template_id>[^/]+)/template_properties/(?P<property_id>[^/]+)$",
+             self.property_delete),
+            ("POST", r"^/api/scored_dataset$", self.scored_dataset_post),
+            ("DELETE", r"^/api/scored_dataset/(?P<scored_dataset_id>[^/]+)$", self.scored_dataset_delete),
+            ("GET", r"^/api/feedback/user-feedback$", self.feedback_get),
+            ("GET", f"^{SCREENSHOTS_PATH}/(?P<name>[^/]+)$", self.screenshot_get),
+        ]
+        # routes are looked up by method first, a request is matched against a handful of patterns at most
+        self.routes: Dict[str, List[Tuple[re.Pattern, Callable]]] = {}
+        for method, pattern, handler in routes:
+            self.routes.setdefault(method, []).append((re.compile(pattern), handler))
+
+    @property
+    def faults(self) -> FaultInjection:
+        return self._faults
+
+    @faults.setter
+    def faults(self, faults: FaultInjection):
+        self._faults = faults
+        self._random = random.Random(faults.seed)
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: bytes,
+               headers: Dict[str, str]) -> Tuple[int, Any, Dict[str, str]]:
+        """
+        (status, payload, extra response headers) of a request, payload is JSON-serializable, bytes or None
+        """
+        for pattern, handler in self.routes.get(method, ()):
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            return 404, {"detail": "Not Found"}, {}
+        name = handler.__name__
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        injected = self._inject(name)
+        if injected is not None:
+            return injected
+        try:
+            if self.verify_tokens and handler not in (self.bucket_post, self.screenshot_get):
+                self._check_token(headers, "refresh" if handler == self.authorization_refresh else "access")
+            return (*handler(query=query, body=body, headers=headers, **match.groupdict()), {})
+        except StubError as error:
+            return error.status, {"detail": [{"loc": [], "msg": error.detail, "type": "value_error"}]}, {}
+
+    def _inject(self, name: str) -> Optional[Tuple[int, Any, Dict[str, str]]]:
+        faults = self.faults
+        if faults.routes and name not in faults.routes:
+            return None
+        if faults.latency or faults.jitter:
+            time.sleep(faults.latency + faults.jitter * self._random.random())
+        if faults.error_rate and self._random.random() < faults.error_rate:
+            headers = {"Retry-After": f"{faults.retry_after:g}"} if faults.retry_after is not None else {}
+            return faults.error_status, {"detail": "Injected failure"}, headers
+        return None
+
+    # authorization
+
+    def issue_token(self, kind: str = "access", ttl: float = None) -> str:
+        return make_token(self.user_id, kind, self.token_ttl if ttl is None else ttl)
+
+    def _check_token(self, headers: Dict[str, str], kind: str):
+        claims = token_claims(headers.get("authorization", ""))
+        if claims is None or claims.get("sub") != self.user_id or claims.get("type") != kind:
+            raise StubError(401, "Could not validate credentials")
+        if claims.get("exp", 0) <= time.time():
+            raise StubError(401, "Signature has expired")
+
+    def authorization_me(self, **kwargs):
+        with self.lock:
+            datasets = [item for item in self.datasets.values() if not item.deleted]
+        return 200, {"created_at": "2022-01-01T00:00:00",
+                     "allocated_memory": sum(item.allocated_memory for item in datasets),
+                     "datasets_count": len(datasets), "model_type": "user", "name": self.user_name}
+
+    def authorization_refresh(self, **kwargs):
+        return 200, {"access_token": self.issue_token()}
+
+    def authorization_name(self, query: Dict[str, str], **kwargs):
+        name = query.get("name", "")
+        if not USER_NAME_PATTERN.match(name):
+            raise StubError(400, f"Invalid user name {name}")
+        self.user_name = name
+        return self.authorization_me()
+
+    # upload and tasks
+
+    def upload_params(self, query: Dict[str, str], **kwargs):
+        filename = query.get("filename", "")
+        if not FILENAME_PATTERN.match(filename):
+            raise StubError(400, f"Invalid filename {filename}")
+        key = f"datasets/{uuid.uuid4()}/{filename}"
+        return 200, {"private_url": None, "detail": None,
+                     "data": {"url": f"{self.base_url}{BUCKET_PATH}", "fields": {"key": key}}}
+
+    def bucket_post(self, body: bytes, headers: Dict[str, str], **kwargs):
+        fields, file = parse_multipart(body, headers.get("content-type", ""))
+        if "key" not in fields or file is None:
+            raise StubError(400, "key and file are required")
+        with self.lock:
+            self.uploads[fields["key"]] = file
+        return 204, None
+
+    def validate(self, body: bytes, **kwargs):
+        filepath = json.loads(body)["filepath"]
+        with self.lock:
+            if filepath not in self.uploads:
+                raise StubError(404, f"File {filepath} isn't uploaded")
+            filename, content = self.uploads.pop(filepath)
+            task_id = str(uuid.uuid4())
+            self.tasks[task_id] = {"id": task_id, "status": "PENDING", "meta": {}, "result": None,
+                                   "polls_left": self.task_polls, "filename": filepath.rsplit("/", 1)[-1],
+                                   "content": content}
+        return 200, self._task_view(self.tasks[task_id])
+
+    def _task_view(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        return {"id": task["id"], "status": task["status"], "meta": task["meta"], "result": task["result"]}
+
+    def _finish_task(self, task: Dict[str, Any]):
+        try:
+            dataset = self._parse_dataset(task["filename"], task.pop("content"))
+        except (ValueError, csv.Error) as error:
+            task["status"], task["meta"] = "FAILURE", {"detail": str(error)}
+            return
+        self.datasets[dataset.dataset_id] = dataset
+        task["status"], task["result"] = "SUCCESS", dataset.card()
+
+    def _parse_dataset(self, filename: str, content: bytes) -> StubDataset:
+        text = content.decode("utf-8")
+        first_line = text.split("\n", 1)[0]
+        delimiter = "\t" if "\t" in first_line else ","
+        rows = list(csv.reader(io.StringIO(text), delimiter=delimiter))
+        if not rows:
+            raise ValueError("Empty file")
+        return StubDataset(uuid.uuid4().hex[:24], filename, self.user_id, delimiter, rows[0],
+                           [row for row in rows[1:] if row], len(content))
+
+    def task_status(self, task_id: str, **kwargs):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                raise StubError(404, f"Task {task_id} not found")
+            if task["status"] in {"PENDING", "STARTED"}:
+                if task["polls_left"] <= 0:
+                    self._finish_task(task)
+                else:
+                    task["polls_left"] -= 1
+                    task["status"] = "STARTED"
+            return 200, self._task_view(task)
+
+    def task_result(self, task_id: str, **kwargs):
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                raise StubError(404, f"Task {task_id} not found")
+            return 200, self._task_view(task)
+
+    # datasets
+
+    def _dataset(self, dataset_id: str, deleted: bool = False) -> StubDataset:
+        dataset = self.datasets.get(dataset_id)
+        if dataset is None or dataset.deleted and not deleted:
+            raise StubError(404, f"Dataset {dataset_id} not found")
+        return dataset
+
+    def datasets_list(self, query: Dict[str, str], **kwargs):
+        cards = [item.card() for item in list(self.datasets.values()) if not item.deleted]
+        if query.get("limit"):
+            cards = cards[:int(query["limit"])]
+        return 200, cards
+
+    def result_model(self, dataset_id: str, query: Dict[str, str], **kwargs):
+        dataset = self._dataset(dataset_id)
+        page = int(query.get("page") or 1)
+        per_page = int(query.get("per_page") or 25)
+        return 200, dataset.result_model(page, per_page, query.get("sort"), query.get("order"))
+
+    def dataset_delete(self, dataset_id: str, **kwargs):
+        with self.lock:
+            self._dataset(dataset_id).deleted = True
+        return 204, None
+
+    def dataset_restore(self, dataset_id: str, **kwargs):
+        with self.lock:
+            dataset = self._dataset(dataset_id, deleted=True)
+            dataset.deleted = False
+        return 200, dataset.card()
+
+    # scoring
+
+    def template_post(self, body: bytes, **kwargs):
+        request = json.loads(body)
+        self._dataset(request["dataset_id"])
+        template_id = uuid.uuid4().hex[:24]
+        properties = {uuid.uuid4().hex[:24]: item for item in request.get("properties") or []}
+        with self.lock:
+            self.templates[template_id] = {"name": request.get("name"), "dataset_id": request["dataset_id"],
+                                           "properties": properties}
+            dataset = self.datasets[request["dataset_id"]]
+            dataset.template_id, dataset.template_name = template_id, request.get("name") or ""
+        return 201, {"created_id": template_id}
+
+    def _template(self, template_id: str) -> Dict[str, Any]:
+        template = self.templates.get(template_id)
+        if template is None:
+            raise StubError(404, f"Scoring template {template_id} not found")
+        return template
+
+    def template_delete(self, template_id: str, **kwargs):
+        with self.lock:
+            template = self._template(template_id)
+            del self.templates[template_id]
+            dataset = self.datasets.get(template["dataset_id"])
+            if dataset is not None and dataset.template_id == template_id:
+                dataset.template_id = dataset.template_name = ""
+        return 204, None
+
+    def property_post(self, template_id: str, body: bytes, **kwargs):
+        template = self._template(template_id)
+        template_property = json.loads(body)
+        if template_property["column_name"] not in self._dataset(template["dataset_id"]).values:
+            raise StubError(400, f"Unknown column {template_property['column_name']}")
+        property_id = uuid.uuid4().hex[:24]
+        with self.lock:
+            template["properties"][property_id] = template_property
+        return 201, {"created_id": property_id}
+
+    def property_delete(self, template_id: str, property_id: str, **kwargs):
+        with self.lock:
+            properties = self._template(template_id)["properties"]
+            if property_id not in properties:
+                raise StubError(404, f"Template property {property_id} not found")
+            del properties[property_id]
+        return 204, None
+
+    def scored_dataset_post(self, query: Dict[str, str], **kwargs):
+        dataset = self._dataset(query.get("dataset_id"))
+        template = self._template(query.get("template_id"))
+        properties = [TemplateProperty(**item) for item in template["properties"].values()]
+        properties = [item for item in properties if item.enabled_for_scoring]
+        if not properties:
+            raise StubError(400, "No properties enabled for scoring")
+        columns = {name: dataset.numeric.get(name) for name in dataset.names}
+        for item in properties:
+            if columns.get(item.column_name) is None:
+                raise StubError(400, f"Column {item.column_name} isn't numeric")
+        scores = desirability.score(properties, columns)
+        scored_dataset_id = uuid.uuid4().hex[:24]
+        with self.lock:
+            dataset.set_scores(scores)
+            dataset.template_id = query.get("template_id")
+            dataset.template_hash = hashlib.md5(json.dumps(template["properties"], sort_keys=True)
+                                                .encode()).hexdigest()
+            dataset.scored_dataset_id = scored_dataset_id
+            self.scored_datasets[scored_dataset_id] = {"dataset_id": dataset.dataset_id,
+                                                       "template_id": query.get("template_id")}
+        return 201, {"created_id": scored_dataset_id}
+
+    def scored_dataset_delete(self, scored_dataset_id: str, **kwargs):
+        with self.lock:
+            scored_dataset = self.scored_datasets.pop(scored_dataset_id, None)
+            if scored_dataset is None:
+                raise StubError(404, f"Scored dataset {scored_dataset_id} not found")
+            dataset = self.datasets.get(scored_dataset["dataset_id"])
+            if dataset is not None and dataset.scored_dataset_id == scored_dataset_id:
+                dataset.set_scores(None)
+                dataset.template_hash = dataset.scored_dataset_id = ""
+        return 204, None
+
+    # feedback
+
+    def add_feedback(self, timestamp: datetime = None, screenshots: int = 0, **fields) -> Dict[str, Any]:
+        """
+        Store a user feedback, screenshots are served by the stub itself
+        """
+        feedback_id = uuid.uuid4().hex[:24]
+        item = {"id": feedback_id, "form_name": "feedback", "type_of_request": "bug", "user_issue": "Stub issue",
+                "email": "user@example.com", "user_id": self.user_id,
+                "screenshots": [f"{self.base_url}{SCREENSHOTS_PATH}/{feedback_id}-{index}.png"
+                                for index in range(screenshots)],
+                "timestamp": (timestamp or datetime.utcnow()).isoformat()}
+        item.update(fields)
+        with self.lock:
+            self.feedback.append(item)
+        return item
+
+    def generate_feedback(self, count: int, start: datetime, end: datetime, screenshots: int = 1, seed: int = 0):
+        """
+        Add count feedbacks spread evenly between start and end
+        """
+        rng = random.Random(seed)
+        step = (end - start) / max(count, 1)
+        for index in range(count):
+            self.add_feedback(start + step * index, rng.randint(0, screenshots),
+                              user_issue=f"Stub issue {index}", type_of_request=rng.choice(["bug", "feature"]))
+
+    def feedback_get(self, query: Dict[str, str], **kwargs):
+        try:
+            after = datetime.fromisoformat(query["after"])
+            before = datetime.fromisoformat(query["before"])
+        except (KeyError, ValueError):
+            raise StubError(400, "after and before dates are required, format yyyy-mm-dd")
+        with self.lock:
+            items = list(self.feedback)
+        return 200, [item for item in items if after <= datetime.fromisoformat(item["timestamp"]) < before]
+
+    def screenshot_get(self, name: str, **kwargs):
+        return 200, PNG_PIXEL
+
+
+def parse_multipart(body: bytes, content_type: str) -> Tuple[Dict[str, str], Optional[Tuple[str, bytes]]]:
+    """
+    Form fields and the uploaded (filename, content) of a multipart/form-data body
+    """
+    boundary = content_type.split("boundary=", 1)[-1].strip('"').encode()
+    fields, file = {}, None
+    for part in body.split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        head, content = part.split(b"\r\n\r\n", 1)
+        content = content[:-2] if content.endswith(b"\r\n") else content
+        disposition = head.decode("utf-8", "replace")
+        name = re.search(r'name="([^"]*)"', disposition)
+        filename = re.search(r'filename="([^"]*)"', disposition)
+        if filename:
+            file = (filename.group(1), content)
+        elif name:
+            fields[name.group(1)] = content.decode("utf-8")
+    return fields, file
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in one segment, flushed after every request
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    server: "StubServer"
+
+    def _dispatch(self):
+        parts = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        status, payload, extra_headers = self.server.backend.handle(self.command, parts.path, query, body, headers)
+        if isinstance(payload, bytes):
+            content, content_type = payload, "image/png"
+        else:
+            content, content_type = b"" if payload is None else dumps(payload), "application/json"
+        if self.command == "GET" and status == 200:
+            extra_headers["ETag"] = f'"{hashlib.md5(content).hexdigest()}"'
+            if headers.get("if-none-match") == extra_headers["ETag"]:
+                status, content = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in extra_headers.items():
+            self.send_header(key, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = _dispatch
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Stand-in Scoring backend serving the endpoints used by scoring_api from memory
+
+        with StubServer() as server:
+            scoring_api.set_environment(server.url)
+    """
+    daemon_threads = True
+    # many clients connect at once in concurrency runs, the default backlog of 5 resets them
+    request_queue_size = 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, backend: StubBackend = None):
+        super().__init__((host, port), StubRequestHandler)
+        self.url = f"http://{host}:{self.server_port}"
+        self.backend = backend or StubBackend()
+        self.backend.base_url = self.url
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the stand-in Scoring backend, point variables.ENV at it")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--task-polls", type=int, default=1, help="status polls before a task finishes")
+    parser.add_argument("--verify-tokens", action="store_true", help="answer 401 to unknown or expired tokens")
+    parser.add_argument("--token-ttl", type=float, default=3600)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0, help="random seconds added on top of latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests failed with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--fault-routes", nargs="*", default=[], help="handler names faults apply to, all by default")
+    parser.add_argument("--feedback", type=int, default=0, help="feedbacks generated over the last 30 days")
+    options = parser.parse_args()
+    faults = FaultInjection(latency=options.latency, jitter=options.jitter, error_rate=options.error_rate,
+                            error_status=options.error_status, retry_after=options.retry_after,
+                            routes=options.fault_routes)
+    backend = StubBackend(task_polls=options.task_polls, verify_tokens=options.verify_tokens,
+                          token_ttl=options.token_ttl, faults=faults)
+    server = StubServer(options.host, options.port, backend)
+    now = datetime.utcnow()
+    backend.generate_feedback(options.feedback, now - timedelta(days=30), now)
+    if options.verify_tokens:
+        print(f"ACCESS_TOKEN=Bearer {backend.issue_token()}")
+        print(f"REFRESH_TOKEN=Bearer {backend.issue_token('refresh', ttl=30 * 24 * 3600)}")
+    print(f"Serving on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Callable, Iterable, Dict, Awaitable, Any
+
+from pydantic import BaseModel, Field
+from models import Task
+
+PENDING_STATUSES = {"PENDING", "STARTED"}
+
+
+class TaskTimeoutError(Exception):
+    pass
+
+
+class Backoff(BaseModel):
+    initial: float = Field(0.05, title='First delay between polls, seconds')
+    factor: float = Field(2.0, title='Delay multiplier after every poll')
+    max_delay: float = Field(5.0, title='Upper bound of a delay, seconds')
+    jitter: float = Field(0.5, title='Share of a delay randomized away, 0..1')
+
+    def delay(self, attempt: int, rng: random.Random = random) -> float:
+        delay = min(self.max_delay, self.initial * self.factor ** attempt)
+        return delay * (1 - self.jitter * rng.random())
+
+
+class TaskWaitResult(BaseModel):
+    task_id: str = Field(..., title='Task Id')
+    task: Optional[Task] = Field(None, title='Last polled task')
+    polls: int = Field(0, title='Status requests sent')
+    wall_time: float = Field(0, title='Seconds from the start of waiting')
+    timed_out: bool = Field(False, title='Deadline reached before the task finished')
+    error: Optional[str] = Field(None, title='Error raised by the last poll')
+
+
+def _poll_kwargs(long_poll: Optional[float], deadline: float) -> dict:
+    if long_poll is None:
+        return {}
+    return {"wait": max(0.0, min(long_poll, deadline - time.monotonic()))}
+
+
+def _checked(task: Any) -> Task:
+    # non-JSON bodies, e.g. an HTML page of a gateway, come back as bytes
+    if not isinstance(getattr(task, "status", None), str):
+        raise TypeError(f"Unexpected task status response: {task!r:.200}")
+    return task
+
+
+def wait_for_task(task_id: str, poll: Callable[..., Task], timeout: float = 300, backoff: Backoff = None,
+                  long_poll: float = None) -> TaskWaitResult:
+    """
+    Poll a task until it leaves PENDING/STARTED
+
+    poll: status getter, e.g. scoring_api.task_task_id_status_get
+    long_poll: seconds the server may hold a status request, passed to poll as `wait`.
+        Servers without long-poll support answer at once and regular backoff is used.
+    """
+    backoff = backoff or Backoff()
+    started = time.monotonic()
+    deadline = started + timeout
+    result = TaskWaitResult(task_id=task_id)
+    while True:
+        poll_started = time.monotonic()
+        result.task = _checked(poll(task_id, **_poll_kwargs(long_poll, deadline)))
+        result.polls += 1
+        now = time.monotonic()
+        result.wall_time = now - started
+        if result.task.status not in PENDING_STATUSES:
+            return result
+        if now >= deadline:
+            raise TaskTimeoutError(f"Task {task_id} reached timeout after {result.polls} polls: {result.task}")
+        if long_poll and now - poll_started >= long_poll / 2:
+            continue  # the server held the request, no need to wait on top of it
+        time.sleep(min(backoff.delay(result.polls - 1), deadline - now))
+
+
+async def async_wait_for_task(task_id: str, poll: Callable[..., Awaitable[Task]], timeout: float = 300,
+                              backoff: Backoff = None, long_poll: float = None) -> TaskWaitResult:
+    """
+    Coroutine version of wait_for_task, poll is an async status getter
+    """
+    backoff = backoff or Backoff()
+    started = time.monotonic()
+    deadline = started + timeout
+    result = TaskWaitResult(task_id=task_id)
+    while True:
+        poll_started = time.monotonic()
+        result.task = _checked(await poll(task_id, **_poll_kwargs(long_poll, deadline)))
+        result.polls += 1
+        now = time.monotonic()
+        result.wall_time = now - started
+        if result.task.status not in PENDING_STATUSES:
+            return result
+        if now >= deadline:
+            raise TaskTimeoutError(f"Task {task_id} reached timeout after {result.polls} polls: {result.task}")
+        if long_poll and now - poll_started >= long_poll / 2:
+            continue
+        await asyncio.sleep(min(backoff.delay(result.polls - 1), deadline - now))
+
+
+class _WaitEntry:
+    __slots__ = ("result", "future", "started", "deadline")
+
+    def __init__(self, task_id: str, timeout: float):
+        self.result = TaskWaitResult(task_id=task_id)
+        self.future = Future()
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+
+
+class TaskScheduler:
+    """
+    Waits on many tasks with a single scheduling thread
+
+    Every submitted task is polled with its own backoff, polls of all tasks share a pool of max_workers threads.
+    Timed out and failed tasks are reported in TaskWaitResult instead of raising.
+
+        with TaskScheduler(scoring_api.task_task_id_status_get) as scheduler:
+            futures = [scheduler.submit(task_id) for task_id in task_ids]
+            results = [future.result() for future in futures]
+    """
+    def __init__(self, poll: Callable[..., Task], timeout: float = 300, backoff: Backoff = None,
+                 max_workers: int = 8, long_poll: float = None):
+        self.poll = poll
+        self.timeout = timeout
+        self.backoff = backoff or Backoff()
+        self.long_poll = long_poll
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task-poll")
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="task-scheduler", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "TaskScheduler":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, task_id: str, timeout: float = None) -> "Future[TaskWaitResult]":
+        entry = _WaitEntry(task_id, self.timeout if timeout is None else timeout)
+        self._schedule(entry, entry.started)
+        return entry.future
+
+    def _schedule(self, entry: _WaitEntry, due: float):
+        with self._condition:
+            heapq.heappush(self._heap, (due, next(self._sequence), entry))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._heap:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                due, _, entry = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            self._executor.submit(self._poll_once, entry)
+
+    def _poll_once(self, entry: _WaitEntry):
+        # runs in the pool, whatever goes wrong has to resolve the future or its waiter blocks forever
+        try:
+            self._poll(entry)
+        except Exception as error:
+            if not entry.future.done():
+                entry.future.set_exception(error)
+
+    def _poll(self, entry: _WaitEntry):
+        result = entry.result
+        poll_started = time.monotonic()
+        try:
+            result.task = _checked(self.poll(result.task_id, **_poll_kwargs(self.long_poll, entry.deadline)))
+        except Exception as error:
+            result.error = repr(error)
+        result.polls += 1
+        now = time.monotonic()
+        result.wall_time = now - entry.started
+        if result.error or result.task.status not in PENDING_STATUSES:
+            entry.future.set_result(result)
+        elif now >= entry.deadline:
+            result.timed_out = True
+            entry.future.set_result(result)
+        elif self.long_poll and now - poll_started >= self.long_poll / 2:
+            self._schedule(entry, now)
+        else:
+            self._schedule(entry, min(now + self.backoff.delay(result.polls - 1), entry.deadline))
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+        for _, _, entry in self._heap:
+            if not entry.future.done():
+                entry.future.cancel()
+
+
+def wait_for_tasks(task_ids: Iterable[str], poll: Callable[..., Task], timeout: float = 300,
+                   backoff: Backoff = None, max_workers: int = 8, long_poll: float = None) -> Dict[str, TaskWaitResult]:
+    """
+    Wait for all tasks at once, returns results keyed by task id
+    """
+    with TaskScheduler(poll, timeout, backoff, max_workers, long_poll) as scheduler:
+        futures = {task_id: scheduler.submit(task_id) for task_id in task_ids}
+        return {task_id: future.result() for task_id, future in futures.items()}
@@ -0,0 +1,171 @@
+import json
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, List, Iterable, Iterator
+
+from pydantic import BaseModel, Field
+
+import scoring_api
+from cleanup import Leftover, CleanupReport, cleanup
+from models import (PostScoringTemplate, RequestTemplateProperty, TemplateProperty, DesirabilityFunction,
+                    DesirabilityFunctionTypes)
+
+PARAMETER_SUFFIX = "_parameter"
+
+
+class PropertyResult(BaseModel):
+    column_name: str = Field(..., title='Column Name')
+    function_type: Optional[str] = Field(None, title='Desirability function type')
+    property_id: Optional[str] = Field(None, title='Created Id, None for properties posted with the template')
+    time: float = Field(0, title='Seconds spent on the request')
+    error: Optional[str] = Field(None, title='Error')
+
+
+class TemplateBuildReport(BaseModel):
+    template_id: Optional[str] = Field(None, title='Created template Id')
+    dataset_id: str = Field(..., title='Dataset Id')
+    name: Optional[str] = Field(None, title='Template name')
+    inline: bool = Field(False, title='Properties were posted with the template in one request')
+    properties: List[PropertyResult] = Field([], title='Properties in input order')
+    template_time: float = Field(0, title='Template request, seconds')
+    properties_time: float = Field(0, title='All property requests, seconds')
+    wall_time: float = Field(0, title='Seconds')
+    error: Optional[str] = Field(None, title='Error of the template request')
+
+    @property
+    def property_ids(self) -> List[str]:
+        return [item.property_id for item in self.properties if item.property_id is not None]
+
+    @property
+    def failed(self) -> List[PropertyResult]:
+        return [item for item in self.properties if item.error is not None]
+
+    @property
+    def ok(self) -> bool:
+        return self.template_id is not None and self.error is None and not self.failed
+
+
+def properties_from_dataframe(dataframe, columns: Iterable[str] = None,
+                              function_types: Iterable[DesirabilityFunctionTypes] = None, row: int = 0,
+                              enabled_for_scoring: bool = True, importance: int = 1) -> List[RequestTemplateProperty]:
+    """
+    Template properties from `<column>_<function type>_parameter` columns holding desirability functions as JSON,
+    like those of scoring_100_with_meta.csv
+
+    columns: value columns to take, all that have parameter columns by default
+    function_types: desirability function types to take, all by default
+    row: row the function JSON is read from
+    """
+    selected_columns = set(columns) if columns is not None else None
+    selected_types = {DesirabilityFunctionTypes(item) for item in function_types} if function_types is not None \
+        else set(DesirabilityFunctionTypes)
+    properties = []
+    for name in dataframe.columns:
+        if not name.endswith(PARAMETER_SUFFIX):
+            continue
+        prefix = name[:-len(PARAMETER_SUFFIX)]
+        function_type = next((item for item in DesirabilityFunctionTypes if prefix.endswith(f"_{item.value}")), None)
+        if function_type is None or function_type not in selected_types:
+            continue
+        column = prefix[:-len(function_type.value) - 1]
+        if selected_columns is not None and column not in selected_columns:
+            continue
+        function = DesirabilityFunction(**json.loads(dataframe[name].iloc[row]))
+        properties.append(RequestTemplateProperty(column_name=column, enabled_for_scoring=enabled_for_scoring,
+                                                  importance=importance, desirability_function=function))
+    return properties
+
+
+def _request_property(template_property) -> RequestTemplateProperty:
+    if isinstance(template_property, TemplateProperty):
+        return RequestTemplateProperty(**template_property.dict(exclude={"id", "model_type"}))
+    return template_property
+
+
+def _property_result(template_property: RequestTemplateProperty) -> PropertyResult:
+    function = template_property.desirability_function
+    return PropertyResult(column_name=template_property.column_name,
+                          function_type=function.type.value if function is not None and function.type else None)
+
+
+def _post_property(template_id: str, template_property: RequestTemplateProperty) -> PropertyResult:
+    result = _property_result(template_property)
+    started = time.monotonic()
+    try:
+        result.property_id = scoring_api.scoring_template_properties_post(template_property, template_id,
+                                                                          expected_code=201).created_id
+    except Exception as error:
+        result.error = repr(error)
+    result.time = time.monotonic() - started
+    return result
+
+
+def build_scoring_template(template: PostScoringTemplate, properties: Iterable[RequestTemplateProperty] = None,
+                           workers: int = 16, inline: bool = False) -> TemplateBuildReport:
+    """
+    Create a scoring template with all its properties
+
+    properties: added to template.properties
+    inline: post the properties with the template in one request, for backends creating them from
+        PostScoringTemplate.properties; their ids aren't returned then and they are deleted with the template
+    Otherwise the template is posted empty and the properties by a pool of workers. A failed property doesn't stop
+    the others, the template is kept for teardown_scoring_template.
+    """
+    properties = [_request_property(item) for item in [*(template.properties or []), *(properties or [])]]
+    report = TemplateBuildReport(dataset_id=template.dataset_id, name=template.name, inline=inline)
+    started = time.monotonic()
+    request = template.copy(update={"properties": [TemplateProperty(**item.dict()) for item in properties]
+                                    if inline else []})
+    try:
+        report.template_id = scoring_api.scoring_template_post(request, expected_code=201).created_id
+    except Exception as error:
+        report.error = repr(error)
+    report.template_time = time.monotonic() - started
+    if report.template_id is not None and inline:
+        report.properties = [_property_result(item) for item in properties]
+    elif report.template_id is not None and properties:
+        properties_started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(properties))),
+                                thread_name_prefix="template-properties") as executor:
+            report.properties = list(executor.map(lambda item: _post_property(report.template_id, item),
+                                                  properties))
+        report.properties_time = time.monotonic() - properties_started
+    report.wall_time = time.monotonic() - started
+    return report
+
+
+def teardown_scoring_template(report: TemplateBuildReport, workers: int = 16, retries: int = 3,
+                              scored_dataset_ids: Iterable[str] = ()) -> CleanupReport:
+    """
+    Delete scored datasets of the template, its properties (concurrently) and the template itself
+    """
+    if report.template_id is None:
+        return CleanupReport()
+    leftovers = [Leftover(kind="scored_dataset", id=item, dataset_id=report.dataset_id)
+                 for item in scored_dataset_ids]
+    leftovers += [Leftover(kind="template_property", id=item, parent_id=report.template_id,
+                           dataset_id=report.dataset_id) for item in report.property_ids]
+    leftovers.append(Leftover(kind="scoring_template", id=report.template_id, dataset_id=report.dataset_id,
+                              name=report.name))
+    return cleanup(leftovers, workers, retries)
+
+
+@contextmanager
+def scoring_template(template: PostScoringTemplate, properties: Iterable[RequestTemplateProperty] = None,
+                     workers: int = 16, inline: bool = False) -> Iterator[TemplateBuildReport]:
+    """
+    Template built on enter and torn down on exit, e.g. in a fixture:
+
+        with scoring_template(PostScoringTemplate(name=name, dataset_id=dataset_id),
+                              properties_from_dataframe(dataframe)) as template:
+            yield template.template_id
+    """
+    report = build_scoring_template(template, properties, workers, inline)
+    try:
+        assert report.ok, f"Scoring template wasn't built: {report.error or report.failed}"
+        yield report
+    finally:
+        teardown = teardown_scoring_template(report, workers)
+    assert not teardown.failed, f"Scoring template wasn't deleted: {teardown.failed}"
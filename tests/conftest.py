@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pytest
+
+import scoring_api
+from cache import set_response_cache
+from cleanup import cleanup_leftovers
+from stub_server import StubServer, StubBackend
+
+pytest_plugins = ["tracing_plugin", "cassette_plugin"]
+
+
+# set by pytest-xdist in its workers, a run without workers is a run of one worker
+RUN_ID = os.environ.get("PYTEST_XDIST_TESTRUNUID", uuid.uuid4().hex)[:8]
+WORKER = os.environ.get("PYTEST_XDIST_WORKER", "main")
+WORKER_COUNT = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", 1))
+
+
+class SharedResources:
+    """
+    Values created once per test run and reused by all xdist workers, e.g. ids of uploaded datasets
+
+    Every key is created by the first worker asking for it while the others wait on a lock file;
+    values are kept as JSON in a directory of the run.
+    Names of shared datasets must start with `prefix`, the last of `workers` to finish deletes them;
+    the xdist controller deletes what is left by a crashed worker.
+    """
+    def __init__(self, directory: Path, prefix: str, workers: int = WORKER_COUNT, timeout: float = 600):
+        self.directory = directory
+        self.prefix = prefix
+        self.workers = workers
+        self.timeout = timeout
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def _lock(self, name: str) -> Path:
+        path = self.directory / f"{name}.lock"
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+            except FileExistsError:
+                assert time.monotonic() < deadline, f"Lock {path} wasn't released in {self.timeout}s"
+                time.sleep(0.05)
+
+    def get(self, key: str, factory: Callable[[], Any]) -> Any:
+        path = self.directory / f"{key}.json"
+        if path.exists():
+            return json.loads(path.read_text())
+        lock = self._lock(key)
+        try:
+            if path.exists():
+                return json.loads(path.read_text())
+            value = factory()
+            temporary = path.with_suffix(".tmp")
+            temporary.write_text(json.dumps(value))
+            temporary.replace(path)
+            return value
+        finally:
+            lock.unlink()
+
+    def finish_worker(self) -> bool:
+        """
+        Count a finished worker, True for the last one
+        """
+        lock = self._lock("workers")
+        try:
+            path = self.directory / "finished_workers"
+            finished = int(path.read_text()) + 1 if path.exists() else 1
+            path.write_text(str(finished))
+            return finished >= self.workers
+        finally:
+            lock.unlink()
+
+    def created(self) -> bool:
+        return any(self.directory.glob("*.json"))
+
+    def delete(self):
+        """
+        Delete the shared datasets and the directory of the run
+        """
+        try:
+            if self.created():
+                report = cleanup_leftovers(prefix=self.prefix)
+                assert not report.failed, f"Shared datasets weren't deleted: {report.failed}"
+        finally:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+shared_resources = SharedResources(Path(tempfile.gettempdir()) / f"scoring_auto_qa-{RUN_ID}", f"Auto-{RUN_ID}-shared")
+
+
+def pytest_configure(config):
+    # dataset names hold the run id, recorded requests have to match the ones of later runs
+    config.pluginmanager.get_plugin("cassette_plugin").SCRUB.append(r"(?<=^Auto-)[0-9a-f]{8}(?=-)")
+    if not config.pluginmanager.hasplugin("xdist"):
+        config.addinivalue_line("markers", "xdist_group(name): tests sharing module state, run by one worker")
+    else:
+        # `-n N` alone distributes single tests, modules marked with xdist_group need their tests kept together
+        if getattr(config.option, "dist", "no") == "load":
+            config.option.dist = "loadgroup"
+        # the controller hands its run id to the workers, so it finds the directory of a crashed worker's run
+        if WORKER == "main" and not getattr(config.option, "testrunuid", None):
+            config.option.testrunuid = RUN_ID
+
+
+def pytest_sessionfinish(session):
+    if session.config.pluginmanager.has_plugin("dsession"):
+        # xdist controller, finishes after its workers: anything left belongs to a worker that crashed
+        shared_resources.delete()
+        return
+    if shared_resources.finish_worker():
+        shared_resources.delete()
+
+
+@pytest.fixture(scope="session")
+def name_prefix() -> str:
+    """
+    Prefix of names of datasets created by this worker, module teardowns delete only those
+    """
+    return f"Auto-{RUN_ID}-{WORKER}"
+
+
+@pytest.fixture(scope="session")
+def shared() -> SharedResources:
+    return shared_resources
+
+
+@contextmanager
+def _stub_environment(backend: StubBackend = None) -> Iterator[StubServer]:
+    # set_environment resets the shared scheduler, tokens and cached responses of another host mustn't leak either
+    with StubServer(backend=backend) as server:
+        previous = scoring_api.set_environment(server.url)
+        previous_manager = scoring_api.set_token_manager(None)
+        previous_cache = set_response_cache(None)
+        try:
+            yield server
+        finally:
+            set_response_cache(previous_cache)
+            scoring_api.set_token_manager(previous_manager)
+            scoring_api.set_environment(previous)
+
+
+@pytest.fixture(scope="session")
+def stub_environment() -> Callable[..., Iterator[StubServer]]:
+    """
+    Context manager pointing the API wrappers at a fresh stub server, for modules overriding `stub`
+    """
+    return _stub_environment
+
+
+@pytest.fixture(scope="module")
+def stub() -> StubServer:
+    """
+    Stub server shared by the tests of a module, the API wrappers talk to it instead of variables.ENV
+    """
+    with _stub_environment() as server:
+        yield server
@@ -0,0 +1,71 @@
+import asyncio
+import time
+import uuid
+import scoring_api
+
+from pathlib import Path
+from async_scoring_api import AsyncScoringApi
+from stub_server import StubServer
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+def test_concurrent_user_info():
+    async def scenario():
+        async with AsyncScoringApi(max_concurrency=10) as api:
+            return await asyncio.gather(*[api.authorization_me_get() for _ in range(20)])
+
+    expected_user = scoring_api.authorization_me_get()
+    users = asyncio.run(scenario())
+    assert all(user.name == expected_user.name for user in users), \
+        f"Concurrent calls returned different users: {users}"
+
+
+def test_concurrent_datasets_list():
+    async def scenario():
+        async with AsyncScoringApi(max_concurrency=5) as api:
+            return await asyncio.gather(*[api.get_datasets_list() for _ in range(10)])
+
+    lists = asyncio.run(scenario())
+    expected_ids = {item.dataset_id for item in lists[0]}
+    for datasets in lists[1:]:
+        assert {item.dataset_id for item in datasets} == expected_ids, "Concurrent dataset lists differ"
+
+
+# the tests below run against the stub, they come last since the stub fixture stays up until the module ends
+def test_async_upload_dataset(stub: StubServer):
+    async def scenario():
+        async with AsyncScoringApi() as api:
+            task = await api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv')
+            return task.result, await api.get_datasets_list()
+
+    dataset, datasets = asyncio.run(scenario())
+    assert dataset.rows_num == 20 and dataset.cols_num == 20, f"Unexpected dataset card: {dataset}"
+    assert dataset.dataset_id in [item.dataset_id for item in datasets], "Uploaded dataset isn't in the list"
+
+
+def test_async_upload_keeps_loop_responsive(stub: StubServer):
+    def slow_disk(sent: int, total: int, bytes_per_second: float):
+        time.sleep(0.1)
+
+    async def ticker(gaps: list, done: asyncio.Event):
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    async def scenario():
+        gaps, done = [], asyncio.Event()
+        async with AsyncScoringApi() as api:
+            upload_params = await api.upload_datasets_upload_params_get(f"Auto-{uuid.uuid4()}.csv")
+            ticking = asyncio.create_task(ticker(gaps, done))
+            await api.upload_file_to_bucket(upload_params, "upload.csv", DATA_DIR / '20_20.csv', chunk_size=1024,
+                                            progress=slow_disk)
+            done.set()
+            await ticking
+        return gaps
+
+    gaps = asyncio.run(scenario())
+    assert gaps and max(gaps) < 0.08, f"File reads blocked the event loop for {max(gaps):.3f}s"
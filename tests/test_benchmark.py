@@ -0,0 +1,36 @@
+import pytest
+
+from benchmark import BenchmarkReport, scenario_matrix, run_benchmark
+from transport import get_transport
+
+# benchmarks replace the shared transport and talk to their own stub server
+pytestmark = pytest.mark.no_cassette
+
+
+def test_stub_benchmark():
+    scenarios = scenario_matrix(["datasets_list", "result_model", "score"], sorts=["Column_1", "Scored_column"],
+                                concurrency=[1, 2], warmup=1, repeats=5)
+    report = run_benchmark(scenarios, stub=True)
+    assert len(report.results) == len(scenarios), "Not all scenarios were run"
+    for result in report.results:
+        assert result.errors == 0, f"{result.name} failed: {result.first_error}"
+        assert result.calls == 5 and 0 < result.p50 <= result.p95 <= result.p99, f"Unexpected result: {result}"
+
+
+def test_benchmark_regression():
+    scenarios = scenario_matrix(["datasets_list"], warmup=0, repeats=3)
+    report = run_benchmark(scenarios, stub=True)
+    baseline = BenchmarkReport(**report.dict())
+    baseline.results[0].p95 = report.results[0].p95 / 2
+    regressions = report.compare(baseline, tolerance=0.2)
+    assert [item.metric for item in regressions] == ["p95"], f"Unexpected regressions: {regressions}"
+    assert not report.compare(report), "Report regressed against itself"
+
+
+def test_scenario_transport_restored():
+    shared = get_transport()
+    scenarios = scenario_matrix(["datasets_list"], warmup=0, repeats=2, transport={"pool_maxsize": 4})
+    report = run_benchmark(scenarios, stub=True)
+    assert report.results[0].errors == 0, f"Scenario failed: {report.results[0].first_error}"
+    assert get_transport() is shared, "Shared transport wasn't restored after the scenario"
+    assert "columns=3" in report.results[0].name, f"Columns missing from the scenario name: {report.results[0].name}"
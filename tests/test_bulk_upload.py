@@ -0,0 +1,32 @@
+import uuid
+import pytest
+import scoring_api
+
+from pathlib import Path
+from bulk_upload import bulk_upload_datasets, StageLimits
+from cleanup import cleanup_leftovers
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.fixture(scope="module", autouse=True)
+def clean_up_datasets(name_prefix: str):
+    yield
+    report = cleanup_leftovers(prefix=name_prefix)
+    assert not report.failed, f"Leftovers weren't deleted: {report.failed}"
+
+
+def test_bulk_upload(name_prefix: str):
+    paths = [DATA_DIR / '20_20.csv'] * 3
+    report = bulk_upload_datasets(paths, filename_factory=lambda path: f"{name_prefix}-{uuid.uuid4()}.csv",
+                                  limits=StageLimits(bucket=2))
+    assert not report.failed, f"Some uploads failed: {report.failed}"
+    datasets_list = scoring_api.get_datasets_list()
+    actual_ids = {dataset.dataset_id for dataset in datasets_list}
+    for result in report.results:
+        assert result.dataset_id in actual_ids, f"Uploaded dataset {result.dataset_id} isn't presented in response"
+
+
+def test_bulk_upload_reports_failed_stage():
+    report = bulk_upload_datasets([DATA_DIR / '20_20.csv'], filename_factory=lambda path: "20-20@data.csv")
+    assert report.results[0].failed_stage == "params", f"Unexpected failed stage: {report.results[0]}"
@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+import textwrap
+import uuid
+import pytest
+import scoring_api
+
+from pathlib import Path
+from cassette import Cassette, CassetteMiss, use_cassette
+from stub_server import StubServer, StubBackend
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+ROOT = Path(__file__).resolve().parent.parent
+
+# the tests record and replay on their own
+pytestmark = pytest.mark.no_cassette
+
+
+def scenario():
+    filename = f"Auto-{uuid.uuid4()}.csv"
+    dataset_id = scoring_api.upload_dataset(filename, DATA_DIR / '20_20.csv').result.dataset_id
+    page = scoring_api.get_dataset_result_model(dataset_id, page=1, per_page=5, sort="Molecular_Weight")
+    assert [dataset.name for dataset in scoring_api.get_datasets_list()] == [filename], \
+        "Uploaded dataset isn't listed under its name"
+    return dataset_id, [column.name for column in page.dataset.columns]
+
+
+def test_record_and_replay(tmp_path: Path):
+    path = tmp_path / "cassette.ndjson.gz"
+    backend = StubBackend(task_polls=3)
+    with StubServer(backend=backend) as server:
+        previous = scoring_api.set_environment(server.url)
+        try:
+            with use_cassette(path, mode="record") as cassette:
+                recorded = scenario()
+        finally:
+            scoring_api.set_environment(previous)
+    assert cassette.stats.recorded == len(Cassette(path).load()), "Not every exchange was saved"
+    endpoints = [item.endpoint for item in cassette.interactions]
+    assert "POST /bucket" in " ".join(endpoints), f"Bucket upload wasn't recorded: {endpoints}"
+    statuses = [item.text for item in cassette.interactions if item.endpoint.endswith("/status")]
+    assert len(statuses) == 4 and "SUCCESS" in statuses[-1], f"Unexpected polling sequence: {statuses}"
+
+    # the server is gone, every call has to come from the cassette, names of this run replace the recorded ones
+    previous = scoring_api.set_environment(server.url)
+    try:
+        with use_cassette(path, mode="replay") as cassette:
+            replayed = scenario()
+            with pytest.raises(CassetteMiss):
+                scoring_api.delete_dataset(recorded[0])
+    finally:
+        scoring_api.set_environment(previous)
+    assert replayed == recorded, "Replayed responses differ from the recorded ones"
+    stats = cassette.stats
+    assert stats.hits + stats.loose_hits == len(cassette) and not stats.repeats and stats.misses == 1, \
+        f"Unexpected stats: {stats}"
+
+
+def test_matching():
+    cassette = Cassette("unused.ndjson", scrub=[r"run\d+"])
+    url = "http://qa/api/datasets/5f3c9a1b2c3d4e5f6a7b8c9d/result_model?page=2"
+    key = cassette.request_key("get", url, *cassette.request(url, params={"sort": "name", "per_page": None},
+                                                             json_body={"name": "Auto-run42-x"}))
+    assert key == ("GET /api/datasets/{id}/result_model", {"page": "2", "sort": "name"}, {"name": "Auto-<id>-x"}), \
+        f"Unexpected request key: {key}"
+
+    class Response:
+        def __init__(self, status_code, content):
+            self.status_code, self.content, self.headers, self.elapsed = status_code, content, {}, None
+
+    url = "http://qa/api/task/0123456789abcdef0123/status"
+    for status in ("STARTED", "SUCCESS"):
+        cassette.record("get", url, Response(200, f'{{"status": "{status}"}}'.encode()))
+    cassette.record("post", "http://qa/api/datasets", Response(201, b'{"name": "Auto-run1-a.csv"}'),
+                    json={"name": "Auto-run1-a.csv"})
+    polls = [cassette.match("get", url).text for _ in range(3)]
+    assert polls == ['{"status": "STARTED"}', '{"status": "SUCCESS"}', '{"status": "SUCCESS"}'], \
+        f"Polls weren't replayed in order: {polls}"
+    interaction = cassette.match("post", "http://qa/api/datasets", json={"name": "Auto-run2-a.csv"})
+    assert cassette.content(interaction) == b'{"name": "Auto-run2-a.csv"}', "Name of this run wasn't replayed"
+    interaction = cassette.match("post", "http://qa/api/datasets", json={"name": "Auto-run2-b.csv"})
+    assert cassette.content(interaction) == b'{"name": "Auto-run2-a.csv"}', \
+        "Request with another value of the same body keys wasn't matched"
+    with pytest.raises(CassetteMiss):
+        cassette.match("post", "http://qa/api/datasets", json={"title": "b.csv"})
+    assert cassette.stats.dict() == {"recorded": 3, "hits": 3, "loose_hits": 0, "repeats": 2, "misses": 1}, \
+        f"Unexpected stats: {cassette.stats}"
+
+
+def run_plugin(directory: Path, mode: str, environment: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-m", "pytest", "-q", "-p", "cassette_plugin", "-p", "no:cacheprovider",
+                           "--cassettes", mode, "--cassette-dir", str(directory / "cassettes"),
+                           "--rootdir", str(directory), str(directory / "test_module.py")],
+                          cwd=directory, capture_output=True, text=True, timeout=120,
+                          env={**os.environ, "PYTHONPATH": str(ROOT), "SCORING_STUB_URL": environment})
+
+
+def test_plugin_auto_records_every_test(tmp_path: Path):
+    (tmp_path / "test_module.py").write_text(textwrap.dedent("""
+        import os
+        import scoring_api
+
+        scoring_api.set_environment(os.environ["SCORING_STUB_URL"])
+
+
+        def test_first():
+            assert scoring_api.get_datasets_list() == []
+
+
+        def test_second():
+            assert scoring_api.authorization_me_get().name
+    """))
+    with StubServer() as server:
+        recorded = run_plugin(tmp_path, "auto", server.url)
+    assert recorded.returncode == 0, f"Recording run failed:\n{recorded.stdout}{recorded.stderr}"
+    assert "recorded 2" in recorded.stdout, f"Both tests weren't recorded:\n{recorded.stdout}"
+    # the server is gone, the calls of both tests have to be in the cassette
+    replayed = run_plugin(tmp_path, "auto", server.url)
+    assert replayed.returncode == 0 and "hits 2" in replayed.stdout, \
+        f"Recorded calls weren't replayed:\n{replayed.stdout}{replayed.stderr}"
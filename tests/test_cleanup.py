@@ -0,0 +1,93 @@
+import uuid
+import pytest
+import scoring_api
+
+from datetime import timedelta
+from pathlib import Path
+from typing import Tuple
+from cleanup import cleanup, cleanup_leftovers, discover_leftovers, Leftover
+from models import *
+from scheduler import configure_scheduler, set_scheduler
+from stub_server import StubServer, FaultInjection
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.fixture()
+def stub(stub_environment) -> StubServer:
+    # every test counts the leftovers of its own server
+    with stub_environment() as server:
+        yield server
+
+
+def upload(name: str) -> str:
+    return scoring_api.upload_dataset(f"{name}-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv').result.dataset_id
+
+
+def add_template(dataset_id: str, scored: bool) -> Tuple[str, str]:
+    request = PostScoringTemplate(name=f"Auto_{uuid.uuid4().hex[:8]}", dataset_id=dataset_id)
+    template_id = scoring_api.scoring_template_post(request, expected_code=201).created_id
+    function = DesirabilityFunction(name="LinearFunction", type="linear", points=[{"x": 0, "y": 0}, {"x": 1, "y": 1}])
+    template_property = RequestTemplateProperty(column_name="Molecular_Weight", enabled_for_scoring=True,
+                                                desirability_function=function)
+    property_id = scoring_api.scoring_template_properties_post(template_property, template_id,
+                                                               expected_code=201).created_id
+    if scored:
+        scoring_api.scored_dataset_post(dataset_id, template_id, expected_code=201)
+    return template_id, property_id
+
+
+def test_cleanup_leftovers(stub: StubServer):
+    leftovers = [upload("Auto") for _ in range(6)]
+    kept = upload("Keep")
+    add_template(leftovers[0], scored=True)
+    add_template(leftovers[1], scored=False)
+    add_template(kept, scored=True)
+
+    report = cleanup_leftovers(prefix="Auto", workers=4)
+    counts = report.counts()
+    assert not report.failed, f"Leftovers weren't deleted: {report.failed}"
+    assert [counts[kind]["deleted"] for kind in ("scored_dataset", "scoring_template", "dataset")] == [1, 2, 6], \
+        f"Unexpected counts: {counts}"
+    assert [item.dataset_id for item in scoring_api.get_datasets_list()] == [kept], "Wrong datasets were deleted"
+    assert len(stub.backend.templates) == 1 and len(stub.backend.scored_datasets) == 1, \
+        "Scoring artifacts of kept datasets were deleted"
+    kinds = [item.leftover.kind for item in report.results]
+    assert kinds == sorted(kinds, key=["scored_dataset", "scoring_template", "dataset"].index), \
+        f"Artifacts weren't deleted in dependency order: {kinds}"
+
+
+def test_cleanup_filters(stub: StubServer):
+    dataset_id = upload("Auto")
+    assert not discover_leftovers(prefix="Auto", older_than=timedelta(hours=1)), "Fresh dataset is a leftover"
+    assert not discover_leftovers(prefix="Keep"), "Dataset with another prefix is a leftover"
+    report = cleanup_leftovers(prefix=None, contains="uto-", dry_run=True)
+    assert [item.leftover.id for item in report.results] == [dataset_id] and not report.failed, \
+        f"Unexpected dry run: {report.results}"
+    assert scoring_api.get_datasets_list(), "Dry run deleted a dataset"
+
+
+def test_cleanup_properties_and_retries(stub: StubServer):
+    dataset_id = upload("Auto")
+    template_id, property_id = add_template(dataset_id, scored=False)
+    stub.backend.faults = FaultInjection(error_rate=0.5, routes=["dataset_delete", "property_delete"], seed=1)
+    report = cleanup([Leftover(kind="template_property", id=property_id, parent_id=template_id),
+                      Leftover(kind="dataset", id=dataset_id)], retries=20)
+    assert not report.failed, f"Leftovers weren't deleted: {report.failed}"
+    calls = stub.backend.calls
+    assert calls["dataset_delete"] + calls["property_delete"] > 2, "Injected failures weren't retried"
+    assert sum(item.attempts for item in report.results) == calls["dataset_delete"] + calls["property_delete"], \
+        "Attempts don't match the requests sent"
+    assert not stub.backend.templates[template_id]["properties"], "Property wasn't deleted"
+
+
+def test_cleanup_rate_limit(stub: StubServer):
+    dataset_ids = [upload("Auto") for _ in range(6)]
+    previous = set_scheduler(None)
+    try:
+        configure_scheduler(rate=20, burst=1, max_retries=3)
+        report = cleanup([Leftover(kind="dataset", id=dataset_id) for dataset_id in dataset_ids], workers=16)
+    finally:
+        set_scheduler(previous)
+    assert not report.failed and report.wall_time >= 5 / 20, \
+        f"Deletes weren't held to the shared rate limit: {report.wall_time:.2f}s"
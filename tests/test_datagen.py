@@ -0,0 +1,33 @@
+import json
+import pandas
+import pytest
+
+from pathlib import Path
+from datagen import generate_dataset
+from desirability import evaluate
+
+APPROXIMATION_ALLOWED = 1e-6
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.mark.parametrize("filename, parameters_in_every_row", [("generated.csv", True), ("generated.csv.gz", False)])
+def test_generated_dataset_layout(tmp_path: Path, filename, parameters_in_every_row):
+    path = generate_dataset(tmp_path / filename, rows=250, columns=3, seed=1, block_rows=100,
+                            parameters_in_every_row=parameters_in_every_row)
+    df = pandas.read_csv(path, sep='\t')
+    expected_df = pandas.read_csv(DATA_DIR / 'scoring_100_with_meta.csv', sep='\t', nrows=1)
+    assert list(df.columns) == list(expected_df.columns), "Generated columns differ from scoring_100_with_meta.csv"
+    assert df.shape[0] == 250, f"Unexpected number of rows: {df.shape[0]}"
+    for column in ["Column_1_linear", "Column_2_logistic", "Column_3_custom_curve"]:
+        function = json.loads(df[f"{column}_parameter"].iloc[0])
+        value_column = "_".join(column.split("_")[:2])
+        expected_rows = evaluate(function, df[value_column])
+        assert pytest.approx(df[column].to_numpy(), abs=APPROXIMATION_ALLOWED) == expected_rows, \
+            f"Scores of {column} don't match its parameters"
+
+
+def test_generated_dataset_is_deterministic(tmp_path: Path):
+    first = generate_dataset(tmp_path / "first.csv", rows=100, seed=7).read_bytes()
+    second = generate_dataset(tmp_path / "second.csv", rows=100, seed=7).read_bytes()
+    assert first == second, "Datasets generated with the same seed differ"
@@ -5,28 +5,32 @@ import scoring_api
 from typing import Union
 from pathlib import Path
 from models import DatasetExtendedCardOut, Model
+from cleanup import cleanup_leftovers
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+# the tests go through one dataset in order, xdist keeps them on one worker
+pytestmark = pytest.mark.xdist_group("dataset_crud")
 
 
 class LocalTestContext(Model):
     created_dataset: Union[DatasetExtendedCardOut, None]
+    prefix: str = "Auto"
 
 
 @pytest.fixture(scope="module", autouse=True)
-def share_and_clean_up_data() -> LocalTestContext:
-    yield LocalTestContext()
-    data = scoring_api.get_datasets_list()
-    for item in data:
-        if "Auto" in item.name:
-            scoring_api.delete_dataset(item.dataset_id, expected_code=204)
+def share_and_clean_up_data(name_prefix: str) -> LocalTestContext:
+    yield LocalTestContext(prefix=name_prefix)
+    report = cleanup_leftovers(prefix=name_prefix)
+    assert not report.failed, f"Leftovers weren't deleted: {report.failed}"
 
 
 def test_file_upload(share_and_clean_up_data: LocalTestContext):
-    filename = str(uuid.uuid4())
-    result = scoring_api.upload_dataset(f"Auto-{filename}.csv", Path('data/20_20.csv'))
+    filename = f"{share_and_clean_up_data.prefix}-{uuid.uuid4()}.csv"
+    result = scoring_api.upload_dataset(filename, DATA_DIR / '20_20.csv')
     share_and_clean_up_data.created_dataset = result.result
-    assert result.result.name == f"Auto-{filename}.csv", f"Filename doesn't match with the expected one. " \
-                                                         f"Expected: f'Auto-{filename}.csv', " \
-                                                         f"actual: {result.result.name}"
+    assert result.result.name == filename, f"Filename doesn't match with the expected one. " \
+                                           f"Expected: {filename}, actual: {result.result.name}"
 
 
 def test_get_dataset(share_and_clean_up_data: LocalTestContext):
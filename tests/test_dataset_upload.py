@@ -3,25 +3,25 @@ import pytest
 import scoring_api
 
 from pathlib import Path
+from cleanup import cleanup_leftovers
 
 # TODO: tests with invalid file format, invalid delimiter, too large size
 
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
 
 @pytest.fixture(scope="module", autouse=True)
-def clean_up_datasets():
+def clean_up_datasets(name_prefix: str):
     yield
-    data = scoring_api.get_datasets_list()
-    for item in data:
-        if "Auto" in item.name:
-            scoring_api.delete_dataset(item.dataset_id, expected_code=204)
-
-
-def test_file_upload():
-    filename = str(uuid.uuid4())
-    result = scoring_api.upload_dataset(f"Auto-{filename}.csv", Path('data/20_20.csv'))
-    assert result.result.name == f"Auto-{filename}.csv", f"Filename doesn't match with the expected one. " \
-                                                            f"Expected: f'Auto-{filename}.csv', " \
-                                                            f"actual: {result.result.name}"
+    report = cleanup_leftovers(prefix=name_prefix)
+    assert not report.failed, f"Leftovers weren't deleted: {report.failed}"
+
+
+def test_file_upload(name_prefix: str):
+    filename = f"{name_prefix}-{uuid.uuid4()}.csv"
+    result = scoring_api.upload_dataset(filename, DATA_DIR / '20_20.csv')
+    assert result.result.name == filename, f"Filename doesn't match with the expected one. " \
+                                           f"Expected: {filename}, actual: {result.result.name}"
 
 
 @pytest.mark.parametrize("filename", [".csv", "_.csv", "20-20@data.csv", "20-20дата.csv", f"verylongnam{'e'*90}.csv"],
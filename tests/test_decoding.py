@@ -0,0 +1,118 @@
+import json
+import uuid
+import pytest
+import scoring_api
+
+from json import JSONDecodeError
+from pathlib import Path
+from decoding import (Decoder, ResultModelStruct, TaskStruct, DatasetExtendedCardStruct, CompactValues,
+                      JSON_BACKENDS, set_decoder, json_loads)
+from microbench import result_model_payload, decoding_benchmark, memory_benchmark
+from models import ResultModel
+from stub_server import StubServer
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+def installed_backends():
+    backends = []
+    for backend in JSON_BACKENDS:
+        try:
+            json_loads(backend)
+        except ImportError:
+            continue
+        backends.append(backend)
+    return backends
+
+
+@pytest.fixture
+def struct_decoder() -> Decoder:
+    decoder = Decoder("auto", "struct")
+    previous = set_decoder(decoder)
+    yield decoder
+    set_decoder(previous)
+
+
+@pytest.mark.parametrize("backend", installed_backends())
+def test_json_backends(backend: str):
+    payload = result_model_payload(columns=3, rows=10)
+    assert json_loads(backend)(json.dumps(payload).encode()) == payload, f"{backend} decoded another payload"
+    for body in [b"", b"{", b"<html></html>"]:
+        with pytest.raises(JSONDecodeError):
+            json_loads(backend)(body)
+
+
+def test_struct_matches_model():
+    payload = result_model_payload(columns=5, rows=20)
+    struct = ResultModelStruct.from_json(payload)
+    model = ResultModel(**payload)
+    assert struct.to_model() == model, "Struct holds other data than the model"
+    assert struct.dict() == model.dict(), "Struct dict differs from the model dict"
+    column = struct.dataset.columns[2]
+    assert (column.id, column.name, column.values[3].order, column.values[3].value) == \
+           ("dataset-2", "Column_3", payload["dataset"]["rows_order"][3],
+            payload["dataset"]["columns"][2]["values"][3]["value"]), f"Unexpected column struct: {column}"
+
+
+@pytest.mark.parametrize("models", ["struct", "compact"])
+def test_custom_columns(models: str):
+    payload = result_model_payload(columns=2, rows=5)
+    payload["dataset"]["columns"].append({"_id": "formula", "name": "Formula", "ordinal_number": 2,
+                                          "model_type": "custom_dataset_column", "custom_formula": "Column_1 * 2"})
+    result = Decoder(models=models).build(ResultModel, payload)
+    column = result.dataset.columns[2]
+    assert (column.ordinal_number, column.custom_formula, len(column.values)) == (2, "Column_1 * 2", 0), \
+        f"Unexpected custom column: {column!r}"
+    assert result.dict() == ResultModel(**payload).dict(), "Struct holds other data than the model"
+
+
+def test_struct_wrappers(stub: StubServer, struct_decoder: Decoder):
+    task = scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv')
+    assert isinstance(task, TaskStruct) and isinstance(task.result, DatasetExtendedCardStruct), \
+        f"Structs weren't built: {task!r}"
+    dataset = task.result
+    cards = scoring_api.get_datasets_list()
+    assert dataset in cards and all(isinstance(card, DatasetExtendedCardStruct) for card in cards), \
+        "Uploaded dataset isn't in the list"
+    result_model = scoring_api.get_dataset_result_model(dataset.dataset_id, 1, 5, "Molecular_Weight", "asc")
+    set_decoder(Decoder())
+    expected = scoring_api.get_dataset_result_model(dataset.dataset_id, 1, 5, "Molecular_Weight", "asc")
+    assert result_model.to_model() == expected, "Struct result model differs from the pydantic one"
+
+
+def test_decoding_benchmark():
+    measurements = {item.name: item for item in decoding_benchmark(columns=5, rows=50, repeats=1)}
+    assert {"loads[json]", "build[pydantic]", "build[struct]"} <= set(measurements), \
+        f"Missing measurements: {list(measurements)}"
+    assert measurements["build[struct]"].retained_bytes < measurements["build[pydantic]"].retained_bytes, \
+        f"Structs take more memory than pydantic models: {measurements}"
+
+
+def test_compact_values():
+    cells = [{"order": 3, "value": "1.5"}, {"order": 0, "value": ""}, {"order": 2, "value": "молекула"},
+             {"order": 1, "value": 7}]
+    values = CompactValues.from_cells(cells)
+    expected = [(3, "1.5"), (0, ""), (2, "молекула"), (1, "7")]
+    assert [(cell.order, cell.value) for cell in values] == expected, f"Unexpected cells: {list(values)}"
+    assert (values[-2].order, values[-2].value) == (2, "молекула"), f"Unexpected cell: {values[-2]}"
+    assert [cell.value for cell in values[1:3]] == ["", "молекула"], f"Unexpected slice: {values[1:3]}"
+    assert values.strings() == [value for _, value in expected], f"Unexpected strings: {values.strings()}"
+    assert values.orders_array().tolist() == [3, 0, 2, 1], f"Unexpected orders: {values.orders_array()}"
+    with pytest.raises(IndexError):
+        values[4]
+
+
+def test_compact_result_model():
+    payload = result_model_payload(columns=5, rows=20)
+    compact = Decoder(models="compact").build(ResultModel, payload)
+    assert isinstance(compact.dataset.columns[0].values, CompactValues), "Column values aren't compact"
+    assert compact.to_model() == ResultModel(**payload), "Compact struct holds other data than the model"
+    assert compact.dataset.columns[1].values == ResultModelStruct.from_json(payload).dataset.columns[1].values, \
+        "Compact values differ from struct values"
+
+
+def test_compact_memory():
+    measurements = {item.name: item for item in memory_benchmark(columns=20, rows=200, repeats=1)}
+    pydantic, compact = measurements["result_model[pydantic]"], measurements["result_model[compact]"]
+    assert compact.bytes_per_cell * 10 <= pydantic.bytes_per_cell, \
+        f"Compact columns take {compact.bytes_per_cell:.1f} B/cell, pydantic {pydantic.bytes_per_cell:.1f} B/cell"
@@ -0,0 +1,54 @@
+import json
+import numpy
+import pandas
+import pytest
+
+from pathlib import Path
+from desirability import evaluate, score
+from models import *
+
+APPROXIMATION_ALLOWED = 1e-6
+COLUMNS = ["Column_1", "Column_2", "Column_3"]
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.fixture(scope="module")
+def dataframe() -> pandas.DataFrame:
+    return pandas.read_csv(DATA_DIR / 'scoring_100_with_meta.csv', sep='\t')
+
+
+@pytest.mark.parametrize("function_type", [item.value for item in DesirabilityFunctionTypes])
+@pytest.mark.parametrize("column", COLUMNS)
+def test_reference_desirability(dataframe: pandas.DataFrame, column, function_type):
+    function = DesirabilityFunction(**json.loads(dataframe[f"{column}_{function_type}_parameter"].iloc[0]))
+    actual_rows = evaluate(function, dataframe[column].to_numpy())
+    expected_rows = dataframe[f"{column}_{function_type}"].to_numpy()
+    assert pytest.approx(expected_rows, abs=APPROXIMATION_ALLOWED) == actual_rows, \
+        f"Reference {function_type} desirability differs from the expected one"
+
+
+def test_reference_scored_column(dataframe: pandas.DataFrame):
+    functions = {column: json.loads(dataframe[f"{column}_logarithmic_parameter"].iloc[0]) for column in COLUMNS}
+    properties = [TemplateProperty(column_name=column, enabled_for_scoring=True, importance=1,
+                                   desirability_function=functions[column]) for column in COLUMNS]
+    columns = {column: dataframe[column].to_numpy() for column in COLUMNS}
+    expected_rows = dataframe["Scored_column"].to_numpy()
+    assert pytest.approx(expected_rows, abs=APPROXIMATION_ALLOWED) == score(properties, columns), \
+        "Reference scored column differs from the expected one"
+
+
+def test_missing_values_strategies():
+    function = DesirabilityFunction(type="linear", points=[{"x": 0, "y": 0}, {"x": 10, "y": 1}])
+    columns = {"x": numpy.array([5, numpy.nan, numpy.nan]), "y": numpy.array([0, 2, numpy.nan])}
+    strategies = {"no-calculate": [0.5, numpy.nan, numpy.nan],
+                  "default-x": [0.5, 0.8, 0.8],
+                  "default-y": [0.5, 8, 8]}
+    for strategy, expected_rows in strategies.items():
+        template_property = TemplateProperty(column_name="x", enabled_for_scoring=True, desirability_function=function,
+                                             missing_values=MissingValues(type=strategy, value=8))
+        assert score([template_property], columns) == pytest.approx(expected_rows, nan_ok=True), strategy
+    template_property = TemplateProperty(column_name="x", enabled_for_scoring=True, desirability_function=function,
+                                         missing_values=MissingValues(type="swap", swap_column="y",
+                                                                      swap_type="default-y", value=0.1))
+    assert score([template_property], columns) == pytest.approx([0.5, 0.2, 0.1])
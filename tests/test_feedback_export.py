@@ -0,0 +1,80 @@
+import json
+import threading
+import pytest
+import feedback_export
+
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from feedback_export import EXPORT, MANIFEST, date_windows, export_feedback, screenshot_path
+from stub_server import StubServer
+
+
+@pytest.fixture()
+def stub(stub_environment) -> StubServer:
+    with stub_environment() as server:
+        server.backend.generate_feedback(60, datetime(2022, 1, 1), datetime(2022, 3, 2), screenshots=2)
+        yield server
+
+
+def test_date_windows():
+    windows = date_windows(date(2022, 1, 1), date(2022, 1, 20), days=7)
+    assert windows == [(date(2022, 1, 1), date(2022, 1, 8)), (date(2022, 1, 8), date(2022, 1, 15)),
+                       (date(2022, 1, 15), date(2022, 1, 20))], f"Unexpected windows: {windows}"
+    assert date_windows(date(2022, 1, 1), date(2022, 1, 1), days=7) == [], "Empty range has windows"
+
+
+def test_export(stub: StubServer, tmp_path: Path):
+    report = export_feedback(date(2022, 1, 1), date(2022, 3, 5), tmp_path, window_days=7, workers=4,
+                             screenshots=True)
+    assert report.windows == 9 and report.fetched == report.changed == 9 and not report.failed, report.summary()
+    items = [json.loads(line) for line in (tmp_path / EXPORT).read_text().splitlines()]
+    expected = stub.backend.feedback
+    assert [item["id"] for item in items] == [item["id"] for item in expected], \
+        "Export doesn't hold every feedback once in date order"
+    urls = {url for item in expected for url in item["screenshots"]}
+    assert report.screenshots == len(urls) and all(screenshot_path(tmp_path, url).read_bytes().startswith(b"\x89PNG")
+                                                   for url in urls), f"Screenshots weren't saved: {report.summary()}"
+    assert stub.backend.calls["screenshot_get"] == len(urls), "Screenshots were downloaded more than once"
+
+
+def test_incremental_export(stub: StubServer, tmp_path: Path):
+    export_feedback(date(2022, 1, 1), date(2022, 3, 5), tmp_path, window_days=7)
+    manifest = json.loads((tmp_path / MANIFEST).read_text())
+    assert all(window["closed"] for window in manifest["windows"].values()), "Past windows aren't closed"
+
+    report = export_feedback(date(2022, 1, 1), date(2022, 3, 5), tmp_path, window_days=7)
+    assert report.skipped == 9 and not report.fetched and report.items == 60, \
+        f"Closed windows were fetched again: {report.summary()}"
+
+    stub.backend.add_feedback(datetime(2022, 1, 10, 12))
+    report = export_feedback(date(2022, 1, 1), date(2022, 3, 5), tmp_path, window_days=7, refresh=True)
+    assert report.fetched == 9 and report.changed == 1 and report.items == 61, \
+        f"Changed window wasn't detected: {report.summary()}"
+
+    # the window ending after today can still get feedback, the one before it can't
+    after, before = date.today() - timedelta(days=10), date.today() + timedelta(days=1)
+    export_feedback(after, before, tmp_path, window_days=7)
+    report = export_feedback(after, before, tmp_path, window_days=7)
+    assert report.skipped == 1 and report.fetched == 1, f"Open window was kept: {report.summary()}"
+
+
+def test_bounded_screenshots(stub: StubServer, tmp_path: Path, monkeypatch):
+    pending, peak = set(), []
+    lock = threading.Lock()
+
+    class CountingExecutor(feedback_export.ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            future = super().submit(fn, *args, **kwargs)
+            if self._thread_name_prefix == "feedback-screenshot":
+                with lock:
+                    pending.add(future)
+                    peak.append(len(pending))
+                future.add_done_callback(lambda done: pending.discard(done))
+            return future
+
+    monkeypatch.setattr(feedback_export, "ThreadPoolExecutor", CountingExecutor)
+    report = export_feedback(date(2022, 1, 1), date(2022, 3, 5), tmp_path, window_days=7, workers=4,
+                             screenshots=True, screenshot_workers=1)
+    urls = {url for item in stub.backend.feedback for url in item["screenshots"]}
+    assert report.screenshots == len(urls) and not report.failed, report.summary()
+    assert max(peak) <= 2, f"{max(peak)} screenshots were pending with a single screenshot worker"
@@ -0,0 +1,105 @@
+import threading
+import time
+import uuid
+import pytest
+import scoring_api
+
+from pathlib import Path
+from cache import ResponseCache, set_response_cache
+from stub_server import StubServer, FaultInjection
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def cache(stub: StubServer) -> ResponseCache:
+    cache = ResponseCache(ttl=30, max_entries=8, clock=FakeClock())
+    previous = set_response_cache(cache)
+    stub.backend.calls.clear()
+    yield cache
+    set_response_cache(previous)
+
+
+def test_cache_disabled_by_default(stub: StubServer):
+    stub.backend.calls.clear()
+    scoring_api.authorization_me_get()
+    scoring_api.authorization_me_get()
+    assert stub.backend.calls["authorization_me"] == 2, "Response was cached without opting in"
+
+
+def test_cache_hits(stub: StubServer, cache: ResponseCache):
+    for _ in range(3):
+        scoring_api.authorization_me_get()
+    scoring_api.authorization_me_get(token="Bearer another")
+    assert stub.backend.calls["authorization_me"] == 2, "Cached response was refetched"
+    assert cache.stats.hits == 2 and cache.stats.misses == 2, f"Unexpected stats: {cache.stats}"
+
+
+def test_cache_invalidated_by_mutations(stub: StubServer, cache: ResponseCache):
+    dataset = scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv').result
+    assert dataset.dataset_id in [item.dataset_id for item in scoring_api.get_datasets_list()], \
+        "Uploaded dataset isn't in the cached list"
+    first_page = scoring_api.get_dataset_result_model(dataset.dataset_id, page=1, per_page=5)
+    assert scoring_api.get_dataset_result_model(dataset.dataset_id, page=1, per_page=5) == first_page, \
+        "Cached page differs"
+    scoring_api.get_dataset_result_model(dataset.dataset_id, page=2, per_page=5)
+    assert stub.backend.calls["result_model"] == 2, "Identical page was refetched"
+
+    scoring_api.delete_dataset(dataset.dataset_id, expected_code=204)
+    assert dataset.dataset_id not in [item.dataset_id for item in scoring_api.get_datasets_list()], \
+        "Deleted dataset is in the cached list"
+    scoring_api.get_dataset_result_model_json(dataset.dataset_id, page=1, per_page=5, expected_code=404)
+    scoring_api.restore_dataset(dataset.dataset_id, expected_code=200)
+    assert dataset.dataset_id in [item.dataset_id for item in scoring_api.get_datasets_list()], \
+        "Restored dataset isn't in the cached list"
+    assert stub.backend.calls["datasets_list"] == 3, "Datasets list wasn't refetched after mutations"
+    assert cache.stats.invalidations >= 3, f"Unexpected stats: {cache.stats}"
+
+
+def test_cache_revalidation(stub: StubServer, cache: ResponseCache):
+    scoring_api.authorization_me_get()
+    cache.clock.now += 60
+    user = scoring_api.authorization_me_get()
+    assert user.name == stub.backend.user_name, f"Unexpected revalidated response: {user}"
+    assert cache.stats.revalidated == 1 and cache.stats.hits == 0, f"Unexpected stats: {cache.stats}"
+    scoring_api.authorization_me_get()
+    assert cache.stats.hits == 1, "Revalidated entry wasn't refreshed"
+
+
+def test_cache_lru_eviction(stub: StubServer, cache: ResponseCache):
+    for index in range(10):
+        scoring_api.get_datasets_list(limit=index + 1)
+    scoring_api.get_datasets_list(limit=10)
+    scoring_api.get_datasets_list(limit=1)
+    assert len(cache) == 8 and cache.stats.evictions == 3, f"Unexpected stats: {cache.stats}"
+    assert cache.stats.hits == 1, f"Recent entry was evicted: {cache.stats}"
+
+
+def test_cache_skips_responses_older_than_invalidation(stub: StubServer, cache: ResponseCache):
+    stub.backend.faults = FaultInjection(latency=0.3, routes=["datasets_list"])
+    try:
+        listing = threading.Thread(target=scoring_api.get_datasets_list)
+        listing.start()
+        time.sleep(0.1)
+        # a write lands while the listing is in flight, its response may not show the change
+        cache.invalidate("/api/datasets")
+        listing.join()
+    finally:
+        stub.backend.faults = FaultInjection()
+    scoring_api.get_datasets_list()
+    assert stub.backend.calls["datasets_list"] == 2 and cache.stats.stores == 1, \
+        f"Response requested before the invalidation was cached: {cache.stats}"
+
+    generation = cache.generation()
+    cache.invalidate("/api/datasets", subtree=True)
+    key = cache.key(f"{stub.url}/api/datasets/any/result_model", None, None)
+    cache.store(key, scoring_api.send_request("/api/datasets", "get"), generation)
+    assert cache.lookup(key) == (None, None), "Response was cached after an invalidation of its parent"
@@ -0,0 +1,153 @@
+import asyncio
+import time
+import pytest
+import scoring_api
+
+from async_scoring_api import AsyncScoringApi
+from scheduler import RequestScheduler, SchedulerConfig, TokenBucket, CircuitOpenError, \
+    get_scheduler, set_scheduler
+from stub_server import StubServer, FaultInjection
+from tasks import Backoff
+from transport import endpoint_template
+
+FAST_BACKOFF = Backoff(initial=0.01, max_delay=0.05)
+DATASETS = "GET /api/datasets"
+
+
+@pytest.fixture()
+def use_scheduler(stub: StubServer):
+    previous = get_scheduler()
+
+    def use(**kwargs) -> RequestScheduler:
+        scheduler = RequestScheduler(SchedulerConfig(backoff=FAST_BACKOFF, **kwargs))
+        set_scheduler(scheduler)
+        return scheduler
+
+    stub.backend.calls.clear()
+    yield use
+    stub.backend.faults = FaultInjection()
+    set_scheduler(previous)
+
+
+def stats_of(scheduler: RequestScheduler, endpoint: str):
+    return next(item for item in scheduler.stats() if item.endpoint == endpoint)
+
+
+def test_endpoint_template():
+    assert endpoint_template("get", "https://host/api/datasets/63f1a2b3c4d5e6f708192a3b/result_model?page=2") == \
+           "GET /api/datasets/{id}/result_model"
+    assert endpoint_template("post", "http://host/api/task/2b1f8e9e-3c4d-4e5f-9a6b-7c8d9e0f1a2b/status") == \
+           "POST /api/task/{id}/status"
+    assert endpoint_template("get", "/api/feedback/user-feedback") == "GET /api/feedback/user-feedback"
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0])
+    assert [bucket.reserve() for _ in range(4)] == pytest.approx([0, 0, 0.1, 0.2]), "Unexpected waits"
+    now[0] = 1.0
+    assert bucket.reserve() == 0, "Bucket wasn't refilled"
+
+
+def test_retry_idempotent(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler(max_retries=10)
+    stub.backend.faults = FaultInjection(error_rate=0.5, routes=["datasets_list"], seed=3)
+    for _ in range(10):
+        scoring_api.get_datasets_list()
+    stats = stats_of(scheduler, DATASETS)
+    assert stats.calls == 10 and stats.retries > 0 and stats.attempts == stats.calls + stats.retries, \
+        f"Unexpected stats: {stats}"
+
+
+def test_default_passes_failures_through(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler()
+    stub.backend.faults = FaultInjection(error_rate=1, routes=["datasets_list"])
+    for _ in range(8):
+        with pytest.raises(AssertionError):
+            scoring_api.get_datasets_list()
+    stats = stats_of(scheduler, DATASETS)
+    assert stub.backend.calls["datasets_list"] == 8 and stats.retries == 0 and stats.breaker_rejections == 0, \
+        f"Default scheduler retried or rejected calls: {stats}"
+
+
+def test_no_retry_non_idempotent(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler()
+    stub.backend.faults = FaultInjection(error_rate=1, routes=["authorization_name"])
+    with pytest.raises(AssertionError):
+        scoring_api.authorization_name_patch("new-name", expected_code=200)
+    assert stub.backend.calls["authorization_name"] == 1, "PATCH was retried on 503"
+    assert stats_of(scheduler, "PATCH /api/authorization/name").failures == 1, "Failure wasn't counted"
+
+
+def test_retry_after(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler(max_retries=2)
+    stub.backend.faults = FaultInjection(error_rate=1, error_status=429, retry_after=0.2,
+                                         routes=["authorization_name"])
+    started = time.monotonic()
+    with pytest.raises(AssertionError):
+        scoring_api.authorization_name_patch("new-name", expected_code=200)
+    assert time.monotonic() - started >= 0.4, "Retry-After wasn't honoured"
+    stats = stats_of(scheduler, "PATCH /api/authorization/name")
+    assert stats.throttled == 3 and stats.retries == 2 and stats.breaker_trips == 0, f"Unexpected stats: {stats}"
+
+
+def test_circuit_breaker(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler(max_retries=0, failure_threshold=3, reset_timeout=0.3)
+    stub.backend.faults = FaultInjection(error_rate=1, routes=["datasets_list"])
+    for _ in range(3):
+        with pytest.raises(AssertionError):
+            scoring_api.get_datasets_list()
+    with pytest.raises(CircuitOpenError):
+        scoring_api.get_datasets_list()
+    assert stub.backend.calls["datasets_list"] == 3, "Open circuit let a call through"
+    scoring_api.authorization_me_get()
+
+    stub.backend.faults = FaultInjection()
+    time.sleep(0.3)
+    scoring_api.get_datasets_list()
+    stats = stats_of(scheduler, DATASETS)
+    assert scheduler.breaker_state(DATASETS) == "closed", "Successful trial didn't close the circuit"
+    assert stats.breaker_trips == 1 and stats.breaker_rejections == 1, f"Unexpected stats: {stats}"
+
+
+def test_rate_limit(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler(rate=50, burst=1)
+    started = time.monotonic()
+    for _ in range(26):
+        scoring_api.authorization_me_get()
+    assert time.monotonic() - started >= 0.48, "Calls weren't rate limited"
+    assert stats_of(scheduler, "GET /api/authorization/me").rate_limited >= 24, "Waits weren't counted"
+
+
+def test_async_retry(stub: StubServer, use_scheduler):
+    scheduler = use_scheduler(max_retries=10)
+    stub.backend.faults = FaultInjection(error_rate=0.5, routes=["datasets_list"], seed=5)
+
+    async def run():
+        async with AsyncScoringApi(max_concurrency=8) as api:
+            return await asyncio.gather(*[api.get_datasets_list() for _ in range(20)])
+
+    assert len(asyncio.run(run())) == 20, "Not all calls succeeded"
+    assert stats_of(scheduler, DATASETS).retries > 0, "Failed calls weren't retried"
+
+
+def test_breakers_per_host():
+    scheduler = RequestScheduler(SchedulerConfig(max_retries=0, failure_threshold=2))
+
+    class Response:
+        def __init__(self, status_code):
+            self.status_code, self.headers = status_code, {}
+
+    def send(method, url):
+        return Response(500 if url.startswith("http://down") else 200)
+
+    for _ in range(2):
+        scheduler.send(send, "get", {"url": "http://down/api/datasets"})
+    with pytest.raises(CircuitOpenError):
+        scheduler.send(send, "get", {"url": "http://down/api/datasets"})
+    assert scheduler.send(send, "get", {"url": "http://up/api/datasets"}).status_code == 200, \
+        "Circuit of another host rejected the call"
+    assert scheduler.breaker_state(DATASETS, "http://up") == "closed" and scheduler.breaker_state(DATASETS) == "open", \
+        "Unexpected breaker states"
+    assert {(item.host, item.calls) for item in scheduler.stats()} == {("http://down", 3), ("http://up", 1)}, \
+        f"Stats weren't kept per host: {scheduler.stats()}"
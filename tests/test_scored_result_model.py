@@ -9,9 +9,15 @@ import scoring_api
 from pandas import DataFrame
 from pathlib import Path
 from models import *
+from columnar import ColumnarResult, get_dataset_result_columns
+from pagination import iter_column_slices, count_pages
+from sort_verification import SortExpectation, expectations_from_dataframe, verify_sorting, SCORED_COLUMN
+from template_builder import build_scoring_template
 
 APPROXIMATION_ALLOWED = 1e-3
 
+DATA = Path(__file__).resolve().parent / 'data' / 'scoring_100_with_meta.csv'
+
 
 class LocalTestContext(Model):
     dataset_id: str = None
@@ -22,72 +28,49 @@ class LocalTestContext(Model):
     scored_dataset_id: str = None
 
 
-@pytest.fixture(scope="module", autouse=True)
-def share_and_clean_up_data() -> LocalTestContext:
-    yield LocalTestContext()
-    data = scoring_api.get_datasets_list()
-    for item in data:
-        if "Auto" in item.name:
-            scoring_api.delete_dataset(item.dataset_id, expected_code=204)
-
-
-@pytest.fixture(scope="module", autouse=True)
-def prepare_dataset(share_and_clean_up_data: LocalTestContext):
-    path = Path('data/scoring_100_with_meta.csv')
-    filename = str(uuid.uuid4())
-    response = scoring_api.upload_dataset(f"Auto-{filename}.csv", path)
-    dataset = share_and_clean_up_data.dataset_id = response.result.dataset_id
-
-    df = pandas.read_csv(path, sep='\t')  # read dataset
-    desirability_function = json.loads(df[f"Column_2_logarithmic_parameter"].iloc[0])
-    share_and_clean_up_data.function = DesirabilityFunction(**desirability_function)
-    share_and_clean_up_data.dataframe = df
-    share_and_clean_up_data.rows = df.shape[0]  # number of rows
-    yield dataset
-    scoring_api.delete_dataset(dataset, expected_code=204)
-
-
-@pytest.fixture(scope="module", autouse=True)
-def prepare_scored_dataset(share_and_clean_up_data: LocalTestContext):
+def create_scored_dataset(prefix: str, function: DesirabilityFunction) -> Dict[str, str]:
+    """
+    Dataset scored by the logarithmic function of Column_2, created once per run for all workers
+    """
+    dataset_id = scoring_api.upload_dataset(f"{prefix}-{uuid.uuid4()}.csv", DATA).result.dataset_id
     name = f"Auto_{''.join(random.choices(string.ascii_letters + string.digits, k=20))}"
-    request = PostScoringTemplate(name=name, dataset_id=share_and_clean_up_data.dataset_id)
-    template_data = scoring_api.scoring_template_post(request_body=request, expected_code=201)
-    share_and_clean_up_data.template_id = template_data.created_id
-    column = "Column_2"
-    column_data = share_and_clean_up_data.dataframe.loc[:, f"{column}"]  # extract current column from dataframe
-    property_body = RequestTemplateProperty(column_name=column,
+    request = PostScoringTemplate(name=name, dataset_id=dataset_id)
+    property_body = RequestTemplateProperty(column_name="Column_2",
                                             enabled_for_scoring=True,
                                             importance=1,
-                                            desirability_function=share_and_clean_up_data.function
+                                            desirability_function=function
                                             )
-    property_data = scoring_api.scoring_template_properties_post(property_body, template_data.created_id,
-                                                                 expected_code=201)
-    share_and_clean_up_data.scored_dataset_id = scoring_api.scored_dataset_post(
-        share_and_clean_up_data.dataset_id, template_data.created_id, expected_code=201).created_id
-    yield
-    scoring_api.scored_dataset_delete(share_and_clean_up_data.scored_dataset_id, expected_code=204)
-    scoring_api.scoring_template_properties_delete(template_data.created_id, property_data.created_id,
-                                                   expected_code=204)
-    scoring_api.scoring_template_delete(template_data.created_id, expected_code=204)
+    template = build_scoring_template(request, [property_body])
+    assert template.ok, f"Scoring template wasn't created: {template.error or template.failed}"
+    scored_dataset_id = scoring_api.scored_dataset_post(dataset_id, template.template_id, expected_code=201).created_id
+    return {"dataset_id": dataset_id, "template_id": template.template_id, "scored_dataset_id": scored_dataset_id}
+
+
+@pytest.fixture(scope="module")
+def scored_data(shared) -> LocalTestContext:
+    # deleted with its template and scored dataset by the last worker, see conftest.SharedResources
+    df = pandas.read_csv(DATA, sep='\t')  # read dataset
+    function = DesirabilityFunction(**json.loads(df["Column_2_logarithmic_parameter"].iloc[0]))
+    ids = shared.get("scored_100_with_meta", lambda: create_scored_dataset(shared.prefix, function))
+    return LocalTestContext(dataframe=df, rows=df.shape[0], function=function, **ids)
+
+
+@pytest.fixture(scope="module")
+def expectations(scored_data: LocalTestContext) -> Dict[str, SortExpectation]:
+    # sorted orders of every column and the expected scores, computed once for all tests
+    return expectations_from_dataframe(scored_data.dataframe, scored="Column_2_logarithmic")
 
 
 @pytest.mark.parametrize("per_page, order", [(25, "asc"), (25, "desc"), (50, "asc"), (50, "desc"),
                                              (100, "asc"), (100, "desc")])
-def test_sort_result_model(share_and_clean_up_data: LocalTestContext, per_page, order):
-    if share_and_clean_up_data.rows % per_page == 0:
-        pages_num = share_and_clean_up_data.rows // per_page
-    else:
-        pages_num = share_and_clean_up_data.rows // per_page + 1
-    page = random.randint(1, pages_num)
+def test_sort_result_model(scored_data: LocalTestContext, expectations: Dict[str, SortExpectation], per_page,
+                           order):
+    page = random.randint(1, count_pages(scored_data.rows, per_page))
     column = "Column_2"
 
-    response = scoring_api.get_dataset_result_model(dataset_id=share_and_clean_up_data.dataset_id, page=page,
+    response = scoring_api.get_dataset_result_model(dataset_id=scored_data.dataset_id, page=page,
                                                     per_page=per_page, sort=column, order=order)
-    if order == "asc":
-        rows = share_and_clean_up_data.dataframe.sort_values(column).iloc[(page*per_page - per_page):(page*per_page)]
-    else:
-        rows = share_and_clean_up_data.dataframe.sort_values(column, ascending=False).iloc[(page*per_page - per_page):
-                                                                                   (page*per_page)]
+    rows = scored_data.dataframe.iloc[expectations[column].page(order, page, per_page)]
     actual_rows = [float(row.value) for item in response.dataset.columns
                    if item.name == column for row in item.values]
     expected_rows = rows.loc[:, f"{column}"].to_list()  # extract current column from dataframe
@@ -97,23 +80,15 @@ def test_sort_result_model(share_and_clean_up_data: LocalTestContext, per_page,
 
 @pytest.mark.parametrize("per_page, order", [(25, "asc"), (25, "desc"), (50, "asc"), (50, "desc"),
                                              (100, "asc"), (100, "desc")])
-def test_sort_by_scored_column(share_and_clean_up_data: LocalTestContext, per_page, order):
-    if share_and_clean_up_data.rows % per_page == 0:
-        pages_num = share_and_clean_up_data.rows // per_page
-    else:
-        pages_num = share_and_clean_up_data.rows // per_page + 1
-    page = random.randint(1, pages_num)
+def test_sort_by_scored_column(scored_data: LocalTestContext, expectations: Dict[str, SortExpectation], per_page,
+                               order):
+    page = random.randint(1, count_pages(scored_data.rows, per_page))
     column = "Column_2_logarithmic"
     compare_column = "Column_2_unit_step"
 
-    response = scoring_api.get_dataset_result_model(dataset_id=share_and_clean_up_data.dataset_id, page=page,
+    response = scoring_api.get_dataset_result_model(dataset_id=scored_data.dataset_id, page=page,
                                                     per_page=per_page, sort='Scored_column', order=order)
-    if order == "asc":
-        rows = share_and_clean_up_data.dataframe.sort_values(column).iloc[
-               (page*per_page - per_page):(page*per_page)]
-    else:
-        rows = share_and_clean_up_data.dataframe.sort_values(column, ascending=False).iloc[
-               (page*per_page - per_page):(page*per_page)]
+    rows = scored_data.dataframe.iloc[expectations[SCORED_COLUMN].page(order, page, per_page)]
     actual_column = response.scored.scored_column
     actual_rows = [round(float(item), 10) if item != 'nonquantifiable' else item
                    for item in actual_column]
@@ -125,3 +100,48 @@ def test_sort_by_scored_column(share_and_clean_up_data: LocalTestContext, per_pa
         "Different actual and expected rows order or number"
     assert expected_compare_rows == pytest.approx(actual_compare_rows), \
         "Sorting is only for scored column, not for the whole dataset"
+
+
+@pytest.mark.parametrize("per_page", [25, 30])
+def test_sort_every_page(scored_data: LocalTestContext, expectations: Dict[str, SortExpectation], per_page):
+    report = verify_sorting(scored_data.dataset_id, expectations, per_page=per_page, workers=8)
+    assert report.ok, f"{report.summary()}: {[item.dict(exclude={'rows'}) for item in report.failed[:5]]} " \
+                      f"{report.errors[:5]}"
+    assert len(report.checks) == len(expectations) * 2 * count_pages(scored_data.rows, per_page), \
+        f"Not every page was checked: {report.summary()}"
+
+
+@pytest.mark.parametrize("per_page, order", [(25, "asc"), (30, "desc")])
+def test_walk_all_pages(scored_data: LocalTestContext, per_page, order):
+    column = "Column_2"
+    actual_rows = [float(value) for values in iter_column_slices(scored_data.dataset_id, column,
+                                                                 sort=column, order=order, per_page=per_page,
+                                                                 prefetch=3)
+                   for value in values]
+    expected_rows = scored_data.dataframe.sort_values(column, ascending=order == "asc")
+    expected_rows = expected_rows.loc[:, column].to_list()
+    assert pytest.approx(actual_rows, APPROXIMATION_ALLOWED) == expected_rows, \
+        "Different actual and expected rows order or number"
+
+
+def test_columnar_decoding(scored_data: LocalTestContext):
+    column = "Column_2"
+    columns = get_dataset_result_columns(scored_data.dataset_id, page=1, per_page=50,
+                                         sort='Scored_column', order="asc")
+    model = columns.model
+    expected_rows = [float(row.value) for item in model.dataset.columns if item.name == column for row in item.values]
+    expected_scores = [item for item in model.scored.scored_column if item != 'nonquantifiable']
+    assert pytest.approx(expected_rows) == columns.columns[column].tolist(), "Columnar values differ from the model"
+    assert pytest.approx(expected_scores) == columns.scored[~columns.scored_mask].tolist(), \
+        "Columnar scored column differs from the model"
+
+
+def test_columnar_mixed_cells():
+    cells = ["1.5", "", "2", "n/a", "3"]
+    payload = {"dataset": {"columns": [
+        {"name": name, "numeric": False, "values": [{"order": row, "value": value} for row, value in enumerate(values)]}
+        for name, values in [("mixed", cells), ("numbers", ["1", "", "2.5"])]]}}
+    columns = ColumnarResult(payload, validation="skip")
+    assert columns.columns["mixed"].tolist() == cells, f"Text cells were lost: {columns.columns['mixed']}"
+    assert columns.columns["numbers"].dtype.kind == "f" and columns.masks["numbers"].tolist() == [False, True, False], \
+        f"Numeric column wasn't parsed: {columns.columns['numbers']}"
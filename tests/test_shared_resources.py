@@ -0,0 +1,61 @@
+import json
+import multiprocessing
+import time
+import uuid
+import scoring_api
+
+from pathlib import Path
+from conftest import SharedResources
+from stub_server import StubServer
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+WORKERS = 6
+
+
+def run_worker(directory: Path, start, created: Path, results):
+    resources = SharedResources(directory, "Auto-shared", workers=WORKERS, timeout=30)
+
+    def factory():
+        with open(created, "a") as file:
+            file.write("created\n")
+        time.sleep(0.2)  # other workers ask for the key while it is being created
+        return {"dataset_id": f"dataset-{multiprocessing.current_process().pid}"}
+
+    start.wait()
+    value = resources.get("dataset", factory)
+    start.wait()
+    results.put((value, resources.finish_worker()))
+
+
+def test_shared_across_processes(tmp_path: Path):
+    # fork keeps the imported conftest, a spawned worker would start a run of its own
+    context = multiprocessing.get_context("fork")
+    start, queue = context.Barrier(WORKERS), context.Queue()
+    created = tmp_path / "created"
+    workers = [context.Process(target=run_worker, args=(tmp_path / "run", start, created, queue))
+               for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    results = [queue.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join()
+    values = [value for value, _ in results]
+    assert created.read_text().splitlines() == ["created"], "Shared value was created more than once"
+    assert all(value == values[0] for value in values), f"Workers got different values: {values}"
+    assert json.loads((tmp_path / "run" / "dataset.json").read_text()) == values[0], "Stored value differs"
+    assert [last for _, last in results].count(True) == 1, f"Not exactly one last worker: {results}"
+    assert not list((tmp_path / "run").glob("*.lock")), "Lock files were left behind"
+
+
+def test_crashed_worker_cleanup(stub: StubServer, tmp_path: Path):
+    resources = SharedResources(tmp_path / "run", "Auto-crash", workers=2)
+    dataset_id = resources.get("dataset", lambda: scoring_api.upload_dataset(
+        f"Auto-crash-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv').result.dataset_id)
+    assert dataset_id in [dataset.dataset_id for dataset in scoring_api.get_datasets_list()], "Dataset wasn't uploaded"
+    assert not resources.finish_worker(), "One of two workers was counted as the last one"
+    # the other worker crashed, the xdist controller deletes what is left
+    resources.delete()
+    assert dataset_id not in [dataset.dataset_id for dataset in scoring_api.get_datasets_list()], \
+        "Shared dataset wasn't deleted"
+    assert not (tmp_path / "run").exists(), "Run directory wasn't removed"
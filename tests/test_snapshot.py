@@ -0,0 +1,84 @@
+import uuid
+import numpy
+import pandas
+import pytest
+import scoring_api
+
+from pathlib import Path
+from models import *
+from snapshot import SnapshotCache, UNSCORED
+from stub_server import StubServer
+from template_builder import build_scoring_template, properties_from_dataframe
+
+DATA = Path(__file__).resolve().parent / 'data' / 'scoring_100_with_meta.csv'
+
+
+@pytest.fixture()
+def dataset_id(stub: StubServer) -> str:
+    return scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA).result.dataset_id
+
+
+@pytest.fixture()
+def snapshots(tmp_path: Path) -> SnapshotCache:
+    return SnapshotCache(tmp_path, per_page=30, prefetch=2)
+
+
+def test_snapshot_matches_dataset(stub: StubServer, dataset_id: str, snapshots: SnapshotCache):
+    dataframe = pandas.read_csv(DATA, sep='\t')
+    snapshot = snapshots.get(dataset_id)
+    assert len(snapshot) == len(dataframe) and snapshot.column_names == list(dataframe.columns), \
+        f"Unexpected snapshot: {snapshot}, columns {snapshot.column_names}"
+    assert snapshot.meta.pages == 4 and snapshot.scored is None, f"Unexpected snapshot meta: {snapshot.meta}"
+    assert snapshot.column("Column_2").tolist() == pytest.approx(dataframe["Column_2"].tolist()), \
+        "Numeric column differs from the file"
+    assert snapshot.column("Column_2_linear_parameter")[5] == dataframe["Column_2_linear_parameter"][5], \
+        "String column differs from the file"
+
+    stub.backend.calls.clear()
+    again = snapshots.get(dataset_id)
+    assert stub.backend.calls["result_model"] == 1 and snapshots.stats.hits == 1, \
+        f"Current snapshot was downloaded again: {dict(stub.backend.calls)}"
+    assert numpy.array_equal(again.column("Column_2"), snapshot.column("Column_2")), "Stored snapshot differs"
+    assert SnapshotCache(snapshots.directory).get(dataset_id).meta == snapshot.meta, \
+        "Snapshot isn't reused by another cache instance"
+
+
+def test_snapshot_follows_template_hash(stub: StubServer, dataset_id: str, snapshots: SnapshotCache):
+    unscored = snapshots.get(dataset_id)
+    properties = properties_from_dataframe(pandas.read_csv(DATA, sep='\t'), columns=["Column_2"],
+                                           function_types=["logarithmic"])
+    template = build_scoring_template(PostScoringTemplate(name="Auto_snapshot", dataset_id=dataset_id), properties)
+    scoring_api.scored_dataset_post(dataset_id, template.template_id, expected_code=201)
+
+    scored = snapshots.get(dataset_id)
+    assert scored.md5_hash and snapshots.stats.stale == 1, f"Rescored dataset wasn't downloaded: {snapshots.stats}"
+    assert not unscored.directory.exists() and scored.directory.name == scored.md5_hash != UNSCORED, \
+        "Outdated snapshot wasn't replaced"
+    expected = scoring_api.get_dataset_result_model_json(dataset_id, page=1, per_page=len(scored))
+    expected_scores = [value if value != "nonquantifiable" else numpy.nan
+                       for value in expected["scored"]["scored_column"]]
+    assert scored.scored.tolist() == pytest.approx(expected_scores, nan_ok=True), \
+        "Scored column differs from the backend"
+    assert scored.scored_mask.tolist() == numpy.isnan(numpy.array(expected_scores, dtype=float)).tolist(), \
+        "Unexpected scored mask"
+    assert snapshots.get(dataset_id).meta == scored.meta and snapshots.stats.downloads == 2, \
+        f"Unexpected stats: {snapshots.stats}"
+
+
+@pytest.mark.parametrize("per_page", [10, 30, 50])
+def test_snapshot_column_types(stub: StubServer, tmp_path: Path, per_page: int):
+    # text only on the last rows of "partial", "sparse" has numbers and empty cells
+    path = tmp_path / "types.csv"
+    pandas.DataFrame({"name": [f"m{index}" for index in range(40)],
+                      "partial": [f"{index}" for index in range(35)] + ["n/a"] * 5,
+                      "sparse": [float(index) for index in range(30)] + [None] * 10}).to_csv(path, sep='\t',
+                                                                                             index=False)
+    dataset_id = scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", path).result.dataset_id
+    snapshot = SnapshotCache(tmp_path / "snapshots", per_page=per_page).get(dataset_id)
+    partial, sparse = snapshot.column("partial"), snapshot.column("sparse")
+    assert partial.dtype.kind == "U" and partial[-1] == "n/a" and partial[3] == "3", \
+        f"Text cells were lost: {partial}"
+    assert sparse.dtype == numpy.float64 and sparse[:30].tolist() == list(range(30)) and \
+        numpy.isnan(sparse[30:]).all() and snapshot.mask("sparse")[30:].all(), f"Unexpected numeric column: {sparse}"
+    assert [column.numeric for column in snapshot.meta.columns] == [False, False, True], \
+        f"Unexpected column types: {snapshot.meta.columns}"
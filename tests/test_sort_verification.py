@@ -0,0 +1,49 @@
+import numpy
+import pytest
+
+from sort_verification import SortExpectation, check_page, SCORED_COLUMN
+
+
+def page_payload(rows, values, scores=None):
+    columns = [{"name": "Value", "values": [{"order": row, "value": value} for row, value in zip(rows, values)]},
+               {"name": "Other", "values": [{"order": row, "value": ""} for row in rows]}]
+    return {"dataset": {"columns": columns}, "scored": {"scored_column": scores} if scores is not None else None}
+
+
+def test_stable_permutations():
+    expectation = SortExpectation(["2", "1", "", "2", "0.5"])
+    assert expectation.numeric, "Numeric keys weren't detected"
+    assert expectation.permutation("asc").tolist() == [4, 1, 0, 3, 2], "Unexpected ascending order"
+    assert expectation.permutation("desc").tolist() == [0, 3, 1, 4, 2], "Ties or missing keys moved in desc"
+    assert SortExpectation(["b", "", "a"]).permutation("asc").tolist() == [1, 2, 0], \
+        "Empty strings aren't the smallest string keys"
+    assert SortExpectation(["1", None], nan_position="first").page("asc", 1, 1).tolist() == [1], \
+        "Missing key isn't first"
+
+
+def test_ties():
+    expectation = SortExpectation([1.0, 2.0, 1.0, 3.0])
+    swapped = page_payload([2, 0, 1], ["1", "1", "2"])
+    assert check_page(swapped, "Value", expectation, "asc", 1, 3) is None, "Tied rows in another order failed"
+    assert "Tied row 2" in check_page(swapped, "Value", expectation, "asc", 1, 3, ties="stable"), \
+        "Tied rows in another order passed the stable check"
+    assert check_page(page_payload([3], ["3"]), "Value", expectation, "asc", 2, 3) is None, "Last page failed"
+
+
+@pytest.mark.parametrize("payload, error", [
+    (page_payload([0, 1, 2], ["1", "2", "1"]), "Position 1 holds '2' of row 1"),
+    (page_payload([0, 2, 1], ["1", "1", "5"]), "Row 1 at position 2 holds '5'"),
+    (page_payload([0, 2], ["1", "1"]), "2 rows instead of 3"),
+    (page_payload([0, 2, 7], ["1", "1", "2"]), "Unknown rows [7]"),
+], ids=["Wrong order", "Wrong value", "Short page", "Unknown row"])
+def test_mismatches(payload, error):
+    message = check_page(payload, "Value", SortExpectation([1.0, 2.0, 1.0, 3.0]), "asc", 1, 3)
+    assert message is not None and message.startswith(error), f"Unexpected mismatch: {message}"
+
+
+def test_scored_column():
+    expectation = SortExpectation([0.5, numpy.nan, 0.25])
+    payload = page_payload([0, 2, 1], ["", "", ""], scores=[0.5, 0.25, "nonquantifiable"])
+    assert check_page(payload, SCORED_COLUMN, expectation, "desc", 1, 3) is None, "Scored sort failed"
+    assert check_page(payload, SCORED_COLUMN, expectation, "asc", 1, 3).startswith("Position 0"), \
+        "Reversed scored sort passed"
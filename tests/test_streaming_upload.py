@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import threading
+import pytest
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+UPLOAD_SIZE_MB = int(os.environ.get("STREAMING_UPLOAD_SIZE_MB", 1024))
+RSS_LIMIT_MB = 200
+ROOT = Path(__file__).resolve().parent.parent
+
+UPLOAD_SCRIPT = """
+import resource, sys
+import scoring_api
+from models import UploadParams
+
+params = UploadParams(data={"url": sys.argv[1], "fields": {"key": "datasets/large.csv"}})
+scoring_api.upload_file_to_bucket(params, "large.csv", sys.argv[2], use_mmap=sys.argv[3] == "mmap")
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024)
+"""
+
+
+class LocalBucketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        remaining = int(self.headers["Content-Length"])
+        tail = b""
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            remaining -= len(chunk)
+            self.server.received += len(chunk)
+            tail = (tail + chunk)[-64:]
+        boundary = self.headers["Content-Type"].split("boundary=")[1]
+        self.send_response(204 if tail.endswith(f"--{boundary}--\r\n".encode()) else 400)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def local_bucket():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalBucketHandler)
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope="module")
+def large_csv(tmp_path_factory) -> Path:
+    path = tmp_path_factory.mktemp("upload") / "large.csv"
+    block = "".join(f"{row}\tCCO\t{row * 0.5}\t{row % 7}\n" for row in range(100000)).encode()
+    with open(path, "wb") as file:
+        file.write(b"CID\tSMILES\tColumn_1\tColumn_2\n")
+        while file.tell() < UPLOAD_SIZE_MB * 1024 * 1024:
+            file.write(block)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["read", "mmap"])
+def test_streaming_upload_memory(local_bucket: ThreadingHTTPServer, large_csv: Path, mode):
+    received_before = local_bucket.received
+    url = f"http://127.0.0.1:{local_bucket.server_port}/bucket"
+    output = subprocess.run([sys.executable, "-c", UPLOAD_SCRIPT, url, str(large_csv), mode], cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    peak_rss_mb = int(output.split()[-1])
+    assert local_bucket.received - received_before > large_csv.stat().st_size, "File wasn't uploaded completely"
+    assert peak_rss_mb < RSS_LIMIT_MB, f"Peak RSS {peak_rss_mb} MB exceeds {RSS_LIMIT_MB} MB"
@@ -0,0 +1,103 @@
+import json
+import uuid
+import pandas
+import pytest
+import requests
+import scoring_api
+
+from datetime import datetime, date, timedelta
+from pathlib import Path
+from models import *
+from sort_verification import SortExpectation
+from stub_server import StubServer, StubBackend, StubDataset, FaultInjection
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+# the stub itself is under test, its calls are never replayed
+pytestmark = pytest.mark.no_cassette
+
+
+def test_stub_auth(stub: StubServer):
+    new_token = f"Bearer {scoring_api.authorization_refresh_get().access_token}"
+    scoring_api.authorization_me_get(new_token)
+    for name in ["", "_", "user#", "user-имя", f"Auto-renamed-{uuid.uuid4()}"]:
+        scoring_api.authorization_name_patch(name, expected_code=400)
+    new_name = f"{uuid.uuid4()}"[:30]
+    scoring_api.authorization_name_patch(new_name, expected_code=200)
+    assert scoring_api.authorization_me_get().name == new_name, "User wasn't renamed"
+
+
+def test_stub_dataset_crud(stub: StubServer):
+    dataset = scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv').result
+    assert dataset.rows_num == 20 and dataset.cols_num == 20, f"Unexpected dataset card: {dataset}"
+    scoring_api.delete_dataset(dataset.dataset_id, expected_code=204)
+    assert dataset.dataset_id not in [item.dataset_id for item in scoring_api.get_datasets_list()], \
+        "Deleted dataset is in the list"
+    scoring_api.get_dataset_result_model_json(dataset.dataset_id, expected_code=404)
+    scoring_api.restore_dataset(dataset.dataset_id, expected_code=200)
+    assert dataset.dataset_id in [item.dataset_id for item in scoring_api.get_datasets_list()], \
+        "Restored dataset isn't in the list"
+
+
+def test_stub_scoring(stub: StubServer):
+    dataset = scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / 'scoring_100_with_meta.csv').result
+    request = PostScoringTemplate(name="Auto_stub", dataset_id=dataset.dataset_id)
+    template_id = scoring_api.scoring_template_post(request, expected_code=201).created_id
+    function = json.loads(pandas.read_csv(DATA_DIR / 'scoring_100_with_meta.csv', sep='\t')
+                          ["Column_1_logarithmic_parameter"].iloc[0])
+    template_property = RequestTemplateProperty(column_name="Column_1", enabled_for_scoring=True,
+                                                desirability_function=DesirabilityFunction(**function))
+    property_id = scoring_api.scoring_template_properties_post(template_property, template_id,
+                                                               expected_code=201).created_id
+    scored_dataset_id = scoring_api.scored_dataset_post(dataset.dataset_id, template_id, expected_code=201).created_id
+
+    result_model = scoring_api.get_dataset_result_model(dataset.dataset_id, 1, 100, "Scored_column", "desc")
+    scores = result_model.scored.scored_column
+    assert len(scores) == 100 and scores == sorted(scores, reverse=True), f"Scores aren't sorted: {scores}"
+
+    scoring_api.scored_dataset_delete(scored_dataset_id, expected_code=204)
+    assert scoring_api.get_dataset_result_model(dataset.dataset_id).scored is None, "Scores weren't deleted"
+    scoring_api.scoring_template_properties_delete(template_id, property_id, expected_code=204)
+    scoring_api.scoring_template_delete(template_id, expected_code=204)
+    scoring_api.scoring_template_delete(template_id, expected_code=404)
+
+
+@pytest.mark.parametrize("values", [["b", "a", "", "b", "a", "c"], ["2", "1", "", "2", "1", "3"]],
+                         ids=["text", "numeric"])
+def test_stub_stable_sort(values):
+    dataset = StubDataset("dataset", "Auto-sort.csv", "user", ",", ["Value"], [[value] for value in values], 0)
+    for order in ("asc", "desc"):
+        rows = dataset.sort_index("Value", order).tolist()
+        assert rows == SortExpectation(values).permutation(order).tolist(), \
+            f"Tied rows of the {order} sort aren't in upload order: {rows}"
+
+
+def test_stub_feedback(stub: StubServer):
+    start = datetime(2022, 1, 1)
+    stub.backend.generate_feedback(10, start, start + timedelta(days=10), screenshots=2)
+    feedback = scoring_api.feedback_get(f"{date(2022, 1, 3)}", f"{date(2022, 1, 6)}")
+    assert len(feedback) == 3, f"Unexpected feedback filtered by date: {feedback}"
+    screenshots = [url for item in feedback for url in item.screenshots]
+    for url in screenshots:
+        assert requests.get(url).content.startswith(b"\x89PNG"), f"Screenshot {url} isn't an image"
+
+
+def test_stub_fault_injection(stub: StubServer):
+    stub.backend.faults = FaultInjection(latency=0.05, error_rate=1, error_status=429, retry_after=2,
+                                         routes=["datasets_list"])
+    try:
+        response = scoring_api.send_request("/api/datasets", "get", expected_code=429)
+        assert response.status_code == 429 and response.headers["Retry-After"] == "2", \
+            f"Failure wasn't injected: {response.status_code} {response.headers}"
+        assert response.elapsed.total_seconds() >= 0.05, f"Latency wasn't injected: {response.elapsed}"
+        scoring_api.authorization_me_get()
+    finally:
+        stub.backend.faults = FaultInjection()
+
+
+def test_stub_verify_tokens(stub_environment):
+    backend = StubBackend(verify_tokens=True, token_ttl=60)
+    with stub_environment(backend):
+        scoring_api.authorization_me_get("Bearer invalid", expected_code=401)
+        scoring_api.authorization_me_get(f"Bearer {backend.issue_token(ttl=-1)}", expected_code=401)
+        scoring_api.authorization_me_get(f"Bearer {backend.issue_token()}", expected_code=200)
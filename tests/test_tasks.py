@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+
+from models import Task
+from tasks import Backoff, wait_for_task, async_wait_for_task, wait_for_tasks
+
+FAST_BACKOFF = Backoff(initial=0.01, max_delay=0.02)
+
+
+def test_wait_for_tasks():
+    polls = {}
+
+    def poll(task_id: str) -> Task:
+        polls[task_id] = polls.get(task_id, 0) + 1
+        if task_id == "gateway":
+            return b"<html>502 Bad Gateway</html>"
+        if task_id == "broken":
+            raise ConnectionError("reset")
+        return Task(id=task_id, status="SUCCESS" if polls[task_id] > 2 else "STARTED", meta={})
+
+    results = wait_for_tasks(["done", "gateway", "broken"], poll, timeout=5, backoff=FAST_BACKOFF)
+    assert results["done"].task.status == "SUCCESS" and results["done"].polls == 3, f"Unexpected: {results['done']}"
+    assert "Unexpected task status response" in results["gateway"].error, f"Unexpected: {results['gateway']}"
+    assert "reset" in results["broken"].error and results["broken"].task is None, f"Unexpected: {results['broken']}"
+
+
+def test_wait_for_task_unexpected_response():
+    polls = []
+
+    def poll(task_id: str) -> Task:
+        polls.append(task_id)
+        if len(polls) < 2:
+            return Task(id=task_id, status="STARTED", meta={})
+        return b"<html>502 Bad Gateway</html>"
+
+    with pytest.raises(TypeError, match="Unexpected task status response"):
+        wait_for_task("gateway", poll, timeout=5, backoff=FAST_BACKOFF)
+
+    async def async_poll(task_id: str) -> Task:
+        return poll(task_id)
+
+    polls.clear()
+    with pytest.raises(TypeError, match="Unexpected task status response"):
+        asyncio.run(async_wait_for_task("gateway", async_poll, timeout=5, backoff=FAST_BACKOFF))
+    assert len(polls) == 2, f"Unexpected polls: {polls}"
@@ -0,0 +1,68 @@
+import uuid
+import pandas
+import pytest
+import scoring_api
+
+from pathlib import Path
+from models import *
+from stub_server import StubServer
+from template_builder import (build_scoring_template, teardown_scoring_template, properties_from_dataframe,
+                              scoring_template)
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+DATA = DATA_DIR / 'scoring_100_with_meta.csv'
+
+
+@pytest.fixture(scope="module")
+def dataset_id(stub: StubServer) -> str:
+    return scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA).result.dataset_id
+
+
+def test_properties_from_dataframe():
+    dataframe = pandas.read_csv(DATA, sep='\t')
+    properties = properties_from_dataframe(dataframe)
+    assert len(properties) == 21, f"Unexpected number of properties: {len(properties)}"
+    assert {item.column_name for item in properties} == {"Column_1", "Column_2", "Column_3"}, \
+        f"Unexpected columns: {[item.column_name for item in properties]}"
+    selected = properties_from_dataframe(dataframe, columns=["Column_2"],
+                                         function_types=[DesirabilityFunctionTypes.custom_curve, "unit_step"])
+    assert [(item.column_name, item.desirability_function.type) for item in selected] == \
+           [("Column_2", DesirabilityFunctionTypes.custom_curve), ("Column_2", DesirabilityFunctionTypes.unit_step)], \
+        f"Unexpected selection: {selected}"
+
+
+def test_build_and_teardown(stub: StubServer, dataset_id: str):
+    properties = properties_from_dataframe(pandas.read_csv(DATA, sep='\t'))
+    template = PostScoringTemplate(name="Auto_builder", dataset_id=dataset_id)
+    report = build_scoring_template(template, properties, workers=8)
+    assert report.ok and len(report.property_ids) == len(properties), f"Template wasn't built: {report}"
+    assert set(stub.backend.templates[report.template_id]["properties"]) == set(report.property_ids), \
+        "Reported ids differ from the created properties"
+    assert all(item.time > 0 for item in report.properties) and report.properties_time > 0, "Timings are missing"
+    scored_dataset_id = scoring_api.scored_dataset_post(dataset_id, report.template_id, expected_code=201).created_id
+
+    teardown = teardown_scoring_template(report, workers=8, scored_dataset_ids=[scored_dataset_id])
+    assert not teardown.failed and len(teardown.results) == len(properties) + 2, f"Unexpected teardown: {teardown}"
+    assert report.template_id not in stub.backend.templates, "Template wasn't deleted"
+
+
+def test_failed_property(stub: StubServer, dataset_id: str):
+    properties = [RequestTemplateProperty(column_name=name, enabled_for_scoring=True,
+                                          desirability_function=DesirabilityFunction(type="linear"))
+                  for name in ["Column_1", "No_such_column"]]
+    with pytest.raises(AssertionError):
+        with scoring_template(PostScoringTemplate(name="Auto_builder", dataset_id=dataset_id), properties):
+            pass
+    assert not [template for template in stub.backend.templates.values() if template["dataset_id"] == dataset_id], \
+        "Template with a failed property wasn't deleted"
+
+
+def test_inline_template(stub: StubServer, dataset_id: str):
+    properties = properties_from_dataframe(pandas.read_csv(DATA, sep='\t'), columns=["Column_1"])
+    template = PostScoringTemplate(name="Auto_builder", dataset_id=dataset_id,
+                                   properties=[TemplateProperty(**item.dict()) for item in properties[:3]])
+    with scoring_template(template, properties[3:], inline=True) as report:
+        assert len(report.properties) == 7 and not report.property_ids, f"Unexpected inline report: {report}"
+        assert len(stub.backend.templates[report.template_id]["properties"]) == 7, "Properties weren't created"
+        template_id = report.template_id
+    assert template_id not in stub.backend.templates, "Template wasn't deleted"
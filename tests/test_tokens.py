@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+import scoring_api
+
+from concurrent.futures import ThreadPoolExecutor
+from async_scoring_api import AsyncScoringApi
+from stub_server import StubServer, StubBackend
+from tokens import TokenManager, jwt_expiry
+
+
+@pytest.fixture()
+def stub(stub_environment) -> StubServer:
+    with stub_environment(StubBackend(verify_tokens=True, token_ttl=3600)) as server:
+        yield server
+
+
+def use_tokens(stub: StubServer, access_ttl: float = None, access_token: str = None) -> TokenManager:
+    access_token = access_token or f"Bearer {stub.backend.issue_token(ttl=access_ttl)}"
+    refresh_token = f"Bearer {stub.backend.issue_token('refresh', ttl=3600)}"
+    manager = TokenManager(access_token, refresh_token, refresh=scoring_api.refresh_access_token)
+    scoring_api.set_token_manager(manager)
+    return manager
+
+
+def test_jwt_expiry(stub: StubServer):
+    token = stub.backend.issue_token(ttl=100)
+    assert jwt_expiry(f"Bearer {token}") == jwt_expiry(token) > 0, "Expiry wasn't decoded"
+    assert jwt_expiry("Bearer...") is None, "Expiry of a non JWT token"
+
+
+def test_proactive_refresh(stub: StubServer):
+    manager = use_tokens(stub, access_ttl=30)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda _: scoring_api.authorization_me_get(), range(64)))
+    assert manager.refreshes == 1, f"Token was refreshed {manager.refreshes} times"
+    assert stub.backend.calls["authorization_me"] == 64, "Requests were retried after a proactive refresh"
+    assert manager.expires_at - 3000 > manager.clock(), "Refreshed token expires too soon"
+
+
+@pytest.mark.parametrize("access_token", ["Bearer expired", None], ids=["Not a JWT", "Expired JWT"])
+def test_refresh_after_unauthorized(stub: StubServer, access_token):
+    manager = use_tokens(stub, access_ttl=-1, access_token=access_token)
+    manager.leeway = -3600
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        users = list(executor.map(lambda _: scoring_api.authorization_me_get(), range(64)))
+    assert len(users) == 64 and manager.refreshes == 1, f"Token was refreshed {manager.refreshes} times"
+    assert stub.backend.calls["authorization_refresh"] == 1, "Refresh endpoint was called more than once"
+
+
+def test_explicit_token_is_not_refreshed(stub: StubServer):
+    manager = use_tokens(stub)
+    scoring_api.authorization_me_get("Bearer invalid", expected_code=401)
+    assert manager.refreshes == 0, "Explicit token was refreshed"
+
+
+def test_refresh_failure(stub: StubServer):
+    manager = use_tokens(stub, access_ttl=-1)
+    manager.refresh_token = "Bearer invalid"
+    with pytest.raises(AssertionError):
+        scoring_api.authorization_me_get()
+    assert stub.backend.calls["authorization_refresh"] == 1, "Failed refresh wasn't shared"
+
+
+def test_async_single_flight_refresh(stub: StubServer):
+    manager = use_tokens(stub, access_token="Bearer expired")
+
+    async def run():
+        async with AsyncScoringApi(max_concurrency=32) as api:
+            return await asyncio.gather(*[api.authorization_me_get() for _ in range(64)])
+
+    users = asyncio.run(run())
+    assert len(users) == 64 and manager.refreshes == 1, f"Token was refreshed {manager.refreshes} times"
+    assert stub.backend.calls["authorization_refresh"] == 1, "Refresh endpoint was called more than once"
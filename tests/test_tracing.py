@@ -0,0 +1,110 @@
+import asyncio
+import uuid
+import pytest
+import requests
+import scoring_api
+
+from pathlib import Path
+from async_scoring_api import AsyncScoringApi
+from cache import set_response_cache, ResponseCache
+from models import UserResponse
+from scheduler import get_scheduler
+from stub_server import StubServer
+from tracing import Tracer, set_tracer, PHASES
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+@pytest.fixture
+def tracer() -> Tracer:
+    tracer = Tracer()
+    previous = set_tracer(tracer)
+    yield tracer
+    set_tracer(previous)
+
+
+def test_wrapper_phases(stub: StubServer, tracer: Tracer):
+    dataset = scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv').result
+    tracer.clear()
+    scoring_api.get_dataset_result_model(dataset.dataset_id, 1, 10)
+    span = tracer.spans[-1]
+    assert span.name == "GET /api/datasets/{id}/result_model", f"Unexpected span name: {span.name}"
+    assert span.status_code == 200 and span.attributes["http.response.body.size"] > 0, \
+        f"Unexpected span attributes: {span.attributes}"
+    assert set(span.phases) == set(PHASES), f"Phases weren't recorded: {span.phases}"
+    assert sum(span.phases.values()) <= span.duration * 1.01, f"Phases exceed the call: {span.phases}"
+
+
+def test_decode_phase(stub: StubServer, tracer: Tracer):
+    scoring_api.authorization_me_get()
+    span = tracer.spans[-1]
+    assert span.name == "GET /api/authorization/me" and span.phases.get("decode", 0) > 0, \
+        f"Decoding wasn't recorded: {span.name} {span.phases}"
+    response = scoring_api.send_request("/api/authorization/me", "get")
+    assert type(response) is requests.Response, f"Traced response changed its class: {type(response)}"
+
+
+def test_async_decode_phase(stub: StubServer, tracer: Tracer):
+    async def run():
+        async with AsyncScoringApi() as api:
+            return await api.authorization_me_get()
+
+    user = asyncio.run(run())
+    span = tracer.spans[-1]
+    assert isinstance(user, UserResponse), f"Unexpected response: {user!r}"
+    assert span.name == "GET /api/authorization/me" and span.phases.get("decode", 0) > 0, \
+        f"Async decoding wasn't recorded: {span.name} {span.phases}"
+
+
+def test_nested_spans(stub: StubServer, tracer: Tracer):
+    scoring_api.upload_dataset(f"Auto-{uuid.uuid4()}.csv", DATA_DIR / '20_20.csv')
+    root = tracer.spans[-1]
+    assert root.name == "upload_dataset" and root.parent_id is None, f"Unexpected root span: {root.name}"
+    children = [span for span in tracer.spans if span.parent_id == root.span_id]
+    names = {span.name for span in children}
+    assert {"GET /api/upload/datasets/upload_params", "POST /api/upload/datasets/validate",
+            "GET /api/task/{id}/result"} <= names, f"Missing child spans: {names}"
+    assert all(span.trace_id == root.trace_id for span in children), "Children are in another trace"
+
+
+def test_cache_hit_and_bare_request(stub: StubServer, tracer: Tracer):
+    previous = set_response_cache(ResponseCache())
+    try:
+        scoring_api.authorization_me_get()
+        scoring_api.authorization_me_get()
+    finally:
+        set_response_cache(previous)
+    assert tracer.spans[-1].attributes.get("scoring.cache") == "hit", "Cache hit wasn't marked"
+    scoring_api.send_request("/api/datasets/unknown", "get", expected_code=404)
+    span = tracer.spans[-1]
+    assert span.name == "GET /api/datasets/unknown" and span.status_code == 404 and span.failed, \
+        f"Bare request wasn't traced: {span.name} {span.status_code}"
+
+
+def test_async_spans(stub: StubServer, tracer: Tracer):
+    async def run():
+        async with AsyncScoringApi() as api:
+            await asyncio.gather(*[api.get_datasets_list() for _ in range(5)])
+
+    asyncio.run(run())
+    summary = {item.endpoint: item for item in tracer.summary()}
+    assert summary["GET /api/datasets"].calls == 5, f"Unexpected summary: {summary}"
+    assert summary["GET /api/datasets"].phases.get("server", 0) > 0, "Async phases weren't recorded"
+
+
+def test_exports(stub: StubServer, tracer: Tracer):
+    scoring_api.get_datasets_list()
+    scoring_api.send_request("/api/datasets/unknown", "get", expected_code=404)
+    spans = tracer.to_otlp()["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(spans) == 2 and all(span["traceId"] and span["spanId"] for span in spans), f"Bad export: {spans}"
+    assert spans[1]["status"]["code"] == 2, f"Failed call isn't an error span: {spans[1]}"
+    metrics = tracer.prometheus()
+    stats = next(item for item in get_scheduler().stats() if item.endpoint == "GET /api/datasets")
+    for line in ['scoring_api_call_duration_seconds_count{endpoint="GET /api/datasets"} 1',
+                 'scoring_api_call_duration_seconds_bucket{endpoint="GET /api/datasets",le="+Inf"} 1',
+                 'scoring_api_responses_total{endpoint="GET /api/datasets/unknown",code="404"} 1',
+                 'scoring_api_errors_total{endpoint="GET /api/datasets/unknown"} 1',
+                 f'scoring_api_scheduler_attempts_total{{endpoint="GET /api/datasets",host="{stub.url}"}} '
+                 f'{stats.attempts}',
+                 f'scoring_api_scheduler_retries_total{{endpoint="GET /api/datasets",host="{stub.url}"}} 0']:
+        assert line in metrics.splitlines(), f"{line} isn't in metrics:\n{metrics}"
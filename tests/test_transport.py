@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+from stub_server import StubServer, FaultInjection
+from transport import Transport, TransportConfig
+
+ME = "/api/authorization/me"
+
+
+def test_connection_reuse(stub: StubServer):
+    transport = Transport()
+    try:
+        timings = [transport.request("get", f"{stub.url}{ME}").timing for _ in range(5)]
+    finally:
+        transport.close()
+    assert [timing.new_connections for timing in timings] == [1, 0, 0, 0, 0], \
+        f"Connection wasn't kept alive: {timings}"
+    assert timings[0].connect > 0 and all(timing.connect == 0 for timing in timings[1:]), \
+        f"Connect time of reused connections: {timings}"
+    assert all(0 < timing.ttfb <= timing.total and timing.status_code == 200 for timing in timings), \
+        f"Unexpected call timings: {timings}"
+    assert transport.pop_timings() == timings and not transport.timings, "Timings weren't recorded once per call"
+
+
+def test_no_keep_alive(stub: StubServer):
+    transport = Transport(TransportConfig(keep_alive=False))
+    try:
+        timings = [transport.request("get", f"{stub.url}{ME}").timing for _ in range(3)]
+    finally:
+        transport.close()
+    assert [timing.new_connections for timing in timings] == [1, 1, 1], f"Connection was reused: {timings}"
+
+
+def test_concurrent_timings(stub: StubServer):
+    transport = Transport(TransportConfig(pool_maxsize=4))
+    stub.backend.faults = FaultInjection(latency=0.02)
+    urls = {}
+
+    def call(index: int):
+        url = f"{stub.url}{ME}?call={index}"
+        response = transport.request("get", url)
+        urls[index] = (url, response.timing)
+
+    try:
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(call, range(40)))
+    finally:
+        stub.backend.faults = FaultInjection()
+        transport.close()
+    assert all(timing.url == url and timing.ttfb >= 0.02 for url, timing in urls.values()), \
+        "Calls got timings of other threads"
+    opened = sum(timing.new_connections for _, timing in urls.values())
+    assert 1 <= opened <= 4, f"Pool of 4 opened {opened} connections for 40 calls"
@@ -0,0 +1,124 @@
+import json
+import random
+import threading
+import time
+import pytest
+
+import scoring_api
+
+from pathlib import Path
+from scheduler import get_scheduler
+from stub_server import FaultInjection, StubServer
+from workload import (WorkloadConfig, WorkloadState, Stage, LatencyHistogram, OperationSummary, IntervalRecord, ramp,
+                      steps, run_workload, throughput_knee, cleanup_workload)
+
+pytestmark = pytest.mark.no_cassette
+
+
+def test_schedule():
+    config = WorkloadConfig(stages=ramp(10, ramp_up=5, soak=20))
+    assert [config.target_at(t) for t in (0, 2.5, 5, 24, 30)] == [0, 5, 10, 10, 10], "Unexpected ramp"
+    config = WorkloadConfig(stages=steps([2, 4], step=3))
+    assert config.duration == 6 and [config.target_at(t) for t in (0, 2.9, 3, 5)] == [2, 2, 4, 4], \
+        "Unexpected staircase"
+
+
+def test_histogram_percentiles():
+    rng = random.Random(0)
+    values = sorted(rng.uniform(0.001, 2) for _ in range(10000))
+    histogram, other = LatencyHistogram(), LatencyHistogram()
+    for index, value in enumerate(values):
+        (histogram if index % 2 else other).record(value)
+    histogram.merge(other)
+    assert histogram.count == len(values) and histogram.max == values[-1], "Merged histogram lost values"
+    for q in (50, 95, 99):
+        expected = values[int(len(values) * q / 100) - 1]
+        assert expected <= histogram.percentile(q) <= expected * 1.1, \
+            f"p{q} {histogram.percentile(q)} is off, expected {expected}"
+    assert sum(histogram.to_dict().values()) == len(values), "Buckets don't hold every value"
+
+
+def test_throughput_knee():
+    def record(target, rps, p95, errors=0):
+        return IntervalRecord(elapsed=0, seconds=1, target=target,
+                              total=OperationSummary(calls=int(rps), rps=rps, p95=p95, errors=errors))
+    intervals = [record(10, 10, 0.1), record(20, 19.5, 0.2), record(40, 30, 0.5), record(30, 29, 2.0),
+                 record(25, 25, 0.3, errors=1)]
+    assert throughput_knee(intervals, p95_limit=1.0) == 20, "Unexpected knee"
+    assert throughput_knee(intervals[2:4]) is None, "Knee found in overloaded intervals"
+
+
+def read_records(path: Path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_closed_loop(tmp_path: Path):
+    config = WorkloadConfig(mode="closed", stages=[Stage(duration=0.5, target=3), Stage(duration=1.5, target=3)],
+                            interval=0.5, pool=2, rows=60)
+    report = run_workload(config, tmp_path, stub=True)
+    assert report.total.calls > 20 and not report.total.errors, f"Unexpected totals: {report.total}"
+    assert {"browse", "page"} <= set(report.operations), f"Operations weren't mixed: {list(report.operations)}"
+    intervals = read_records(tmp_path / "intervals.ndjson")
+    assert len(intervals) >= 4 and sum(item["total"]["calls"] for item in intervals) == report.total.calls, \
+        "Interval records don't add up to the totals"
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert summary["total"]["calls"] == report.total.calls and summary["histograms"], "Summary wasn't saved"
+
+
+def test_open_loop_errors_and_drops(tmp_path: Path):
+    config = WorkloadConfig(mode="open", stages=[Stage(duration=1.5, target=80)], arrivals="uniform",
+                            max_in_flight=2, mix={"browse": 1}, interval=0.5, pool=0)
+    faults = FaultInjection(latency=0.05, error_rate=0.3, error_status=500)
+    report = run_workload(config, tmp_path, stub=True, faults=faults)
+    browse = report.operations["browse"]
+    assert browse.errors and browse.calls, f"Injected failures weren't counted: {browse}"
+    assert browse.dropped, f"Arrivals over max_in_flight weren't dropped: {browse}"
+    assert browse.p50 >= 0.05, f"Injected latency is missing: {browse}"
+    errors = read_records(tmp_path / "errors.ndjson")
+    assert len(errors) == browse.errors and errors[0]["operation"] == "browse", "Errors weren't streamed"
+
+
+def test_failures_not_retried(tmp_path: Path):
+    config = WorkloadConfig(mode="closed", stages=[Stage(duration=1, target=2)], mix={"browse": 1}, interval=0.5,
+                            pool=0)
+    # retried statuses, the shared scheduler would retry them and open the circuit of the endpoint
+    faults = FaultInjection(error_rate=0.5, error_status=503, seed=1)
+    shared = get_scheduler()
+    report = run_workload(config, tmp_path, stub=True, faults=faults)
+    browse = report.operations["browse"]
+    assert browse.error_rate >= 0.25, f"Failures were retried: {browse}"
+    errors = read_records(tmp_path / "errors.ndjson")
+    assert not [error for error in errors if "CircuitOpenError" in error["error"]], "Calls were rejected by a breaker"
+    assert get_scheduler() is shared, "Shared scheduler wasn't restored"
+
+
+def test_shared_scheduler_untouched(tmp_path: Path):
+    config = WorkloadConfig(mode="closed", stages=[Stage(duration=1, target=2)], mix={"browse": 1}, interval=0.5,
+                            pool=0)
+    shared = get_scheduler()
+    shared.reset()
+    reports, observed = [], []
+    run = threading.Thread(target=lambda: reports.append(run_workload(config, tmp_path, stub=True)))
+    run.start()
+    while run.is_alive():
+        observed.append(get_scheduler() is shared and not shared.stats())
+        time.sleep(0.05)
+    run.join()
+    assert reports and reports[0].operations["browse"].calls, "Workload didn't run"
+    assert observed and all(observed), "Workload calls went through the shared scheduler or replaced it"
+
+
+def test_cleanup_keeps_going(stub: StubServer, tmp_path: Path):
+    state = WorkloadState(tmp_path, "Auto-load-cleanup", rows=20, columns=2)
+    for _ in range(3):
+        state.upload()
+    state.delete(random.Random(0))
+    stub.backend.faults = FaultInjection(error_rate=1, error_status=500, routes=["dataset_restore"])
+    try:
+        errors = cleanup_workload(state)
+    finally:
+        stub.backend.faults = FaultInjection()
+    assert len(errors) == 1 and errors[0].startswith(f"restore {state.deleted[0]}"), \
+        f"Unexpected cleanup errors: {errors}"
+    left = [item.name for item in scoring_api.get_datasets_list() if item.name.startswith(state.prefix)]
+    assert not left, f"A failed restore stopped the cleanup: {left}"
@@ -0,0 +1,144 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+import weakref
+
+from typing import Optional, Callable, Awaitable
+
+RefreshFunction = Callable[[str], str]
+AsyncRefreshFunction = Callable[[str], Awaitable[str]]
+
+
+def jwt_expiry(token: str) -> Optional[float]:
+    """
+    exp claim of a "Bearer <jwt>" or bare JWT, None if the token isn't a JWT or never expires
+    """
+    try:
+        payload = token.split(" ", 1)[-1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"]) if claims.get("exp") is not None else None
+    except (IndexError, KeyError, TypeError, ValueError, AttributeError):
+        return None
+
+
+class TokenManager:
+    """
+    Access token shared by all threads and coroutines, renewed through the refresh token
+
+    The token is refreshed `leeway` seconds before its JWT expiry, or after the server rejects it with 401.
+    Callers that need a new token at the same time share one refresh call: the first one refreshes,
+    the others wait for it and take its result (or its error).
+    refresh: returns a new "Bearer ..." access token for the refresh token
+    """
+    def __init__(self, access_token: str, refresh_token: str, refresh: RefreshFunction = None,
+                 leeway: float = 60, clock: Callable[[], float] = time.time):
+        self.refresh_token = refresh_token
+        self.leeway = leeway
+        self.clock = clock
+        self.refresh_function = refresh
+        self.refreshes = 0
+        self._lock = threading.Lock()
+        self._async_locks = weakref.WeakKeyDictionary()
+        self._attempt = 0
+        self._error: Optional[BaseException] = None
+        self._set(access_token)
+
+    def _set(self, access_token: str):
+        self._access_token = access_token
+        self.expires_at = jwt_expiry(access_token)
+
+    @property
+    def access_token(self) -> str:
+        return self._access_token
+
+    def set_tokens(self, access_token: str, refresh_token: str = None):
+        with self._lock:
+            self._set(access_token)
+            if refresh_token is not None:
+                self.refresh_token = refresh_token
+
+    def expires_soon(self) -> bool:
+        return self.expires_at is not None and self.expires_at - self.leeway <= self.clock()
+
+    # threads
+
+    def get(self) -> str:
+        """
+        Access token valid for at least `leeway` seconds if its expiry is known
+        """
+        attempt = self._attempt
+        if self.expires_soon():
+            return self._refresh(attempt)
+        return self._access_token
+
+    def invalidate(self, token: str) -> str:
+        """
+        Token the server rejected with 401 is replaced, unless another caller has already done it
+        """
+        attempt = self._attempt
+        if token != self._access_token:
+            return self._access_token
+        return self._refresh(attempt)
+
+    def _refresh(self, attempt: int) -> str:
+        with self._lock:
+            if self._attempt != attempt:
+                if self._error is not None:
+                    raise self._error
+                return self._access_token
+            assert self.refresh_function is not None, "Token manager has no refresh function"
+            try:
+                token = self.refresh_function(self.refresh_token)
+            except Exception as error:
+                self._error = error
+                self._attempt += 1
+                raise
+            self._finish(token)
+            return token
+
+    def _finish(self, token: str):
+        # the new token is visible before the attempt counter moves, so callers that read the counter
+        # after this refresh never see the expired token
+        self._error = None
+        self.refreshes += 1
+        self._set(token)
+        self._attempt += 1
+
+    # coroutines
+
+    def _async_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        lock = self._async_locks.get(loop)
+        if lock is None:
+            lock = self._async_locks[loop] = asyncio.Lock()
+        return lock
+
+    async def get_async(self, refresh: AsyncRefreshFunction) -> str:
+        attempt = self._attempt
+        if self.expires_soon():
+            return await self._refresh_async(attempt, refresh)
+        return self._access_token
+
+    async def invalidate_async(self, token: str, refresh: AsyncRefreshFunction) -> str:
+        attempt = self._attempt
+        if token != self._access_token:
+            return self._access_token
+        return await self._refresh_async(attempt, refresh)
+
+    async def _refresh_async(self, attempt: int, refresh: AsyncRefreshFunction) -> str:
+        async with self._async_lock():
+            if self._attempt != attempt:
+                if self._error is not None:
+                    raise self._error
+                return self._access_token
+            try:
+                token = await refresh(self.refresh_token)
+            except Exception as error:
+                self._error = error
+                self._attempt += 1
+                raise
+            with self._lock:
+                self._finish(token)
+            return token
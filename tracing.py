@@ -0,0 +1,400 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from collections import deque
+from typing import Optional, Dict, List, Deque, Any, Callable, Tuple
+
+from pydantic import BaseModel, Field
+
+from scheduler import get_scheduler
+from transport import endpoint_template
+
+# connect: DNS lookup and TCP connect of new connections, the lookup happens inside the socket connect of
+#     urllib3 and httpcore and can't be told apart without resolving twice
+# tls: TLS handshakes of new connections
+# server: from the request being sent until the response headers came back (upload, network and server time)
+# download: reading the body
+# wait: rest of send_request - retries, backoff, rate limiting and token refresh
+# decode: parsing the body in decode_response, recorded by the decoder with record_phase
+# model: building pydantic models from the decoded JSON
+PHASES = ("connect", "tls", "server", "download", "wait", "decode", "model")
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("scoring_api_span", default=None)
+
+
+class Span:
+    """
+    One endpoint wrapper call, or one send_request made outside of a wrapper
+
+    Wrapper calls are named by the endpoint template of their request, e.g. "GET /api/datasets/{id}/result_model",
+    calls of several endpoints (upload_dataset) by the function name with a child span per request.
+    """
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "started", "duration", "phases",
+                 "attributes", "status_code", "error", "request", "responded")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.attributes = attributes
+        self.status_code: Optional[int] = None
+        self.error: Optional[str] = None
+        self.request: Optional[str] = None
+        self.responded: Optional[float] = None
+
+    def add_phase(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None or self.status_code is not None and self.status_code >= 400
+
+    def to_otel(self) -> Dict[str, Any]:
+        """
+        Span in the OTLP/JSON layout
+        """
+        attributes = dict(self.attributes)
+        attributes.update({f"scoring.phase.{phase}": seconds for phase, seconds in self.phases.items()})
+        if self.status_code is not None:
+            attributes["http.response.status_code"] = self.status_code
+        span = {"traceId": self.trace_id,
+                "spanId": self.span_id,
+                "name": self.name,
+                "kind": 3 if self.request else 1,
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(self.start_ns + int((self.duration or 0) * 1e9)),
+                "attributes": [_otel_attribute(key, value) for key, value in attributes.items()],
+                "status": {"code": 2, "message": self.error or f"HTTP {self.status_code}"} if self.failed
+                else {"code": 0}}
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otel_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class EndpointMetrics:
+    """
+    Running totals of the spans of one name
+    """
+    __slots__ = ("name", "calls", "errors", "total", "max", "buckets", "phases", "request_bytes", "response_bytes",
+                 "statuses")
+
+    def __init__(self, name: str, bucket_count: int):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (bucket_count + 1)
+        self.phases: Dict[str, float] = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.statuses: Dict[int, int] = {}
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+class EndpointSummary(BaseModel):
+    endpoint: str = Field(..., title='Endpoint template or function name')
+    calls: int = Field(..., title='Calls')
+    errors: int = Field(..., title='Calls failed with an exception or a 4xx/5xx status')
+    total: float = Field(..., title='Seconds spent in all calls')
+    mean: float = Field(..., title='Mean seconds per call')
+    max: float = Field(..., title='Slowest call, seconds')
+    phases: Dict[str, float] = Field({}, title='Seconds spent in every phase of all calls')
+    request_bytes: int = Field(0, title='Bytes sent')
+    response_bytes: int = Field(0, title='Bytes received')
+
+
+class Tracer:
+    """
+    Collects spans of API calls and aggregates them by endpoint
+
+    The last max_spans spans are kept for export, aggregates cover every call since the last clear().
+    tags: attributes added to every new span, e.g. {"test.case.name": nodeid}
+    """
+    def __init__(self, max_spans: int = 10000, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self.tags: Dict[str, Any] = {}
+        self.root_calls = 0
+        self.root_time = 0.0
+        self._metrics: Dict[str, EndpointMetrics] = {}
+        self._lock = threading.Lock()
+
+    def start(self, name: str) -> Tuple[Span, contextvars.Token]:
+        span = Span(name, _current_span.get(), dict(self.tags))
+        return span, _current_span.set(span)
+
+    def finish(self, span: Span, token: contextvars.Token = None):
+        now = time.perf_counter()
+        span.duration = now - span.started
+        if span.responded is not None:
+            span.add_phase("model", max(0.0, now - span.responded - span.phases.get("decode", 0.0)))
+        if token is not None:
+            _current_span.reset(token)
+        with self._lock:
+            self.spans.append(span)
+            if span.parent_id is None:
+                self.root_calls += 1
+                self.root_time += span.duration
+            metrics = self._metrics.get(span.name)
+            if metrics is None:
+                metrics = self._metrics[span.name] = EndpointMetrics(span.name, len(self.buckets))
+            metrics.calls += 1
+            metrics.errors += span.failed
+            metrics.total += span.duration
+            metrics.max = max(metrics.max, span.duration)
+            metrics.buckets[bisect_left(self.buckets, span.duration)] += 1
+            for phase, seconds in span.phases.items():
+                metrics.phases[phase] = metrics.phases.get(phase, 0.0) + seconds
+            metrics.request_bytes += span.attributes.get("http.request.body.size", 0)
+            metrics.response_bytes += span.attributes.get("http.response.body.size", 0)
+            if span.status_code is not None:
+                metrics.statuses[span.status_code] = metrics.statuses.get(span.status_code, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self._metrics.clear()
+            self.root_calls, self.root_time = 0, 0.0
+
+    def summary(self) -> List[EndpointSummary]:
+        """
+        Aggregates by endpoint, slowest in total first
+        """
+        with self._lock:
+            summaries = [EndpointSummary(endpoint=item.name, calls=item.calls, errors=item.errors, total=item.total,
+                                         mean=item.mean, max=item.max, phases=dict(item.phases),
+                                         request_bytes=item.request_bytes, response_bytes=item.response_bytes)
+                         for item in self._metrics.values()]
+        return sorted(summaries, key=lambda item: item.total, reverse=True)
+
+    def to_otlp(self, service_name: str = "scoring_auto_qa") -> Dict[str, Any]:
+        """
+        Kept spans as an OTLP/JSON export request, accepted by OpenTelemetry collectors on /v1/traces
+        """
+        with self._lock:
+            spans = [span.to_otel() for span in self.spans]
+        return {"resourceSpans": [{
+            "resource": {"attributes": [_otel_attribute("service.name", service_name)]},
+            "scopeSpans": [{"scope": {"name": "scoring_api.tracing"}, "spans": spans}]}]}
+
+    def save_otlp(self, path: str, service_name: str = "scoring_auto_qa"):
+        with open(path, "w") as file:
+            json.dump(self.to_otlp(service_name), file)
+
+    def prometheus(self, prefix: str = "scoring_api") -> str:
+        """
+        Aggregates and the counters of the shared scheduler in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda item: item.name)
+            lines = [f"# HELP {prefix}_call_duration_seconds Duration of API calls",
+                     f"# TYPE {prefix}_call_duration_seconds histogram"]
+            for item in metrics:
+                label = f'endpoint="{_escape(item.name)}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, item.buckets):
+                    cumulative += count
+                    lines.append(f'{prefix}_call_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_call_duration_seconds_bucket{{{label},le="+Inf"}} {item.calls}')
+                lines.append(f"{prefix}_call_duration_seconds_sum{{{label}}} {item.total}")
+                lines.append(f"{prefix}_call_duration_seconds_count{{{label}}} {item.calls}")
+            lines += [f"# HELP {prefix}_phase_seconds_total Seconds spent in every phase of API calls",
+                      f"# TYPE {prefix}_phase_seconds_total counter"]
+            lines += [f'{prefix}_phase_seconds_total{{endpoint="{_escape(item.name)}",phase="{phase}"}} '
+                      f'{item.phases[phase]}' for item in metrics for phase in PHASES if phase in item.phases]
+            lines += [f"# HELP {prefix}_responses_total Responses by status code",
+                      f"# TYPE {prefix}_responses_total counter"]
+            lines += [f'{prefix}_responses_total{{endpoint="{_escape(item.name)}",code="{code}"}} {count}'
+                      for item in metrics for code, count in sorted(item.statuses.items())]
+            lines += [f"# HELP {prefix}_errors_total Calls failed with an exception or a 4xx/5xx status",
+                      f"# TYPE {prefix}_errors_total counter"]
+            lines += [f'{prefix}_errors_total{{endpoint="{_escape(item.name)}"}} {item.errors}' for item in metrics]
+            for direction in ("request", "response"):
+                lines += [f"# HELP {prefix}_{direction}_bytes_total Body bytes of {direction}s",
+                          f"# TYPE {prefix}_{direction}_bytes_total counter"]
+                lines += [f'{prefix}_{direction}_bytes_total{{endpoint="{_escape(item.name)}"}} '
+                          f'{getattr(item, f"{direction}_bytes")}' for item in metrics]
+        return "\n".join(lines + _scheduler_lines(prefix)) + "\n"
+
+    def save_prometheus(self, path: str, prefix: str = "scoring_api"):
+        with open(path, "w") as file:
+            file.write(self.prometheus(prefix))
+
+
+# counters of the shared scheduler: EndpointStats field, metric name, help
+SCHEDULER_COUNTERS = (
+    ("attempts", "scheduler_attempts_total", "Requests sent, retries included"),
+    ("retries", "scheduler_retries_total", "Requests sent again"),
+    ("throttled", "scheduler_throttled_total", "429 responses"),
+    ("failures", "scheduler_failures_total", "Connection errors and 5xx responses"),
+    ("rate_limited", "scheduler_rate_limited_total", "Requests delayed by the rate limiter"),
+    ("rate_limit_wait", "scheduler_rate_limit_wait_seconds_total", "Seconds spent waiting for the rate limiter"),
+    ("breaker_trips", "scheduler_breaker_trips_total", "Times the circuit of an endpoint opened"),
+    ("breaker_rejections", "scheduler_breaker_rejections_total", "Calls rejected while the circuit was open"),
+)
+
+
+def _scheduler_lines(prefix: str) -> List[str]:
+    stats = sorted(get_scheduler().stats(), key=lambda item: (item.endpoint, item.host))
+    lines = []
+    for field, name, description in SCHEDULER_COUNTERS:
+        lines += [f"# HELP {prefix}_{name} {description}", f"# TYPE {prefix}_{name} counter"]
+        lines += [f'{prefix}_{name}{{endpoint="{_escape(item.endpoint)}",host="{_escape(item.host)}"}} '
+                  f'{getattr(item, field)}' for item in stats]
+    return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _body_size(message: Any) -> int:
+    body = getattr(message, "body", None)
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    try:
+        return int(message.headers.get("Content-Length", 0))
+    except (AttributeError, ValueError):
+        return 0
+
+
+def record_phase(phase: str, seconds: float):
+    """
+    Add time to a phase of the current span, if there is one
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.add_phase(phase, seconds)
+
+
+def trace_call(method: str, url: str, started: float, sent: Any = None, response: Any = None):
+    """
+    Account a finished send_request in the span of the calling wrapper, or in a span of its own
+
+    started: perf_counter() at the start of send_request
+    sent: response of the last attempt, None for a cache hit
+    response: response returned to the caller
+    """
+    tracer = _tracer
+    if tracer is None:
+        return
+    now = time.perf_counter()
+    span = _current_span.get()
+    own = span is None or span.request is not None
+    if own:
+        span, token = tracer.start(endpoint_template(method, url))
+        span.start_ns -= int((now - started) * 1e9)
+        span.started = started
+    else:
+        span.name = endpoint_template(method, url)
+    span.request = span.name
+    span.attributes.update({"http.request.method": method.upper(), "url.full": url,
+                            "url.template": span.name.split(" ", 1)[-1]})
+    if sent is None:
+        span.attributes["scoring.cache"] = "hit"
+    else:
+        if sent is not response:
+            span.attributes["scoring.cache"] = "revalidated"
+        timing = getattr(sent, "timing", None)
+        if timing is not None:
+            connect = timing.connect - timing.tls
+            span.add_phase("connect", connect)
+            span.add_phase("tls", timing.tls)
+            span.add_phase("server", max(0.0, timing.ttfb - timing.connect))
+            span.add_phase("download", max(0.0, timing.total - timing.ttfb))
+            span.add_phase("wait", max(0.0, now - started - timing.total))
+            span.attributes["scoring.new_connections"] = timing.new_connections
+        span.attributes["http.request.body.size"] = _body_size(getattr(sent, "request", None))
+        span.attributes["http.response.body.size"] = len(sent.content)
+    if response is not None:
+        span.status_code = response.status_code
+    if own:
+        tracer.finish(span, token)
+    else:
+        span.responded = now
+
+
+def traced(function: Callable) -> Callable:
+    """
+    Record a span for every call of an endpoint wrapper, a no-op while tracing is disabled
+    """
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return await function(*args, **kwargs)
+            span, token = tracer.start(function.__name__)
+            try:
+                return await function(*args, **kwargs)
+            except BaseException as error:
+                span.error = repr(error)
+                raise
+            finally:
+                tracer.finish(span, token)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return function(*args, **kwargs)
+        span, token = tracer.start(function.__name__)
+        try:
+            return function(*args, **kwargs)
+        except BaseException as error:
+            span.error = repr(error)
+            raise
+        finally:
+            tracer.finish(span, token)
+    return wrapper
+
+
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    """
+    Tracer of endpoint wrappers, None until enabled with configure_tracing
+    """
+    return _tracer
+
+
+def set_tracer(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    """
+    Replace the shared tracer (None disables tracing), returns the previous one
+    """
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def configure_tracing(max_spans: int = 10000, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Tracer:
+    set_tracer(Tracer(max_spans, buckets))
+    return _tracer
@@ -0,0 +1,82 @@
+"""
+pytest plugin tracing API calls of a test session, loaded by tests/conftest.py or with `-p tracing_plugin`
+
+    pytest --api-report 10 --api-spans spans.json --api-metrics metrics.prom
+
+prints the 10 slowest endpoints and the 10 tests spending most time in API calls at the end of the session,
+saves spans as OTLP/JSON and aggregates in the Prometheus text format.
+"""
+from typing import Optional, Dict, Tuple
+
+import pytest
+
+from tracing import Tracer, PHASES, get_tracer, set_tracer, configure_tracing
+
+TEST_ATTRIBUTE = "test.case.name"
+
+
+class ApiReport:
+    def __init__(self, tracer: Tracer, limit: int):
+        self.tracer = tracer
+        self.limit = limit
+        # nodeid: (root calls, seconds in root calls)
+        self.tests: Dict[str, Tuple[int, float]] = {}
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):
+        self.tracer.tags[TEST_ATTRIBUTE] = item.nodeid
+        calls, seconds = self.tracer.root_calls, self.tracer.root_time
+        try:
+            yield
+        finally:
+            self.tracer.tags.pop(TEST_ATTRIBUTE, None)
+            self.tests[item.nodeid] = (self.tracer.root_calls - calls, self.tracer.root_time - seconds)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if not self.limit:
+            return
+        summaries = self.tracer.summary()[:self.limit]
+        terminalreporter.write_sep("=", f"{len(summaries)} slowest API endpoints")
+        header = "".join(f"{phase:>10}" for phase in PHASES)
+        terminalreporter.write_line(f"{'calls':>7}{'errors':>7}{'total':>10}{'mean':>10}{'max':>10}{header}  endpoint")
+        for item in summaries:
+            phases = "".join(f"{item.phases.get(phase, 0) / item.calls:>10.4f}" for phase in PHASES)
+            terminalreporter.write_line(f"{item.calls:>7}{item.errors:>7}{item.total:>10.3f}{item.mean:>10.4f}"
+                                        f"{item.max:>10.4f}{phases}  {item.endpoint}")
+        tests = sorted(self.tests.items(), key=lambda test: test[1][1], reverse=True)[:self.limit]
+        terminalreporter.write_sep("=", f"{len(tests)} tests with the most time in API calls")
+        terminalreporter.write_line(f"{'calls':>7}{'seconds':>10}  test")
+        for nodeid, (calls, seconds) in tests:
+            terminalreporter.write_line(f"{calls:>7}{seconds:>10.3f}  {nodeid}")
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("api-tracing", "API call tracing")
+    group.addoption("--api-report", type=int, default=None, metavar="N",
+                    help="trace API calls and show the N slowest endpoints and tests (0 for none)")
+    group.addoption("--api-spans", metavar="PATH", help="trace API calls and save the spans as OTLP/JSON")
+    group.addoption("--api-metrics", metavar="PATH", help="trace API calls and save Prometheus text metrics")
+
+
+_previous_tracer: Optional[Tracer] = None
+
+
+def pytest_configure(config):
+    global _previous_tracer
+    limit = config.getoption("api_report")
+    if limit is None and not config.getoption("api_spans") and not config.getoption("api_metrics"):
+        return
+    _previous_tracer = get_tracer()
+    config.pluginmanager.register(ApiReport(configure_tracing(), limit or 0), "api-report")
+
+
+def pytest_unconfigure(config):
+    report = config.pluginmanager.get_plugin("api-report")
+    if report is None:
+        return
+    if config.getoption("api_spans"):
+        report.tracer.save_otlp(config.getoption("api_spans"))
+    if config.getoption("api_metrics"):
+        report.tracer.save_prometheus(config.getoption("api_metrics"))
+    config.pluginmanager.unregister(report)
+    set_tracer(_previous_tracer)
@@ -0,0 +1,247 @@
+import re
+import threading
+import time
+
+from collections import deque
+from typing import Optional, Dict, Deque, List
+from urllib.parse import urlsplit
+
+import requests
+from pydantic import BaseModel, Field
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# path segments holding ids: ObjectId-like hex, uuid, numbers or long tokens with digits
+_ID_SEGMENT = re.compile(r"^(?:[0-9a-fA-F-]{16,}|\d+|(?=.*\d)[\w.-]{20,})$")
+
+
+def endpoint_template(method: str, url: str) -> str:
+    """
+    Endpoint of a call with ids replaced by {id}, e.g. "GET /api/datasets/{id}/result_model"
+    """
+    path = urlsplit(url).path
+    segments = ["{id}" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")]
+    return f"{method.upper()} {'/'.join(segments)}"
+
+
+# Seconds spent in connect() (TCP + TLS) and in the TLS handshake alone by the current thread since the last reset
+_connect_clock = threading.local()
+
+
+def _reset_connect_clock():
+    _connect_clock.elapsed = 0.0
+    _connect_clock.tls = 0.0
+    _connect_clock.opened = 0
+
+
+def _record_connect(started: float):
+    _connect_clock.elapsed = getattr(_connect_clock, "elapsed", 0.0) + time.perf_counter() - started
+    _connect_clock.opened = getattr(_connect_clock, "opened", 0) + 1
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _record_connect(started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        sock = super()._new_conn()
+        # the TLS handshake starts once the TCP connection is up
+        self._tcp_connected = time.perf_counter()
+        return sock
+
+    def connect(self):
+        started = time.perf_counter()
+        self._tcp_connected = None
+        try:
+            super().connect()
+        finally:
+            if self._tcp_connected is not None:
+                _connect_clock.tls = getattr(_connect_clock, "tls", 0.0) + time.perf_counter() - self._tcp_connected
+            _record_connect(started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections report the time spent establishing them
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TimedHTTPConnectionPool,
+                                                   "https": _TimedHTTPSConnectionPool}
+
+
+class TransportConfig(BaseModel):
+    pool_connections: int = Field(10, title='Number of host pools to cache')
+    pool_maxsize: int = Field(10, title='Connections kept alive per host')
+    host_pool_sizes: Dict[str, int] = Field({}, title='Connections per host, keyed by scheme://host[:port]')
+    keep_alive: bool = Field(True, title='Reuse connections between calls')
+    http2: bool = Field(False, title='Use HTTP/2 (requires httpx[http2])')
+    timeout: Optional[float] = Field(None, title='Per-call timeout in seconds')
+    max_timings: int = Field(10000, title='Number of call timings to keep')
+
+
+class CallTiming(BaseModel):
+    method: str = Field(..., title='Method')
+    url: str = Field(..., title='Url')
+    status_code: int = Field(..., title='Status Code')
+    connect: float = Field(..., title='Seconds spent opening connections, 0 for a reused one')
+    tls: float = Field(0, title='Part of connect spent in TLS handshakes')
+    ttfb: float = Field(..., title='Seconds until response headers were received')
+    total: float = Field(..., title='Seconds until the body was read')
+    new_connections: int = Field(0, title='Connections opened by the call')
+
+
+def timing_from_trace(method: str, url: str, status_code: int, marks: Dict[str, float], started: float,
+                      total: float) -> CallTiming:
+    """
+    CallTiming of an httpx call from perf_counter() marks of its trace extension events
+    """
+    connect_started = marks.get("connection.connect_tcp.started")
+    connect_finished = marks.get("connection.start_tls.complete", marks.get("connection.connect_tcp.complete"))
+    connect = connect_finished - connect_started if connect_started and connect_finished else 0.0
+    tls_started, tls_finished = marks.get("connection.start_tls.started"), marks.get("connection.start_tls.complete")
+    headers_received = next((mark for event, mark in marks.items()
+                             if event.endswith("receive_response_headers.complete")), started + total)
+    return CallTiming(method=method.upper(), url=url, status_code=status_code, connect=connect,
+                      tls=tls_finished - tls_started if tls_started and tls_finished else 0.0,
+                      ttfb=headers_received - started, total=total, new_connections=1 if connect_started else 0)
+
+
+class Transport:
+    """
+    Shared HTTP session with connection pooling, keep-alive and per-call timings
+    """
+    def __init__(self, config: TransportConfig = None):
+        self.config = config or TransportConfig()
+        self.timings: Deque[CallTiming] = deque(maxlen=self.config.max_timings)
+        self._lock = threading.Lock()
+        if self.config.http2:
+            self._client = self._create_http2_client()
+            self._session = None
+        else:
+            self._client = None
+            self._session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=self.config.pool_connections,
+                                   pool_maxsize=self.config.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        for host, size in self.config.host_pool_sizes.items():
+            session.mount(host.rstrip("/") + "/", TimedHTTPAdapter(pool_connections=1, pool_maxsize=size))
+        if not self.config.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def _create_http2_client(self):
+        import httpx
+        limits = httpx.Limits(max_connections=max([self.config.pool_maxsize,
+                                                   *self.config.host_pool_sizes.values()]),
+                              max_keepalive_connections=self.config.pool_maxsize if self.config.keep_alive else 0)
+        return httpx.Client(http2=True, limits=limits, timeout=self.config.timeout)
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+        Send a request through the pooled session and record its timing
+        """
+        if self._client is not None:
+            return self._request_http2(method, url, **kwargs)
+        kwargs.setdefault("timeout", self.config.timeout)
+        _reset_connect_clock()
+        started = time.perf_counter()
+        response = self._session.request(method, url, **kwargs)
+        total = time.perf_counter() - started
+        response.timing = CallTiming(method=method.upper(), url=url, status_code=response.status_code,
+                                     connect=_connect_clock.elapsed, tls=_connect_clock.tls,
+                                     ttfb=response.elapsed.total_seconds(), total=total,
+                                     new_connections=_connect_clock.opened)
+        self._record(response.timing)
+        return response
+
+    def _request_http2(self, method: str, url: str, **kwargs):
+        if "allow_redirects" in kwargs:
+            kwargs["follow_redirects"] = kwargs.pop("allow_redirects")
+        if kwargs.get("json") is None:
+            kwargs.pop("json", None)
+        if kwargs.get("data") is not None and not isinstance(kwargs["data"], dict):
+            kwargs["content"] = kwargs.pop("data")
+        marks = {}
+
+        def trace(event_name, info):
+            marks[event_name] = time.perf_counter()
+
+        kwargs.setdefault("extensions", {})["trace"] = trace
+        started = time.perf_counter()
+        response = self._client.request(method, url, **kwargs)
+        total = time.perf_counter() - started
+        response.timing = timing_from_trace(method, url, response.status_code, marks, started, total)
+        self._record(response.timing)
+        return response
+
+    def _record(self, timing: CallTiming):
+        with self._lock:
+            self.timings.append(timing)
+
+    def pop_timings(self) -> List[CallTiming]:
+        """
+        Return recorded timings and start a new recording
+        """
+        with self._lock:
+            timings = list(self.timings)
+            self.timings.clear()
+        return timings
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+        if self._client is not None:
+            self._client.close()
+
+
+_transport: Optional[Transport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport() -> Transport:
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
+
+
+def set_transport(transport: Transport) -> Optional[Transport]:
+    """
+    Replace the shared transport, returns the previous one
+    """
+    global _transport
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
+
+
+def configure_transport(**kwargs) -> Transport:
+    """
+    Create a shared transport from TransportConfig fields, e.g. configure_transport(pool_maxsize=50, http2=True)
+    """
+    previous = set_transport(Transport(TransportConfig(**kwargs)))
+    if previous is not None:
+        previous.close()
+    return get_transport()
@@ -0,0 +1,659 @@
+import argparse
+import bisect
+import json
+import math
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Callable, Iterable, Iterator, Tuple, TYPE_CHECKING
+
+from pydantic import BaseModel, Field
+
+import scoring_api
+from cleanup import cleanup_leftovers
+from datagen import generate_dataset, column_ranges, column_functions
+from models import PostScoringTemplate, RequestTemplateProperty, DesirabilityFunctionTypes
+from scheduler import RequestScheduler, SchedulerConfig, use_scheduler
+
+if TYPE_CHECKING:
+    from stub_server import FaultInjection
+
+OPERATIONS = ("browse", "page", "upload", "template", "score", "delete", "restore")
+MODES = ("open", "closed")
+ARRIVALS = ("poisson", "uniform")
+NAME_PREFIX = "Auto-load"
+DEFAULT_MIX = {"browse": 20, "page": 60, "upload": 3, "template": 3, "score": 6, "delete": 4, "restore": 4}
+
+
+class Stage(BaseModel):
+    duration: float = Field(..., title='Seconds')
+    target: float = Field(..., title='Arrivals per second (open loop) or virtual users (closed loop) at the end, '
+                                     'reached linearly from the target of the previous stage, at once if duration is 0')
+
+
+class WorkloadConfig(BaseModel):
+    mode: str = Field("closed", title='One of MODES: fixed arrival rate (open) or N virtual users (closed)')
+    stages: List[Stage] = Field([Stage(duration=10, target=4)], title='Load schedule')
+    mix: Dict[str, float] = Field(DEFAULT_MIX, title='Relative weights of OPERATIONS')
+    arrivals: str = Field("poisson", title='Open loop arrival process, one of ARRIVALS')
+    max_in_flight: int = Field(64, title='Open loop: calls in flight, later arrivals are dropped and counted')
+    think_time: float = Field(0, title='Closed loop: seconds a virtual user waits between calls')
+    pool: int = Field(3, title='Datasets uploaded before the load starts')
+    rows: int = Field(100, title='Rows of uploaded datasets')
+    columns: int = Field(3, title='Value columns of uploaded datasets')
+    per_page: List[int] = Field([25, 100], title='Page sizes of result_model calls')
+    interval: float = Field(5, title='Seconds between interval records')
+    seed: int = Field(0, title='Seed of operation choice and arrivals')
+
+    def target_at(self, elapsed: float) -> float:
+        previous, start = 0.0, 0.0
+        for stage in self.stages:
+            if elapsed < start + stage.duration:
+                return previous + (stage.target - previous) * (elapsed - start) / stage.duration
+            previous, start = stage.target, start + stage.duration
+        return previous
+
+    @property
+    def duration(self) -> float:
+        return sum(stage.duration for stage in self.stages)
+
+
+def ramp(target: float, ramp_up: float, soak: float) -> List[Stage]:
+    """
+    Stages going from 0 to `target` over ramp_up seconds, then holding it for soak seconds
+    """
+    return [Stage(duration=ramp_up, target=target), Stage(duration=soak, target=target)]
+
+
+def steps(targets: Iterable[float], step: float) -> List[Stage]:
+    """
+    Staircase schedule holding every target for `step` seconds, for finding the throughput knee
+    """
+    return [stage for target in targets for stage in (Stage(duration=0, target=target),
+                                                      Stage(duration=step, target=target))]
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram, buckets are 2^(1/8) (~9%) wide between 0.5 ms and 2 min
+
+    Percentiles are bucket upper bounds capped by the largest recorded value; histograms merge by adding counts.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+    BOUNDS = [0.0005 * 2 ** (index / 8) for index in range(int(8 * math.log2(120 / 0.0005)) + 2)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Non-empty buckets as {upper bound: count}, +Inf for values above the last bound
+        """
+        return {(f"{self.BOUNDS[index]:.6g}" if index < len(self.BOUNDS) else "+Inf"): count
+                for index, count in enumerate(self.counts) if count}
+
+
+class OperationWindow:
+    __slots__ = ("histogram", "errors", "skipped", "dropped")
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors: Dict[str, int] = {}
+        self.skipped = 0
+        self.dropped = 0
+
+    def merge(self, other: "OperationWindow"):
+        self.histogram.merge(other.histogram)
+        for error, count in other.errors.items():
+            self.errors[error] = self.errors.get(error, 0) + count
+        self.skipped += other.skipped
+        self.dropped += other.dropped
+
+
+class OperationSummary(BaseModel):
+    calls: int = Field(0, title='Successful calls')
+    errors: int = Field(0, title='Failed calls')
+    skipped: int = Field(0, title='Calls without a dataset or template to work on')
+    dropped: int = Field(0, title='Open loop arrivals dropped at max_in_flight')
+    rps: float = Field(0, title='Successful calls per second')
+    error_rate: float = Field(0, title='Failed share of calls')
+    p50: float = Field(0, title='Median latency, seconds')
+    p95: float = Field(0, title='95th percentile latency, seconds')
+    p99: float = Field(0, title='99th percentile latency, seconds')
+    max: float = Field(0, title='Largest latency, seconds')
+    mean: float = Field(0, title='Mean latency, seconds')
+    error_types: Dict[str, int] = Field({}, title='Failed calls by exception type')
+
+    @classmethod
+    def from_window(cls, window: OperationWindow, seconds: float) -> "OperationSummary":
+        histogram = window.histogram
+        errors = sum(window.errors.values())
+        calls = histogram.count
+        return cls(calls=calls, errors=errors, skipped=window.skipped, dropped=window.dropped,
+                   rps=calls / seconds if seconds > 0 else 0.0,
+                   error_rate=errors / (calls + errors) if calls + errors else 0.0,
+                   p50=histogram.percentile(50), p95=histogram.percentile(95), p99=histogram.percentile(99),
+                   max=histogram.max, mean=histogram.mean, error_types=dict(window.errors))
+
+
+class IntervalRecord(BaseModel):
+    elapsed: float = Field(..., title='Seconds since the load started, end of the interval')
+    seconds: float = Field(..., title='Interval length')
+    target: float = Field(..., title='Offered arrival rate or active virtual users at the end of the interval')
+    in_flight: int = Field(0, title='Calls in flight at the end of the interval')
+    total: OperationSummary = Field(OperationSummary(), title='All operations')
+    operations: Dict[str, OperationSummary] = Field({}, title='By operation')
+
+
+class WorkloadReport(BaseModel):
+    environment: str = Field(..., title='Loaded host')
+    started_at: str = Field(..., title='Start time, ISO format')
+    config: WorkloadConfig
+    duration: float = Field(0, title='Seconds under load')
+    total: OperationSummary = Field(OperationSummary(), title='All operations')
+    operations: Dict[str, OperationSummary] = Field({}, title='By operation')
+    histograms: Dict[str, Dict[str, int]] = Field({}, title='Latency buckets by operation')
+    intervals: List[IntervalRecord] = Field([], title='Interval records, also streamed to intervals.ndjson')
+    cleanup_errors: List[str] = Field([], title='Datasets the cleanup failed to restore or delete')
+
+    def table(self) -> str:
+        lines = [f"{'operation':<10} {'calls':>8} {'errors':>7} {'skipped':>8} {'rps':>8} {'p50 ms':>9} "
+                 f"{'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name, item in [*self.operations.items(), ("total", self.total)]:
+            lines.append(f"{name:<10} {item.calls:>8} {item.errors:>7} {item.skipped:>8} {item.rps:>8.1f} "
+                         f"{item.p50 * 1000:>9.1f} {item.p95 * 1000:>9.1f} {item.p99 * 1000:>9.1f} "
+                         f"{item.max * 1000:>9.1f}")
+        return "\n".join(lines)
+
+
+def throughput_knee(intervals: Iterable[IntervalRecord], p95_limit: float = 1.0,
+                    min_share: float = 0.95) -> Optional[float]:
+    """
+    Highest offered rate of an open loop run still served: throughput within min_share of it, p95 under p95_limit
+    and no errors; None if no interval qualifies
+    """
+    served = [item.target for item in intervals
+              if item.target > 0 and item.total.calls + item.total.errors + item.total.dropped > 0
+              and item.total.rps >= min_share * item.target and item.total.p95 <= p95_limit and not item.total.errors]
+    return max(served, default=None)
+
+
+class SkipOperation(Exception):
+    """
+    Nothing to work on, e.g. restore without deleted datasets
+    """
+
+
+class WorkloadState:
+    """
+    Datasets, templates and scored datasets created by a workload, shared by its virtual users
+
+    Calls working on a dataset hold it with using(), delete only takes datasets nobody holds, so the workload
+    doesn't fail its own calls with 404s.
+    """
+    def __init__(self, directory: Path, prefix: str, rows: int, columns: int):
+        self.prefix = prefix
+        self.rows = rows
+        self.columns = columns
+        self.file = generate_dataset(directory / f"load_{rows}_{columns}.csv", rows, columns,
+                                     parameters_in_every_row=False)
+        self.datasets: List[str] = []
+        self.deleted: List[str] = []
+        self.templates: Dict[str, List[str]] = {}
+        self.scored: set = set()
+        self._held: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def using(self, rng: random.Random, scorable: bool = False) -> Iterator[str]:
+        """
+        Random live dataset (with a template if scorable) held for the duration of the block
+        """
+        with self._lock:
+            candidates = [item for item in self.datasets if self.templates.get(item)] if scorable else self.datasets
+            if not candidates:
+                raise SkipOperation()
+            dataset_id = rng.choice(candidates)
+            self._held[dataset_id] = self._held.get(dataset_id, 0) + 1
+        try:
+            yield dataset_id
+        finally:
+            with self._lock:
+                self._held[dataset_id] -= 1
+                if not self._held[dataset_id]:
+                    del self._held[dataset_id]
+
+    def upload(self) -> str:
+        dataset_id = scoring_api.upload_dataset(f"{self.prefix}-{uuid.uuid4()}.csv", self.file).result.dataset_id
+        with self._lock:
+            self.datasets.append(dataset_id)
+        return dataset_id
+
+    def template(self, rng: random.Random) -> str:
+        with self.using(rng) as dataset_id:
+            request = PostScoringTemplate(name=f"{self.prefix}-{uuid.uuid4().hex[:8]}", dataset_id=dataset_id)
+            template_id = scoring_api.scoring_template_post(request, expected_code=201).created_id
+            column = rng.randrange(self.columns)
+            center, spread = column_ranges(self.columns)[column]
+            function = column_functions(center, spread)[rng.choice(list(DesirabilityFunctionTypes))]
+            template_property = RequestTemplateProperty(column_name=f"Column_{column + 1}",
+                                                        enabled_for_scoring=True, importance=1,
+                                                        desirability_function=function)
+            scoring_api.scoring_template_properties_post(template_property, template_id, expected_code=201)
+            with self._lock:
+                self.templates.setdefault(dataset_id, []).append(template_id)
+        return template_id
+
+    def score(self, rng: random.Random) -> str:
+        with self.using(rng, scorable=True) as dataset_id:
+            with self._lock:
+                template_id = rng.choice(self.templates[dataset_id])
+            scored_dataset_id = scoring_api.scored_dataset_post(dataset_id, template_id,
+                                                                expected_code=201).created_id
+            with self._lock:
+                self.scored.add(dataset_id)
+        return scored_dataset_id
+
+    def page(self, rng: random.Random, per_page: List[int]):
+        with self.using(rng) as dataset_id:
+            size = rng.choice(per_page)
+            sorts = [None, *(f"Column_{index}" for index in range(1, self.columns + 1))]
+            if dataset_id in self.scored:
+                sorts.append("Scored_column")
+            return scoring_api.get_dataset_result_model(dataset_id, page=rng.randint(1, max(1, -(-self.rows // size))),
+                                                        per_page=size, sort=rng.choice(sorts),
+                                                        order=rng.choice(["asc", "desc"]))
+
+    def delete(self, rng: random.Random):
+        with self._lock:
+            idle = [item for item in self.datasets if item not in self._held]
+            # keep one dataset to page through
+            if len(self.datasets) < 2 or not idle:
+                raise SkipOperation()
+            dataset_id = rng.choice(idle)
+            self.datasets.remove(dataset_id)
+        try:
+            scoring_api.delete_dataset(dataset_id, expected_code=204)
+        except BaseException:
+            with self._lock:
+                self.datasets.append(dataset_id)
+            raise
+        with self._lock:
+            self.deleted.append(dataset_id)
+
+    def restore(self, rng: random.Random):
+        with self._lock:
+            if not self.deleted:
+                raise SkipOperation()
+            dataset_id = self.deleted.pop(rng.randrange(len(self.deleted)))
+        try:
+            scoring_api.restore_dataset(dataset_id, expected_code=200)
+        except BaseException:
+            with self._lock:
+                self.deleted.append(dataset_id)
+            raise
+        with self._lock:
+            self.datasets.append(dataset_id)
+
+
+class Workload:
+    """
+    Drives a mix of scoring_api operations by a load schedule and streams interval records to disk
+
+    Closed loop: up to max(stage targets) virtual users, the first target(t) of them call operations back to back.
+    Open loop: calls arrive at target(t) per second whether or not earlier ones finished; latency is measured
+    from the planned arrival, so a slow backend shows up as latency instead of a lower arrival rate.
+    Every `interval` seconds a record of that interval is appended to <output>/intervals.ndjson,
+    failed calls go to <output>/errors.ndjson.
+    Calls go through `scheduler`, by default one without retries and circuit breakers: every operation is
+    measured as one call, retries and open circuits would hide the failures.
+    """
+    def __init__(self, config: WorkloadConfig, state: WorkloadState, output: Path = None,
+                 clock: Callable[[], float] = time.monotonic, scheduler: RequestScheduler = None):
+        assert config.mode in MODES, f"Unknown mode {config.mode}, use one of {MODES}"
+        assert config.arrivals in ARRIVALS, f"Unknown arrivals {config.arrivals}, use one of {ARRIVALS}"
+        unknown = set(config.mix) - set(OPERATIONS)
+        assert not unknown, f"Unknown operations {unknown}, use {OPERATIONS}"
+        self.config = config
+        self.state = state
+        self.output = Path(output) if output is not None else None
+        self.clock = clock
+        self.scheduler = scheduler or RequestScheduler(SchedulerConfig(max_retries=0, failure_threshold=0))
+        self.operations = [name for name in OPERATIONS if config.mix.get(name, 0) > 0]
+        self.weights = [config.mix[name] for name in self.operations]
+        self._window: Dict[str, OperationWindow] = {}
+        self._totals: Dict[str, OperationWindow] = {}
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._started = 0.0
+        self._stop = threading.Event()
+        self._errors_file = None
+        self.intervals: List[IntervalRecord] = []
+
+    def _call(self, name: str, rng: random.Random):
+        state = self.state
+        if name == "browse":
+            return scoring_api.get_datasets_list()
+        if name == "page":
+            return state.page(rng, self.config.per_page)
+        if name == "upload":
+            return state.upload()
+        if name == "template":
+            return state.template(rng)
+        if name == "score":
+            return state.score(rng)
+        if name == "delete":
+            return state.delete(rng)
+        if name == "restore":
+            return state.restore(rng)
+        raise ValueError(f"Unknown operation {name}")
+
+    def _operation_window(self, name: str) -> OperationWindow:
+        window = self._window.get(name)
+        if window is None:
+            window = self._window[name] = OperationWindow()
+        return window
+
+    def run_one(self, rng: random.Random, planned: float = None):
+        """
+        One call of an operation chosen by the mix, latency counted from `planned` if given
+        """
+        name = rng.choices(self.operations, self.weights)[0]
+        started = planned if planned is not None else self.clock()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            with use_scheduler(self.scheduler):
+                self._call(name, rng)
+        except SkipOperation:
+            with self._lock:
+                self._operation_window(name).skipped += 1
+        except Exception as error:
+            with self._lock:
+                errors = self._operation_window(name).errors
+                errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+                if self._errors_file is not None:
+                    self._errors_file.write(json.dumps({"elapsed": round(self.clock() - self._started, 3),
+                                                        "operation": name, "error": repr(error)[:1000]}) + "\n")
+        else:
+            elapsed = self.clock() - started
+            with self._lock:
+                self._operation_window(name).histogram.record(elapsed)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _flush(self, seconds: float) -> IntervalRecord:
+        with self._lock:
+            window, self._window = self._window, {}
+            in_flight = self._in_flight
+        elapsed = self.clock() - self._started
+        total = OperationWindow()
+        for name, item in window.items():
+            total.merge(item)
+            self._totals.setdefault(name, OperationWindow()).merge(item)
+        record = IntervalRecord(elapsed=elapsed, seconds=seconds, target=self.config.target_at(elapsed),
+                                in_flight=in_flight, total=OperationSummary.from_window(total, seconds),
+                                operations={name: OperationSummary.from_window(item, seconds)
+                                            for name, item in sorted(window.items())})
+        self.intervals.append(record)
+        if self.output is not None:
+            with open(self.output / "intervals.ndjson", "a") as file:
+                file.write(record.json() + "\n")
+        return record
+
+    def _report(self):
+        last = self._started
+        while not self._stop.wait(max(0.0, last + self.config.interval - self.clock())):
+            now = self.clock()
+            self._flush(now - last)
+            last = now
+        self._flush(self.clock() - last)
+
+    def _closed_loop(self):
+        users = max(1, math.ceil(max(stage.target for stage in self.config.stages)))
+
+        def user(index: int):
+            rng = random.Random(self.config.seed * 100003 + index)
+            while not self._stop.is_set():
+                if index >= self.config.target_at(self.clock() - self._started):
+                    self._stop.wait(0.05)
+                    continue
+                self.run_one(rng)
+                if self.config.think_time:
+                    self._stop.wait(self.config.think_time)
+
+        with ThreadPoolExecutor(max_workers=users, thread_name_prefix="workload-user") as executor:
+            futures = [executor.submit(user, index) for index in range(users)]
+            self._stop.wait(self.config.duration)
+            self._stop.set()
+            for future in futures:
+                future.result()
+
+    def _next_arrival(self, rng: random.Random, previous: float, end: float, step: float = 0.05) -> float:
+        """
+        Time the integral of target(t) from `previous` reaches an Exp(1) draw (poisson) or 1 (uniform),
+        integrated in steps so that ramps are followed
+        """
+        remaining = rng.expovariate(1) if self.config.arrivals == "poisson" else 1.0
+        planned = previous
+        while planned < end:
+            rate = self.config.target_at(planned - self._started)
+            if rate > 0 and remaining <= rate * step:
+                return planned + remaining / rate
+            remaining -= rate * step
+            planned += step
+        return end
+
+    def _open_loop(self):
+        rng = random.Random(self.config.seed)
+        slots = threading.BoundedSemaphore(self.config.max_in_flight)
+        planned = self.clock()
+        end = self._started + self.config.duration
+
+        def call(call_rng: random.Random, arrival: float):
+            try:
+                self.run_one(call_rng, arrival)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.config.max_in_flight, thread_name_prefix="workload-call") as executor:
+            while True:
+                planned = self._next_arrival(rng, planned, end)
+                if planned >= end or (planned > self.clock() and self._stop.wait(planned - self.clock())):
+                    break
+                call_rng = random.Random(rng.getrandbits(64))
+                if not slots.acquire(blocking=False):
+                    name = call_rng.choices(self.operations, self.weights)[0]
+                    with self._lock:
+                        self._operation_window(name).dropped += 1
+                    continue
+                executor.submit(call, call_rng, planned)
+        self._stop.set()
+
+    def run(self) -> List[IntervalRecord]:
+        if self.output is not None:
+            self.output.mkdir(parents=True, exist_ok=True)
+            self._errors_file = open(self.output / "errors.ndjson", "a", buffering=1)
+        self._stop.clear()
+        self._started = self.clock()
+        reporter = threading.Thread(target=self._report, name="workload-report", daemon=True)
+        reporter.start()
+        try:
+            if self.config.mode == "closed":
+                self._closed_loop()
+            else:
+                self._open_loop()
+        finally:
+            self._stop.set()
+            reporter.join()
+            if self._errors_file is not None:
+                self._errors_file.close()
+                self._errors_file = None
+        return self.intervals
+
+    def summary(self) -> Tuple[OperationSummary, Dict[str, OperationSummary], Dict[str, Dict[str, int]]]:
+        seconds = self.intervals[-1].elapsed if self.intervals else 0.0
+        total = OperationWindow()
+        for item in self._totals.values():
+            total.merge(item)
+        return (OperationSummary.from_window(total, seconds),
+                {name: OperationSummary.from_window(item, seconds) for name, item in sorted(self._totals.items())},
+                {name: item.histogram.to_dict() for name, item in sorted(self._totals.items())})
+
+
+def cleanup_workload(state: WorkloadState) -> List[str]:
+    """
+    Restore the datasets deleted by the workload and delete everything named after its prefix
+
+    A failure doesn't stop the rest of the cleanup, the datasets left behind are returned with their errors.
+    """
+    errors = []
+    for dataset_id in list(state.deleted):
+        try:
+            scoring_api.restore_dataset(dataset_id, expected_code=200)
+        except Exception as error:
+            errors.append(f"restore {dataset_id}: {error!r}"[:1000])
+    try:
+        report = cleanup_leftovers(prefix=state.prefix)
+    except Exception as error:
+        errors.append(f"cleanup {state.prefix}: {error!r}"[:1000])
+    else:
+        errors += [f"delete {item.leftover.kind} {item.leftover.id}: {item.error or item.status_code}"
+                   for item in report.failed]
+    return errors
+
+
+def run_workload(config: WorkloadConfig, output: Path = None, stub: bool = False,
+                 faults: "FaultInjection" = None, cleanup: bool = True) -> WorkloadReport:
+    """
+    Upload the dataset pool, run the schedule, then delete everything the run created (named Auto-load-<run>-...)
+
+    The schedule runs through a scheduler of its own (see Workload), other threads of the process keep the shared
+    one. Datasets the cleanup left behind are listed in the report's cleanup_errors.
+
+    stub: run against an in-process stub backend, with latency and failures of `faults`
+    The report is also saved to <output>/summary.json.
+    """
+    server = None
+    if stub:
+        from stub_server import StubServer, StubBackend
+        server = StubServer(backend=StubBackend(faults=faults)).start()
+        previous_environment = scoring_api.set_environment(server.url)
+    prefix = f"{NAME_PREFIX}-{uuid.uuid4().hex[:8]}"
+    report = WorkloadReport(environment=scoring_api.ENV, started_at=datetime.now().isoformat(), config=config)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            state = WorkloadState(Path(directory), prefix, config.rows, config.columns)
+            try:
+                for _ in range(config.pool):
+                    state.upload()
+                workload = Workload(config, state, output)
+                report.intervals = workload.run()
+                report.total, report.operations, report.histograms = workload.summary()
+                report.duration = report.intervals[-1].elapsed if report.intervals else 0.0
+            finally:
+                if cleanup and not stub:
+                    report.cleanup_errors = cleanup_workload(state)
+    finally:
+        if server is not None:
+            scoring_api.set_environment(previous_environment)
+            server.stop()
+    if output is not None:
+        (Path(output) / "summary.json").write_text(report.json(indent=2, exclude={"intervals"}))
+    return report
+
+
+def _stage(value: str) -> Stage:
+    duration, target = value.split(":")
+    return Stage(duration=float(duration), target=float(target))
+
+
+def _weight(value: str) -> Tuple[str, float]:
+    name, weight = value.split("=")
+    assert name in OPERATIONS, f"Unknown operation {name}, use one of {OPERATIONS}"
+    return name, float(weight)
+
+
+def main(arguments: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Mixed-traffic load, soak and capacity runs against the Scoring API")
+    parser.add_argument("--mode", choices=MODES, default="closed")
+    parser.add_argument("--target", type=float, default=4, help="arrivals per second (open) or virtual users (closed)")
+    parser.add_argument("--ramp-up", type=float, default=0, help="seconds to reach --target")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to hold --target after the ramp-up")
+    parser.add_argument("--stage", type=_stage, action="append", help="DURATION:TARGET, replaces the options above")
+    parser.add_argument("--steps", type=float, nargs="+", help="staircase of targets, each held for --duration")
+    parser.add_argument("--mix", type=_weight, nargs="+", help="OPERATION=WEIGHT, e.g. page=60 browse=20")
+    parser.add_argument("--arrivals", choices=ARRIVALS, default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument("--think-time", type=float, default=0)
+    parser.add_argument("--pool", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=100)
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub", action="store_true", help="run against an in-process stub backend")
+    parser.add_argument("--p95-limit", type=float, default=1.0, help="seconds, for the throughput knee of --steps")
+    parser.add_argument("--output", type=Path, help="directory of intervals.ndjson, errors.ndjson and summary.json")
+    options = parser.parse_args(arguments)
+
+    if options.stage:
+        stages = options.stage
+    elif options.steps:
+        stages = steps(options.steps, options.duration)
+    else:
+        stages = ramp(options.target, options.ramp_up, options.duration)
+    config = WorkloadConfig(mode=options.mode, stages=stages, mix=dict(options.mix) if options.mix else DEFAULT_MIX,
+                            arrivals=options.arrivals, max_in_flight=options.max_in_flight,
+                            think_time=options.think_time, pool=options.pool, rows=options.rows,
+                            columns=options.columns, interval=options.interval, seed=options.seed)
+    report = run_workload(config, options.output, stub=options.stub)
+    print(report.table())
+    if options.mode == "open" and options.steps:
+        knee = throughput_knee(report.intervals, options.p95_limit)
+        print(f"throughput knee: {knee} calls/s" if knee is not None else "no offered rate was served")
+    for error in report.cleanup_errors:
+        print(f"cleanup failed: {error}")
+    return 1 if report.total.errors or report.cleanup_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())